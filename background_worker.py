@@ -0,0 +1,165 @@
+import queue
+import threading
+import time
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, worker, description, func, on_done, on_error, cancellable):
+        self.worker = worker
+        self.description = description
+        self.func = func
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancellable = cancellable
+        self.cancel_event = threading.Event()
+        self.started = None
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check_cancelled(self):
+        # Called by the job function between steps that are safe to stop at
+        if self.cancelled:
+            raise JobCancelled()
+
+    def post(self, func, *args):
+        # Run func(*args) on the Tk thread, e.g. to merge a partial result
+        self.worker.results.put(('call', self, (func, args)))
+
+    def progress(self, text):
+        # Safe to call from the worker thread, shown on the next poll
+        self.worker.results.put(('progress', self, text))
+
+
+class BackgroundWorker:
+    # Runs blocking calls on one worker thread, in submission order. Results are
+    # handed back to the Tk thread by polling with root.after, so callbacks and
+    # on_status may freely touch widgets.
+    def __init__(self, root, on_status=None, poll_ms=100):
+        self.root = root
+        self.on_status = on_status
+        self.poll_ms = poll_ms
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.pending = []
+        self.current = None
+        self.current_text = ''
+        self.polling = False
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, description, func, on_done=None, on_error=None, cancellable=True):
+        # func(job) runs on the worker thread; on_done(result) / on_error(exc)
+        # run on the Tk thread
+        job = Job(self, description, func, on_done, on_error, cancellable)
+        self.pending.append(job)
+        self.requests.put(job)
+        self.start_polling()
+        self.report()
+        return job
+
+    @property
+    def busy(self):
+        return bool(self.pending)
+
+    def cancel(self):
+        cancelled = 0
+        for job in self.pending:
+            if job.cancellable and not job.cancelled:
+                job.cancel_event.set()
+                cancelled += 1
+        self.report()
+        return cancelled
+
+    def run(self):
+        while True:
+            job = self.requests.get()
+            if job.cancelled:
+                self.results.put(('cancelled', job, None))
+                continue
+
+            self.results.put(('started', job, None))
+            try:
+                result = job.func(job)
+            except JobCancelled:
+                self.results.put(('cancelled', job, None))
+            except Exception as e:
+                self.results.put(('error', job, e))
+            else:
+                self.results.put(('done', job, result))
+
+    def start_polling(self):
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.poll_ms, self.poll)
+
+    def poll(self):
+        while True:
+            try:
+                kind, job, value = self.results.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == 'started':
+                self.current = job
+                self.current_text = ''
+                job.started = time.monotonic()
+            elif kind == 'progress':
+                self.current_text = value
+            elif kind == 'call':
+                func, args = value
+                func(*args)
+            else:
+                self.finish(kind, job, value)
+
+        self.report()
+        if self.pending:
+            self.root.after(self.poll_ms, self.poll)
+        else:
+            self.polling = False
+
+    def finish(self, kind, job, value):
+        if job in self.pending:
+            self.pending.remove(job)
+        if self.current is job:
+            self.current = None
+            self.current_text = ''
+        if self.on_status:
+            self.on_status('', False)
+
+        # A result that arrives after cancel was requested is dropped, unless
+        # the job could not be stopped anyway
+        if kind == 'done' and not job.cancelled:
+            if job.on_done:
+                job.on_done(value)
+        elif kind == 'error':
+            if job.on_error:
+                job.on_error(value)
+        elif self.on_status:
+            self.on_status(f"{job.description} cancelled", False)
+
+    def report(self):
+        if not self.on_status or not self.pending:
+            return
+
+        job = self.current or self.pending[0]
+        if job.cancelled:
+            text = f"Cancelling {job.description.lower()}..."
+        elif job.started is None:
+            text = f"{job.description} (waiting)..."
+        else:
+            elapsed = time.monotonic() - job.started
+            text = f"{job.description}..."
+            if self.current_text:
+                text += f" {self.current_text}"
+            text += f" ({elapsed:.0f}s)"
+        queued = len(self.pending) - 1
+        if queued:
+            text += f" [{queued} more queued]"
+        self.on_status(text, True)
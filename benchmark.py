@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+# Times the storage, sync and UI-refresh hot paths of uiWireBonder.py on a
+# synthetic dataset, against an in-process fake worksheet and a hidden Tk root.
+#
+#   python3 benchmark.py --modules 2000 --history 20 --params 30 --output bench.json
+#   python3 benchmark.py --compare bench.json      # compare with an earlier run
+#
+# Needs a display for Tk; on a headless station run it under xvfb-run.
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tkinter as tk
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+from fake_sheet import FakeWorksheet
+from module_store import ModuleStore
+from sheet_schema import SYNC_COLUMNS, SheetSchema, make_origin
+from sheet_sync import entry_row
+
+
+def generate_dataset(n_modules, n_history, n_params, seed=0):
+    # module_params in the plain JSON shape written by older versions, with
+    # every entry stamped as saved by one other station
+    rng = random.Random(seed)
+    parameters = [f"param_{i}" for i in range(n_params)]
+    start = datetime(2024, 1, 1)
+    module_params = {}
+    for m in range(n_modules):
+        values = [f"{rng.uniform(0, 100):.2f}" for _ in parameters]
+        history = []
+        moment = start + timedelta(minutes=m)
+        for h in range(n_history):
+            values = list(values)
+            # A save usually touches only a few fields
+            for column in rng.sample(range(n_params), min(3, n_params)):
+                values[column] = f"{rng.uniform(0, 100):.2f}"
+            moment += timedelta(hours=rng.randint(1, 48))
+            history.append({'timestamp': moment.strftime("%Y-%m-%d %H:%M:%S"),
+                            'parameters': values,
+                            'origin': make_origin('bench', m * n_history + h + 1),
+                            'base': history[-1]['origin'] if history else ''})
+        module_params[f"M{m:06d}"] = {
+            'parameters': history[-1]['parameters'] if history else values,
+            'created': history[0]['timestamp'] if history else '',
+            'modified': history[-1]['timestamp'] if history else '',
+            'history': history
+        }
+    return parameters, module_params
+
+
+def summarize(durations):
+    return {
+        'runs': len(durations),
+        'total_s': sum(durations),
+        'mean_s': statistics.mean(durations),
+        'median_s': statistics.median(durations),
+        'min_s': min(durations),
+        'max_s': max(durations)
+    }
+
+
+def timed(func, repeat):
+    durations = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        durations.append(time.perf_counter() - start)
+    return summarize(durations)
+
+
+def pump(root, condition, timeout=600):
+    # Run the Tk event loop until condition() is true
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("benchmark step did not finish")
+        root.update()
+        time.sleep(0.001)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    from uiWireBonder import ModuleTrackingGUI
+
+    parameters, module_params = generate_dataset(args.modules, args.history, args.params, args.seed)
+    module_ids = list(module_params)
+    rng = random.Random(args.seed)
+    results = {}
+
+    workdir = tempfile.mkdtemp(prefix='uiWireBonder-bench-')
+    os.chdir(workdir)
+    with open('module_params.json', 'w') as f:
+        json.dump(module_params, f)
+
+    results['store_load'] = timed(lambda i: ModuleStore('module_params.json').load(), args.repeat)
+
+    # The sheet already holds everything in the dataset, in the rows the
+    # outbox would have appended
+    schema = SheetSchema(['Timestamp', 'Module ID'] + parameters + list(SYNC_COLUMNS))
+    sheet_rows = [entry_row(schema, module_id, history_entry)
+                  for module_id, module_data in ModuleStore('module_params.json').load().items()
+                  for history_entry in module_data['history'].entries()]
+    sheet_rows.sort(key=lambda row: row[0])
+    sheet = FakeWorksheet(schema.header, sheet_rows, latency=args.latency)
+
+    root = tk.Tk()
+    root.withdraw()
+    app = ModuleTrackingGUI(root, fast_start=False, sheet=sheet)
+    # Saved, since pending_rows() re-reads sync_state.json
+    app.sync_state.commit({module_id: len(module_data['history'])
+                           for module_id, module_data in app.module_params.items()})
+
+    def select(i):
+        app.module_id_var.set(rng.choice(module_ids))
+        app.on_module_select(None)
+    results['on_module_select'] = timed(select, args.repeat)
+
+    results['update_history_display'] = timed(lambda i: app.update_history_display(), args.repeat)
+
+    def save(i):
+        for entry in list(app.param_entries.values())[:3]:
+            entry.delete(0, tk.END)
+            entry.insert(0, f"{rng.uniform(0, 100):.2f}")
+        app.save_parameters()
+    saves = []
+    for i in range(args.repeat):
+        select(i)
+        saves.append(timed(save, 1)['total_s'])
+    results['save_parameters'] = summarize(saves)
+
+    def submit(i):
+        app.submit_all_to_sheet()
+        pump(root, lambda: len(app.outbox) == 0)
+    results['submit_all_to_sheet'] = timed(submit, 1)
+
+    # Another station's rows show up on the sheet before each read
+    def read(i):
+        count = args.modules // 10 + 1
+        extra = [schema.row(f"2030-01-01 00:{i:02d}:{k % 60:02d}", rng.choice(module_ids),
+                            [str(k)] * len(parameters), make_origin('bench-2', i * count + k + 1))
+                 for k in range(count)]
+        sheet.values.extend(extra)
+        app.read_all_from_sheet()
+        pump(root, lambda: not app.sheets_worker.busy)
+    results['read_all_from_sheet'] = timed(read, min(args.repeat, 60))
+
+    app.flusher.stop()
+    root.destroy()
+
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform()
+        },
+        'dataset': {
+            'modules': args.modules,
+            'history': args.history,
+            'params': args.params,
+            'latency_s': args.latency,
+            'seed': args.seed,
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+
+
+def compare(current, previous_path):
+    with open(previous_path, 'r') as f:
+        previous = json.load(f)
+    print(f"{'path':<26}{'before':>12}{'after':>12}{'ratio':>8}")
+    for name, result in current['results'].items():
+        before = previous['results'].get(name)
+        if before is None:
+            continue
+        ratio = result['median_s'] / before['median_s'] if before['median_s'] else float('inf')
+        print(f"{name:<26}{before['median_s']:>12.6f}{result['median_s']:>12.6f}{ratio:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark uiWireBonder hot paths")
+    parser.add_argument('--modules', type=int, default=1000)
+    parser.add_argument('--history', type=int, default=20)
+    parser.add_argument('--params', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added to every fake sheet call")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--compare', metavar='PREVIOUS_JSON')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    previous = os.path.abspath(args.compare) if args.compare else None
+    try:
+        report = run(args)
+    except tk.TclError as e:
+        print(f"Could not create a Tk root ({e}); run under xvfb-run", file=sys.stderr)
+        sys.exit(2)
+
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+    if previous:
+        compare(report, previous)
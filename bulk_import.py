@@ -0,0 +1,108 @@
+import csv
+
+from sheet_schema import SYNC_COLUMNS
+
+# Header names accepted for the module id column, compared without case/spaces
+MODULE_ID_NAMES = ('moduleid', 'module')
+IGNORED_COLUMNS = ('timestamp',) + tuple(name.lower() for name in SYNC_COLUMNS)
+
+
+def normalize(name):
+    return ''.join(name.split()).replace('_', '').lower()
+
+
+def sniff_delimiter(path, sample):
+    if path.lower().endswith(('.tsv', '.tab')):
+        return '\t'
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=',;\t').delimiter
+    except csv.Error:
+        return ','
+
+
+class BulkImport:
+    # Reads a CSV/TSV of module ids and parameter values and checks it against
+    # the sheet schema. Rows with problems are collected in `errors` as
+    # (line, message) and left out; every other row ends up in `rows` as
+    # (module_id, values in sheet parameter order). Empty cells keep the
+    # module's current value.
+    def __init__(self, schema, module_params):
+        self.schema = schema
+        self.module_params = module_params
+        self.rows = []
+        self.errors = []
+        self.unchanged = 0
+        self.new_modules = 0
+
+    def read(self, path):
+        with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+            delimiter = sniff_delimiter(path, f.read(4096))
+            f.seek(0)
+            self.read_rows(csv.reader(f, delimiter=delimiter))
+        return self
+
+    def read_rows(self, reader):
+        header = next(reader, None)
+        if not header:
+            self.errors.append((1, "File is empty"))
+            return
+
+        module_column = None
+        columns = {}
+        parameter_positions = {normalize(name): i for i, name in enumerate(self.schema.parameters)}
+        for column, name in enumerate(header):
+            key = normalize(name)
+            if key in MODULE_ID_NAMES and module_column is None:
+                module_column = column
+            elif key in parameter_positions:
+                columns[column] = parameter_positions[key]
+            elif key and key not in IGNORED_COLUMNS:
+                self.errors.append((1, f"Unknown column '{name}' ignored"))
+        if module_column is None:
+            self.errors.append((1, "No 'Module ID' column"))
+            return
+        if not columns:
+            self.errors.append((1, "No column matches a sheet parameter"))
+            return
+
+        seen = set()
+        for line, row in enumerate(reader, 2):
+            if not any(cell.strip() for cell in row):
+                continue
+            if len(row) > len(header):
+                self.errors.append((line, f"{len(row)} fields, header has {len(header)}"))
+                continue
+            module_id = row[module_column].strip() if module_column < len(row) else ''
+            if not module_id:
+                self.errors.append((line, "Missing Module ID"))
+                continue
+            if module_id in seen:
+                self.errors.append((line, f"Module {module_id} appears more than once"))
+                continue
+            seen.add(module_id)
+
+            module_data = self.module_params.get(module_id)
+            if module_data is None:
+                current = [''] * len(self.schema.parameters)
+                self.new_modules += 1
+            else:
+                current = self.schema.from_storage(module_data['history'].latest
+                                                   if module_data['history']
+                                                   else module_data['parameters'])
+            values = list(current)
+            for column, position in columns.items():
+                if column < len(row) and row[column].strip():
+                    values[position] = row[column].strip()
+
+            if module_data is not None and module_data['history'] and values == current:
+                self.unchanged += 1
+                continue
+            self.rows.append((module_id, values))
+
+    def summary(self):
+        text = f"{len(self.rows)} modules to save ({self.new_modules} new)"
+        if self.unchanged:
+            text += f", {self.unchanged} unchanged"
+        if self.errors:
+            text += f", {len(self.errors)} problems"
+        return text
@@ -0,0 +1,212 @@
+import re
+import threading
+import time
+
+
+class RateLimitError(Exception):
+    # Looks like the gspread APIError the Sheets API gives for a 429
+    code = 429
+
+    def __init__(self):
+        super().__init__("Quota exceeded for quota metric 'Read requests'")
+
+
+class FakeWorksheet:
+    # In-process stand-in for the parts of gspread.Worksheet this project uses.
+    # latency is added to every call; set offline to make calls fail like a
+    # dropped connection.
+    def __init__(self, header=None, rows=None, title='Sheet1', latency=0.0, id=0):
+        self.title = title
+        self.id = id
+        self.latency = latency
+        self.offline = False
+        # Set by FakeSpreadsheet when the worksheet is protected; writes then
+        # fail, like they would for an operator editing an archived partition
+        self.protected = False
+        self.fail_next = 0
+        # Number of upcoming calls answered with a 429 "quota exceeded"
+        self.rate_limit_next = 0
+        self.calls = []
+        self.lock = threading.Lock()
+        self.values = []
+        if header is not None:
+            self.values.append(list(header))
+        for row in rows or []:
+            self.values.append(list(row))
+
+    def call(self, name):
+        self.calls.append(name)
+        if self.latency:
+            time.sleep(self.latency)
+        if self.offline:
+            raise ConnectionError("Fake worksheet is offline")
+        if self.rate_limit_next:
+            self.rate_limit_next -= 1
+            raise RateLimitError()
+        if self.fail_next:
+            self.fail_next -= 1
+            raise ConnectionError("Fake worksheet request failed")
+
+    def check_writable(self):
+        if self.protected:
+            raise PermissionError(f"Worksheet '{self.title}' is protected")
+
+    @property
+    def row_count(self):
+        return len(self.values)
+
+    @property
+    def col_count(self):
+        with self.lock:
+            return max((len(row) for row in self.values), default=0)
+
+    def row_values(self, row):
+        self.call('row_values')
+        with self.lock:
+            if row > len(self.values):
+                return []
+            return list(self.values[row - 1])
+
+    def get_all_values(self):
+        self.call('get_all_values')
+        with self.lock:
+            return [list(row) for row in self.values]
+
+    def get(self, range_name=None, **kwargs):
+        # Only whole-row ranges ("2:1001") are supported
+        self.call('get')
+        with self.lock:
+            if range_name is None:
+                return [list(row) for row in self.values]
+            start, end = range_name.split(':')
+            return [list(row) for row in self.values[int(start) - 1:int(end)]]
+
+    def batch_get(self, ranges, **kwargs):
+        self.call('batch_get')
+        with self.lock:
+            pages = []
+            for range_name in ranges:
+                start, end = range_name.split(':')
+                pages.append([list(row) for row in self.values[int(start) - 1:int(end)]])
+            return pages
+
+    def append_row(self, values, **kwargs):
+        self.call('append_row')
+        self.check_writable()
+        with self.lock:
+            self.values.append([str(value) for value in values])
+
+    def append_rows(self, values, **kwargs):
+        self.call('append_rows')
+        self.check_writable()
+        with self.lock:
+            for row in values:
+                self.values.append([str(value) for value in row])
+
+    def update(self, range_name=None, values=None, **kwargs):
+        self.call('update')
+        self.check_writable()
+        self.write(range_name, values)
+
+    def write(self, range_name, values):
+        # Only single-cell anchors ("A1", "C5") are supported
+        match = re.fullmatch(r'([A-Z]+)(\d+)', range_name or 'A1')
+        column = 0
+        for letter in match.group(1):
+            column = column * 26 + ord(letter) - ord('A') + 1
+        column -= 1
+        first_row = int(match.group(2)) - 1
+        with self.lock:
+            for offset, new_values in enumerate(values):
+                while len(self.values) <= first_row + offset:
+                    self.values.append([])
+                cells = self.values[first_row + offset]
+                needed = column + len(new_values)
+                if len(cells) < needed:
+                    cells.extend([''] * (needed - len(cells)))
+                cells[column:needed] = [str(value) for value in new_values]
+
+    def batch_update(self, data, **kwargs):
+        self.call('batch_update')
+        self.check_writable()
+        for update in data:
+            self.write(update['range'], update['values'])
+
+    def add_cols(self, cols):
+        self.call('add_cols')
+        self.check_writable()
+
+    def resize(self, rows=None, cols=None):
+        self.call('resize')
+        self.check_writable()
+        with self.lock:
+            if rows is not None:
+                del self.values[rows:]
+
+    def clear(self):
+        self.call('clear')
+        self.check_writable()
+        with self.lock:
+            self.values = []
+
+
+class FakeSpreadsheet:
+    # In-process stand-in for a gspread.Spreadsheet holding several worksheets.
+    # Setting offline takes every worksheet offline with it.
+    def __init__(self, header=None, rows=None, title='uiWireBonder', latency=0.0):
+        self.title = title
+        self.latency = latency
+        self.calls = []
+        self.offline_flag = False
+        self.sheets = [FakeWorksheet(header, rows, latency=latency)]
+
+    @property
+    def offline(self):
+        return self.offline_flag
+
+    @offline.setter
+    def offline(self, value):
+        self.offline_flag = value
+        for sheet in self.sheets:
+            sheet.offline = value
+
+    @property
+    def sheet1(self):
+        return self.sheets[0]
+
+    def call(self, name):
+        self.calls.append(name)
+        if self.latency:
+            time.sleep(self.latency)
+        if self.offline_flag:
+            raise ConnectionError("Fake spreadsheet is offline")
+
+    def worksheets(self, exclude_hidden=False):
+        self.call('worksheets')
+        return list(self.sheets)
+
+    def worksheet(self, title):
+        self.call('worksheet')
+        for sheet in self.sheets:
+            if sheet.title == title:
+                return sheet
+        raise LookupError(f"No worksheet named '{title}'")
+
+    def add_worksheet(self, title, rows, cols, index=None):
+        self.call('add_worksheet')
+        if any(sheet.title == title for sheet in self.sheets):
+            raise ValueError(f"A sheet with the name \"{title}\" already exists")
+        sheet = FakeWorksheet(title=title, latency=self.latency,
+                              id=max(sheet.id for sheet in self.sheets) + 1)
+        sheet.offline = self.offline_flag
+        self.sheets.append(sheet)
+        return sheet
+
+    def batch_update(self, body):
+        # Only addProtectedRange over whole worksheets is supported
+        self.call('batch_update')
+        for request in body['requests']:
+            sheet_id = request['addProtectedRange']['protectedRange']['range']['sheetId']
+            for sheet in self.sheets:
+                if sheet.id == sheet_id:
+                    sheet.protected = True
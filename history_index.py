@@ -0,0 +1,74 @@
+class ModuleHistoryIndex:
+    # Per-module lookup tables from seq / timestamp to positions in the
+    # (append-ordered) history
+    def __init__(self, history):
+        self.history = history
+        self.by_seq = {}
+        self.by_timestamp = {}
+
+    def add(self, position, seq, timestamp):
+        self.by_seq[seq] = position
+        self.by_timestamp.setdefault(timestamp, []).append(position)
+
+
+class HistoryIndex:
+    # Gives every history entry a unique, increasing 'seq' id so entries saved in
+    # the same second stay distinguishable, and keeps constant-time lookups by
+    # seq or timestamp for each module.
+    def __init__(self, module_params=None):
+        self.modules = {}
+        self.next_seq = 1
+        if module_params is not None:
+            self.rebuild(module_params)
+
+    def rebuild(self, module_params):
+        self.modules = {}
+
+        # Entries written before seq ids existed are numbered after the known ones
+        self.next_seq = 1
+        for module_data in module_params.values():
+            for entry in module_data['history']:
+                if 'seq' in entry and entry['seq'] >= self.next_seq:
+                    self.next_seq = entry['seq'] + 1
+
+        for module_id, module_data in module_params.items():
+            self.index_module(module_id, module_data['history'])
+
+    def index_module(self, module_id, history):
+        module_index = self.modules[module_id] = ModuleHistoryIndex(history)
+        for position, entry in enumerate(history):
+            if 'seq' not in entry:
+                entry['seq'] = self.new_seq()
+            module_index.add(position, entry['seq'], entry['timestamp'])
+
+    def new_seq(self):
+        seq = self.next_seq
+        self.next_seq += 1
+        return seq
+
+    def appended(self, module_id, history):
+        # Index the entry just appended to `history`
+        module_index = self.modules.get(module_id)
+        if module_index is None or module_index.history is not history:
+            module_index = self.modules[module_id] = ModuleHistoryIndex(history)
+        position = len(history) - 1
+        entry = history[position]
+        if entry['seq'] >= self.next_seq:
+            self.next_seq = entry['seq'] + 1
+        module_index.add(position, entry['seq'], entry['timestamp'])
+
+    def remove_module(self, module_id):
+        self.modules.pop(module_id, None)
+
+    def get(self, module_id, seq):
+        module_index = self.modules.get(module_id)
+        if module_index is None or seq not in module_index.by_seq:
+            return None
+        return module_index.history[module_index.by_seq[seq]]
+
+    def find_by_timestamp(self, module_id, timestamp):
+        module_index = self.modules.get(module_id)
+        if module_index is None:
+            return []
+        return [module_index.history[position]
+                for position in module_index.by_timestamp.get(timestamp, [])]
@@ -0,0 +1,288 @@
+import sys
+from array import array
+
+# Every N-th history entry is stored with its full values
+CHECKPOINT_EVERY = 32
+
+
+def intern_values(values):
+    return tuple(sys.intern(str(value)) for value in values)
+
+
+def diff_values(source, target):
+    # Changes that turn `source` into `target`: ((column, value), ...), with the
+    # target length kept separately so trailing columns can be dropped
+    changes = []
+    for column in range(len(target)):
+        value = target[column]
+        if column >= len(source) or source[column] != value:
+            changes.append((column, value))
+    return tuple(changes)
+
+
+def apply_changes(values, length, changes):
+    del values[length:]
+    if len(values) < length:
+        values.extend([''] * (length - len(values)))
+    for column, value in changes:
+        values[column] = value
+    return values
+
+
+class HistoryEntryView:
+    # Dict-shaped read access to one entry of a CompactHistory; parameters are
+    # rebuilt only when asked for
+    __slots__ = ('history', 'position')
+
+    def __init__(self, history, position):
+        self.history = history
+        self.position = position
+
+    def __getitem__(self, key):
+        if key == 'timestamp':
+            return self.history.timestamps[self.position]
+        if key == 'seq':
+            seq = self.history.seqs[self.position]
+            if not seq:
+                raise KeyError(key)
+            return seq
+        if key == 'parameters':
+            return self.history.values_at(self.position)
+        if key in ('origin', 'base'):
+            value = getattr(self.history, key + 's')[self.position]
+            if not value:
+                raise KeyError(key)
+            return value
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key != 'seq':
+            raise TypeError("history entries are read-only")
+        self.history.seqs[self.position] = value
+
+    def __contains__(self, key):
+        if key == 'seq':
+            return bool(self.history.seqs[self.position])
+        if key in ('origin', 'base'):
+            return bool(getattr(self.history, key + 's')[self.position])
+        return key in ('timestamp', 'parameters')
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [key for key in ('seq', 'timestamp', 'parameters', 'origin', 'base')
+                if key in self]
+
+    def to_dict(self):
+        return {key: self[key] for key in self.keys()}
+
+
+class CompactHistory:
+    # One module's history as columns. The newest entry's values are kept in
+    # full, every older entry only stores what differs from the entry after it
+    # (reverse deltas), so the recent entries the UI and sync need are cheap and
+    # unchanged values are never repeated. Every CHECKPOINT_EVERY-th entry also
+    # keeps its full values, which bounds the walk to rebuild any old entry.
+    # Values are interned strings. origins/bases hold the "station:revision" of
+    # each entry and of the entries it was edited from ('' when unknown).
+    def __init__(self, entries=()):
+        self.seqs = array('q')
+        self.timestamps = []
+        self.origins = []
+        self.bases = []
+        self.lengths = array('l')
+        self.back = []
+        self.checkpoints = {}
+        self.latest = ()
+        self.cache_position = None
+        self.cache_values = None
+        for entry in entries:
+            self.append(entry)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __bool__(self):
+        return bool(self.timestamps)
+
+    def append(self, entry):
+        values = intern_values(entry['parameters'])
+        previous = len(self.timestamps) - 1
+        if previous >= 0:
+            if previous % CHECKPOINT_EVERY == 0:
+                self.checkpoints[previous] = self.latest
+            else:
+                # The previous newest entry becomes a delta against the new one
+                self.back[previous] = diff_values(values, self.latest)
+        self.seqs.append(entry.get('seq', 0))
+        self.timestamps.append(sys.intern(entry['timestamp']))
+        self.origins.append(sys.intern(entry.get('origin', '')))
+        self.bases.append(sys.intern(entry.get('base', '')))
+        self.lengths.append(len(values))
+        self.back.append(None)
+        self.latest = values
+        self.cache_position = None
+        self.cache_values = None
+
+    def full_values(self, position):
+        # Values stored in full at `position`, or None if it is a delta
+        if position == len(self) - 1:
+            return self.latest
+        return self.checkpoints.get(position)
+
+    def step_back(self, values, position):
+        # Turn the values of entry position+1 into those of entry `position`
+        full = self.full_values(position)
+        if full is not None:
+            values[:] = full
+        else:
+            apply_changes(values, self.lengths[position], self.back[position])
+
+    def values_at(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+
+        # Start from the closest full copy at or after `position`: the next
+        # checkpoint, the newest entry, or the last reconstructed one
+        current = -(-position // CHECKPOINT_EVERY) * CHECKPOINT_EVERY
+        if current >= len(self) - 1:
+            current = len(self) - 1
+        if self.cache_position is not None and position <= self.cache_position < current:
+            current = self.cache_position
+            values = list(self.cache_values)
+        else:
+            values = list(self.full_values(current))
+        while current > position:
+            current -= 1
+            self.step_back(values, current)
+
+        self.cache_position = current
+        self.cache_values = tuple(values)
+        return values
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [HistoryEntryView(self, position)
+                    for position in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return HistoryEntryView(self, index)
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield HistoryEntryView(self, position)
+
+    def __reversed__(self):
+        for position in range(len(self) - 1, -1, -1):
+            yield HistoryEntryView(self, position)
+
+    def iter_values(self, start=0):
+        # (seq, timestamp, parameters) oldest first from `start`, in one
+        # backward pass; use this rather than entry views for bulk reads
+        all_values = []
+        values = list(self.latest)
+        for position in range(len(self) - 1, start - 1, -1):
+            if position < len(self) - 1:
+                self.step_back(values, position)
+            all_values.append(list(values))
+        all_values.reverse()
+        for offset, values in enumerate(all_values):
+            position = start + offset
+            yield self.seqs[position], self.timestamps[position], values
+
+    def entries(self, start=0):
+        return [{'seq': seq, 'timestamp': timestamp, 'parameters': values,
+                 'origin': self.origins[position], 'base': self.bases[position]}
+                for position, (seq, timestamp, values)
+                in enumerate(self.iter_values(start), start)]
+
+    def to_json(self):
+        # Forward deltas on disk: only the changes against the previous entry,
+        # with the full values every CHECKPOINT_EVERY entries
+        entries = []
+        previous = ()
+        for position, (seq, timestamp, values) in enumerate(self.iter_values()):
+            entry = {'timestamp': timestamp}
+            if seq:
+                entry['seq'] = seq
+            add_origin(entry, self, position)
+            if position % CHECKPOINT_EVERY == 0:
+                entry['parameters'] = values
+            else:
+                entry['changes'] = diff_values(previous, values)
+                if len(values) != len(previous):
+                    entry['length'] = len(values)
+            entries.append(entry)
+            previous = values
+        return {'format': 'delta', 'entries': entries}
+
+    @classmethod
+    def from_json(cls, data):
+        history = cls()
+        if isinstance(data, list):
+            # Full snapshots per entry, as written by older versions
+            for entry in data:
+                history.append(entry)
+            return history
+
+        values = []
+        for entry in data['entries']:
+            values = resolve_entry_values(values, entry)
+            history.append({
+                'seq': entry.get('seq', 0),
+                'timestamp': entry['timestamp'],
+                'parameters': values,
+                'origin': entry.get('origin', ''),
+                'base': entry.get('base', '')
+            })
+        return history
+
+
+def encode_entry(history, position):
+    # Stored form of one entry: the fields that changed since the previous
+    # entry, or the full values at checkpoints
+    entry = {'timestamp': history.timestamps[position]}
+    if history.seqs[position]:
+        entry['seq'] = history.seqs[position]
+    add_origin(entry, history, position)
+    values = history.values_at(position)
+    if position % CHECKPOINT_EVERY == 0:
+        entry['parameters'] = values
+    else:
+        previous = history.values_at(position - 1)
+        entry['changes'] = diff_values(previous, values)
+        if len(values) != len(previous):
+            entry['length'] = len(values)
+    return entry
+
+
+def add_origin(entry, history, position):
+    if history.origins[position]:
+        entry['origin'] = history.origins[position]
+    if history.bases[position]:
+        entry['base'] = history.bases[position]
+
+
+def resolve_entry_values(previous, entry):
+    # Full values of a stored entry that has either 'parameters' or 'changes'
+    if 'parameters' in entry:
+        return list(entry['parameters'])
+    values = list(previous)
+    return apply_changes(values, entry.get('length', len(values)), entry['changes'])
+
+
+def encode_history(obj):
+    # json.dump default= hook
+    if isinstance(obj, CompactHistory):
+        return obj.to_json()
+    if isinstance(obj, HistoryEntryView):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
@@ -0,0 +1,101 @@
+import tkinter as tk
+from tkinter import ttk
+
+
+class VirtualHistoryView(ttk.Frame):
+    # Treeview over a module's history that only materializes the visible rows.
+    # The scrollbar is driven by hand from the row offset instead of by the tree,
+    # so a history of any length costs `height` Treeview items.
+    def __init__(self, parent, height=6):
+        super().__init__(parent)
+        self.height = height
+        self.entries = []
+        self.offset = 0
+
+        self.tree = ttk.Treeview(self, height=height, columns=('Timestamp',),
+                                 show='headings', selectmode='browse')
+        self.tree.heading('Timestamp', text='Timestamp')
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self.page_label = ttk.Label(self, text="")
+
+        self.tree.grid(row=0, column=0, sticky='nsew')
+        self.scrollbar.grid(row=0, column=1, sticky='ns')
+        self.page_label.grid(row=1, column=0, columnspan=2, sticky='w')
+        self.grid_columnconfigure(0, weight=1)
+
+        self.tree.bind('<MouseWheel>', self.on_mousewheel)
+        self.tree.bind('<Button-4>', lambda e: self.scroll_rows(-1))
+        self.tree.bind('<Button-5>', lambda e: self.scroll_rows(1))
+        self.tree.bind('<Prior>', lambda e: self.scroll_rows(-self.height))
+        self.tree.bind('<Next>', lambda e: self.scroll_rows(self.height))
+
+    def bind_select(self, callback):
+        self.tree.bind('<<TreeviewSelect>>', callback)
+
+    def selection(self):
+        return self.tree.selection()
+
+    def set_entries(self, entries):
+        # entries is the history list, oldest first; it is shown newest first
+        self.entries = entries
+        self.offset = 0
+        self.render()
+
+    def clear(self):
+        self.set_entries([])
+
+    def entry_at(self, row):
+        return self.entries[len(self.entries) - 1 - row]
+
+    def appended(self):
+        # The caller appended to self.entries; keep the user's place unless they
+        # are looking at the newest rows
+        if self.offset > 0:
+            self.offset += 1
+        self.render()
+
+    def render(self):
+        total = len(self.entries)
+        self.offset = max(0, min(self.offset, total - self.height))
+        last = min(total, self.offset + self.height)
+
+        wanted = [self.entry_at(row) for row in range(self.offset, last)]
+        wanted_iids = [str(entry['seq']) for entry in wanted]
+
+        # Reuse items that are still visible, only add/remove the difference
+        current = self.tree.get_children()
+        if list(current) != wanted_iids:
+            keep = set(wanted_iids)
+            stale = [iid for iid in current if iid not in keep]
+            if stale:
+                self.tree.delete(*stale)
+            for position, entry in enumerate(wanted):
+                iid = wanted_iids[position]
+                if self.tree.exists(iid):
+                    self.tree.move(iid, '', position)
+                else:
+                    self.tree.insert('', position, iid=iid, values=(entry['timestamp'],))
+
+        if total:
+            self.scrollbar.set(self.offset / total, last / total)
+            self.page_label.config(text=f"Showing {self.offset + 1}-{last} of {total}")
+        else:
+            self.scrollbar.set(0, 1)
+            self.page_label.config(text="")
+
+    def scroll_rows(self, rows):
+        self.offset += rows
+        self.render()
+        return 'break'
+
+    def on_mousewheel(self, event):
+        return self.scroll_rows(-1 if event.delta > 0 else 1)
+
+    def yview(self, *args):
+        # Scrollbar protocol: ('moveto', fraction) or ('scroll', n, 'units'|'pages')
+        if args[0] == 'moveto':
+            self.offset = int(float(args[1]) * len(self.entries))
+            self.render()
+        elif args[0] == 'scroll':
+            step = self.height if args[2] == 'pages' else 1
+            self.scroll_rows(int(args[1]) * step)
@@ -0,0 +1,198 @@
+import functools
+import json
+import threading
+import time
+from collections import deque
+
+
+class NullSpan:
+    # What span() hands out while metrics are off: entering and leaving it is free
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ('metrics', 'name', 'fields', 'start')
+
+    def __init__(self, metrics, name, fields):
+        self.metrics = metrics
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record(self.name, time.perf_counter() - self.start, self.fields,
+                            exc_type is None)
+        return False
+
+
+class SpanStats:
+    __slots__ = ('count', 'errors', 'total', 'max', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+
+class Metrics:
+    # Timing spans and counters for sheet calls, disk writes and UI refreshes.
+    # Off by default; every entry point checks `enabled` first, so leaving the
+    # calls in place costs one attribute lookup. When a log path is given each
+    # span is also written as one JSON line.
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+        self.log_file = None
+        self.started = time.time()
+        # Monotonic times of the sheet requests in the last minute, the window
+        # the Sheets API quota is counted over
+        self.recent_requests = deque()
+
+    def enable(self, log_path=None):
+        if log_path:
+            self.log_file = open(log_path, 'a', buffering=1)
+        self.started = time.time()
+        self.enabled = True
+
+    def close(self):
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.write(json.dumps({'ts': time.time(), 'counters': self.counters}) + '\n')
+                self.log_file.close()
+                self.log_file = None
+
+    def span(self, name, **fields):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, fields)
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def request(self, kind):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self.lock:
+            self.counters['sheet.requests'] = self.counters.get('sheet.requests', 0) + 1
+            self.counters[kind] = self.counters.get(kind, 0) + 1
+            self.recent_requests.append(now)
+            while self.recent_requests[0] < now - 60:
+                self.recent_requests.popleft()
+
+    def requests_last_minute(self):
+        now = time.monotonic()
+        with self.lock:
+            return sum(1 for moment in self.recent_requests if moment >= now - 60)
+
+    def record(self, name, duration, fields=None, ok=True):
+        with self.lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.count += 1
+            stats.total += duration
+            stats.last = duration
+            if duration > stats.max:
+                stats.max = duration
+            if not ok:
+                stats.errors += 1
+            if self.log_file is not None:
+                line = {'ts': time.time(), 'span': name, 'ms': round(duration * 1000, 3)}
+                if not ok:
+                    line['error'] = True
+                if fields:
+                    line.update(fields)
+                self.log_file.write(json.dumps(line) + '\n')
+
+    def snapshot(self):
+        # ([(name, count, errors, total_s, max_s, last_s)], {counter: value})
+        with self.lock:
+            spans = [(name, stats.count, stats.errors, stats.total, stats.max, stats.last)
+                     for name, stats in sorted(self.spans.items())]
+            return spans, dict(self.counters)
+
+    def reset(self):
+        with self.lock:
+            self.spans = {}
+            self.counters = {}
+            self.recent_requests.clear()
+            self.started = time.time()
+
+
+metrics = Metrics()
+
+
+def timed(name):
+    # Decorator form of metrics.span(name)
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            with Span(metrics, name, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# gspread Worksheet methods that cost one API request each
+SHEET_READS = frozenset(('get', 'get_all_values', 'get_all_records', 'row_values',
+                         'col_values', 'batch_get', 'acell', 'cell',
+                         'worksheet', 'worksheets'))
+SHEET_WRITES = frozenset(('append_row', 'append_rows', 'update', 'batch_update', 'resize',
+                          'clear', 'add_cols', 'add_rows', 'delete_rows', 'insert_row',
+                          'insert_rows', 'update_cell', 'update_cells', 'update_acell',
+                          'add_worksheet'))
+
+
+class InstrumentedWorksheet:
+    # Wraps a worksheet so every API call is timed and counted against the quota
+    def __init__(self, sheet):
+        self.sheet = sheet
+
+    def __getattr__(self, name):
+        attr = getattr(self.sheet, name)
+        if name not in SHEET_READS and name not in SHEET_WRITES:
+            return attr
+
+        kind = 'sheet.read_requests' if name in SHEET_READS else 'sheet.write_requests'
+
+        def call(*args, **kwargs):
+            metrics.request(kind)
+            with metrics.span('sheet.' + name):
+                result = attr(*args, **kwargs)
+            if name == 'append_rows':
+                metrics.count('sheet.rows_uploaded', len(args[0] if args else kwargs['values']))
+            elif name == 'append_row':
+                metrics.count('sheet.rows_uploaded')
+            elif name in ('get', 'get_all_values') and result is not None:
+                metrics.count('sheet.rows_read', len(result))
+            return result
+        return call
+
+
+def instrument_sheet(sheet):
+    # Only pay for the wrapper when metrics are being collected
+    if metrics.enabled:
+        return InstrumentedWorksheet(sheet)
+    return sheet
@@ -0,0 +1,526 @@
+import bisect
+import math
+
+from module_search import ModuleIdIndex
+
+# Predicate operators; range ones compare numerically
+OPERATORS = ('=', '!=', '<', '<=', '>', '>=', 'between', 'outside', 'contains', 'empty')
+NUMERIC_OPERATORS = ('<', '<=', '>', '>=', 'between', 'outside')
+
+# Sorts after any character a module id or timestamp contains
+HIGHEST = '\U0010ffff'
+
+
+class Top:
+    # Compares greater than any key, so (number, TOP) sorts after every
+    # (number, key) whatever the keys are
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+
+TOP = Top()
+
+# Changing more entries than this fraction of the time index at once rebuilds it
+REBUILD_FRACTION = 0.125
+
+
+def to_number(text):
+    try:
+        number = float(text)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+class Predicate:
+    # A condition on one stored column (column id, see SheetSchema)
+    def __init__(self, column, op, value='', high=''):
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown operator '{op}'")
+        self.column = column
+        self.op = op
+        self.value = value.strip()
+        self.high = high.strip()
+        self.low_number = to_number(self.value)
+        self.high_number = to_number(self.high)
+        if op in NUMERIC_OPERATORS and self.low_number is None:
+            raise ValueError(f"'{op}' needs a number, got '{value}'")
+        if op in ('between', 'outside'):
+            if self.high_number is None:
+                raise ValueError(f"'{op}' needs two numbers")
+            if self.high_number < self.low_number:
+                self.low_number, self.high_number = self.high_number, self.low_number
+
+    def matches(self, values):
+        value = values[self.column] if self.column < len(values) else ''
+        op = self.op
+        if op == 'empty':
+            return value == ''
+        if op == 'contains':
+            return self.value.lower() in value.lower()
+        if op in ('=', '!='):
+            number = to_number(value)
+            if self.low_number is not None and number is not None:
+                equal = number == self.low_number
+            else:
+                equal = value == self.value
+            return equal if op == '=' else not equal
+        number = to_number(value)
+        if number is None:
+            return False
+        if op == '<':
+            return number < self.low_number
+        if op == '<=':
+            return number <= self.low_number
+        if op == '>':
+            return number > self.low_number
+        if op == '>=':
+            return number >= self.low_number
+        inside = self.low_number <= number <= self.high_number
+        return inside if op == 'between' else not inside
+
+
+class Query:
+    # Modules whose current values match every predicate, or (history=True)
+    # the history entries that do. since/until bound the entry timestamps;
+    # until is a prefix, so "2024-05-01" covers that whole day.
+    def __init__(self, predicates=(), since='', until='', prefix='', history=False, limit=1000):
+        self.predicates = list(predicates)
+        self.since = since.strip()
+        self.until = until.strip()
+        self.prefix = prefix.strip()
+        self.history = history
+        self.limit = limit
+
+
+class QueryIndex:
+    # Secondary indexes over module_params for queries:
+    #  - every history entry as (timestamp, module_id, position), sorted, for
+    #    time ranges
+    #  - the module ids, sorted, for prefix matches
+    #  - per stored column, each module's current value: sorted numbers for
+    #    range predicates and value -> module ids for the rest
+    #  - per stored column, the same over all history values. Consecutive
+    #    entries of a module holding the same value form one run, keyed by
+    #    (module_id, first position), so unchanged values cost nothing.
+    # A column's indexes are built the first time it is queried and kept
+    # current after. Saves update all of them in place; see appended() and
+    # modules_changed().
+    def __init__(self, module_params=None):
+        self.module_params = {}
+        self.times = []
+        self.module_times = {}
+        self.module_ids = ModuleIdIndex()
+        self.current = {}
+        self.numbers = {}
+        self.texts = {}
+        self.history_numbers = {}
+        self.history_texts = {}
+        # column -> module_id -> (run start positions, run values)
+        self.history_runs = {}
+        if module_params is not None:
+            self.rebuild(module_params)
+
+    def rebuild(self, module_params):
+        self.module_params = module_params
+        self.module_times = {}
+        for module_id, module_data in module_params.items():
+            self.module_times[module_id] = [
+                (timestamp, module_id, position)
+                for position, timestamp in enumerate(module_data['history'].timestamps)]
+        self.times = sorted(item for items in self.module_times.values() for item in items)
+        self.module_ids.rebuild(module_params.keys())
+        self.current = {module_id: module_data['history'].latest
+                        for module_id, module_data in module_params.items()}
+        self.numbers = {}
+        self.texts = {}
+        self.history_numbers = {}
+        self.history_texts = {}
+        self.history_runs = {}
+
+    def __len__(self):
+        return len(self.times)
+
+    def appended(self, module_id):
+        # A save appended one entry to the module's history
+        history = self.module_params[module_id]['history']
+        position = len(history) - 1
+        item = (history.timestamps[position], module_id, position)
+        bisect.insort(self.times, item)
+        self.module_times.setdefault(module_id, []).append(item)
+        self.module_ids.add(module_id)
+        self.set_current(module_id, history.latest)
+        for column, runs in self.history_runs.items():
+            value = self.column_value(history.latest, column)
+            starts, values = runs.setdefault(module_id, ([], []))
+            if not values or values[-1] != value:
+                starts.append(position)
+                values.append(value)
+                self.index_run(column, (module_id, position), value)
+
+    def modules_changed(self, module_ids):
+        # Histories rebuilt, replaced or deleted (sheet merge, clear): reindex them
+        module_ids = list(module_ids)
+        affected = sum(len(self.module_times.get(module_id, ())) for module_id in module_ids)
+        if affected > len(self.times) * REBUILD_FRACTION:
+            # Sorting once beats many inserts; column indexes are rebuilt on
+            # their next use
+            self.rebuild(self.module_params)
+            return
+        for module_id in module_ids:
+            for column, runs in self.history_runs.items():
+                starts, values = runs.pop(module_id, ((), ()))
+                for start, value in zip(starts, values):
+                    self.unindex_run(column, (module_id, start), value)
+            for item in self.module_times.pop(module_id, ()):
+                position = bisect.bisect_left(self.times, item)
+                if position < len(self.times) and self.times[position] == item:
+                    del self.times[position]
+            module_data = self.module_params.get(module_id)
+            if module_data is None:
+                self.module_ids.remove(module_id)
+                self.set_current(module_id, None)
+                continue
+            history = module_data['history']
+            items = [(timestamp, module_id, position)
+                     for position, timestamp in enumerate(history.timestamps)]
+            for item in items:
+                bisect.insort(self.times, item)
+            self.module_times[module_id] = items
+            self.module_ids.add(module_id)
+            self.set_current(module_id, history.latest)
+            self.index_history(module_id, history, list(self.history_runs))
+
+    def set_current(self, module_id, values):
+        old = self.current.pop(module_id, None)
+        if values is not None:
+            self.current[module_id] = values
+        for column in self.numbers:
+            old_value = self.column_value(old, column)
+            new_value = self.column_value(values, column)
+            if old is not None and values is not None and old_value == new_value:
+                continue
+            if old is not None:
+                self.unindex(column, module_id, old_value)
+            if values is not None:
+                self.index(column, module_id, new_value)
+
+    def column_value(self, values, column):
+        if values is None or column >= len(values):
+            return ''
+        return values[column]
+
+    def index(self, column, module_id, value):
+        add_key(self.numbers[column], self.texts[column], module_id, value)
+
+    def unindex(self, column, module_id, value):
+        remove_key(self.numbers[column], self.texts[column], module_id, value)
+
+    def index_run(self, column, key, value):
+        add_key(self.history_numbers[column], self.history_texts[column], key, value)
+
+    def unindex_run(self, column, key, value):
+        remove_key(self.history_numbers[column], self.history_texts[column], key, value)
+
+    def index_history(self, module_id, history, columns):
+        # Add the value runs of one module's history
+        for column, (starts, run_values) in value_runs(history, columns).items():
+            self.history_runs[column][module_id] = (starts, run_values)
+            for start, value in zip(starts, run_values):
+                self.index_run(column, (module_id, start), value)
+
+    def history_column_index(self, columns):
+        # Build the history indexes of the columns that have none yet, in one
+        # pass over all histories
+        missing = sorted({column for column in columns if column not in self.history_runs})
+        if not missing:
+            return
+        runs = {column: {} for column in missing}
+        texts = {column: {} for column in missing}
+        for module_id, module_data in self.module_params.items():
+            for column, (starts, run_values) in value_runs(module_data['history'],
+                                                           missing).items():
+                runs[column][module_id] = (starts, run_values)
+                column_texts = texts[column]
+                for start, value in zip(starts, run_values):
+                    keys = column_texts.get(value)
+                    if keys is None:
+                        keys = column_texts[value] = set()
+                    keys.add((module_id, start))
+        for column in missing:
+            # Each distinct value is parsed once
+            numbers = []
+            for value, keys in texts[column].items():
+                number = to_number(value)
+                if number is not None:
+                    numbers.extend((number, key) for key in keys)
+            numbers.sort()
+            self.history_numbers[column] = numbers
+            self.history_texts[column] = texts[column]
+            self.history_runs[column] = runs[column]
+
+    def column_index(self, column):
+        if column not in self.numbers:
+            numbers = []
+            texts = {}
+            for module_id, values in self.current.items():
+                value = self.column_value(values, column)
+                number = to_number(value)
+                if number is not None:
+                    numbers.append((number, module_id))
+                texts.setdefault(value, set()).add(module_id)
+            numbers.sort()
+            self.numbers[column] = numbers
+            self.texts[column] = texts
+        return self.numbers[column], self.texts[column]
+
+    def number_range(self, numbers, low, high, include_low=True, include_high=True):
+        # Keys whose number lies between low and high (None = unbounded)
+        start = 0
+        end = len(numbers)
+        if low is not None:
+            if include_low:
+                start = bisect.bisect_left(numbers, (low,))
+            else:
+                start = bisect.bisect_right(numbers, (low, TOP))
+        if high is not None:
+            if include_high:
+                end = bisect.bisect_right(numbers, (high, TOP))
+            else:
+                end = bisect.bisect_left(numbers, (high,))
+        return {key for _, key in numbers[start:end]}
+
+    def modules_matching(self, predicate):
+        numbers, texts = self.column_index(predicate.column)
+        return self.keys_matching(predicate, numbers, texts, lambda: set(self.current))
+
+    def entry_ranges(self, predicate):
+        # {module_id: [(start, end), ...]}: the history positions whose value
+        # the predicate matches, as sorted, merged half-open ranges
+        column = predicate.column
+        runs = self.history_runs[column]
+
+        def all_runs():
+            return {(module_id, start) for module_id, (starts, _) in runs.items()
+                    for start in starts}
+
+        ranges = {}
+        keys = self.keys_matching(predicate, self.history_numbers[column],
+                                  self.history_texts[column], all_runs)
+        for module_id, start in keys:
+            starts = runs[module_id][0]
+            next_run = bisect.bisect_right(starts, start)
+            if next_run < len(starts):
+                end = starts[next_run]
+            else:
+                end = len(self.module_params[module_id]['history'])
+            ranges.setdefault(module_id, []).append((start, end))
+        for module_id, spans in ranges.items():
+            ranges[module_id] = merge_spans(spans)
+        return ranges
+
+    def keys_matching(self, predicate, numbers, texts, all_keys):
+        # Keys of one column's index (module ids, or history runs) whose value
+        # matches; all_keys() gives every key, for '!='
+        op = predicate.op
+        low = predicate.low_number
+        if op == '<':
+            return self.number_range(numbers, None, low, include_high=False)
+        if op == '<=':
+            return self.number_range(numbers, None, low)
+        if op == '>':
+            return self.number_range(numbers, low, None, include_low=False)
+        if op == '>=':
+            return self.number_range(numbers, low, None)
+        if op == 'between':
+            return self.number_range(numbers, low, predicate.high_number)
+        if op == 'outside':
+            return (self.number_range(numbers, None, low, include_high=False)
+                    | self.number_range(numbers, predicate.high_number, None, include_low=False))
+        if op in ('=', '!='):
+            if low is not None:
+                equal = self.number_range(numbers, low, low)
+            else:
+                equal = set(texts.get(predicate.value, ()))
+            return equal if op == '=' else all_keys() - equal
+        if op == 'empty':
+            return set(texts.get('', ()))
+        # contains: scan the distinct values, not the modules
+        needle = predicate.value.lower()
+        matches = set()
+        for value, modules in texts.items():
+            if needle in value.lower():
+                matches |= modules
+        return matches
+
+    def time_slice(self, since, until):
+        start = bisect.bisect_left(self.times, (since,)) if since else 0
+        end = bisect.bisect_right(self.times, (until + HIGHEST,)) if until else len(self.times)
+        return self.times[start:end]
+
+    def run(self, query):
+        # (results, total): module ids sorted by id, or (module_id, position)
+        # pairs newest first, at most query.limit of them
+        if query.history:
+            return self.matching_entries(query)
+        results = sorted(self.matching_modules(query))
+        return results[:query.limit], len(results)
+
+    def matching_modules(self, query):
+        candidates = None
+        if query.prefix:
+            candidates = set(self.module_ids.search(query.prefix, limit=len(self.module_ids)))
+        if query.since or query.until:
+            saved = {module_id for _, module_id, _ in self.time_slice(query.since, query.until)}
+            candidates = saved if candidates is None else candidates & saved
+        # Smallest sets first so the intersection shrinks quickly
+        for modules in sorted((self.modules_matching(predicate) for predicate in query.predicates),
+                              key=len):
+            candidates = modules if candidates is None else candidates & modules
+            if not candidates:
+                break
+        return set(self.current) if candidates is None else candidates
+
+    def matching_entries(self, query):
+        if query.since or query.until:
+            results = []
+            candidates = self.time_slice(query.since, query.until)
+            if query.prefix:
+                candidates = [item for item in candidates if item[1].startswith(query.prefix)]
+            if not query.predicates:
+                results = candidates
+            else:
+                # Newest first within each module, so values_at() steps back
+                # from the entry it rebuilt last instead of from a checkpoint
+                candidates.sort(key=lambda item: (item[1], -item[2]))
+                for item in candidates:
+                    values = self.module_params[item[1]]['history'].values_at(item[2])
+                    if all(predicate.matches(values) for predicate in query.predicates):
+                        results.append(item)
+            results.sort(reverse=True)
+            return ([(module_id, position) for _, module_id, position in results[:query.limit]],
+                    len(results))
+
+        if not query.predicates:
+            if not query.prefix:
+                newest = self.times[:-query.limit - 1:-1] if query.limit else []
+                return [(module_id, position) for _, module_id, position in newest], len(self.times)
+            ranges = {module_id: [(0, len(self.module_params[module_id]['history']))]
+                      for module_id in self.module_ids.search(query.prefix,
+                                                              limit=len(self.module_ids))}
+        else:
+            # No time range: intersect the positions each predicate matches in
+            # the history value indexes, smallest first
+            self.history_column_index(predicate.column for predicate in query.predicates)
+            ranges = None
+            for matched in sorted((self.entry_ranges(predicate)
+                                   for predicate in query.predicates), key=len):
+                ranges = matched if ranges is None else intersect_ranges(ranges, matched)
+                if not ranges:
+                    break
+            if query.prefix:
+                ranges = {module_id: spans for module_id, spans in ranges.items()
+                          if module_id.startswith(query.prefix)}
+        return self.newest_in(ranges, query.limit)
+
+    def newest_in(self, ranges, limit):
+        # The newest `limit` entries inside `ranges`, and how many there are
+        total = sum(end - start for spans in ranges.values() for start, end in spans)
+        if total * total <= limit * len(self.times):
+            # Few matches: sort them
+            results = []
+            for module_id, spans in ranges.items():
+                timestamps = self.module_params[module_id]['history'].timestamps
+                for start, end in spans:
+                    results.extend((timestamps[position], module_id, position)
+                                   for position in range(start, end))
+            results.sort(reverse=True)
+            return [(module_id, position) for _, module_id, position in results[:limit]], total
+        # Many matches: walk the time index from the newest entry, which
+        # reaches `limit` of them long before the end
+        results = []
+        for _, module_id, position in reversed(self.times):
+            if len(results) >= limit:
+                break
+            spans = ranges.get(module_id)
+            if spans:
+                span = bisect.bisect_left(spans, (position + 1,)) - 1
+                if span >= 0 and position < spans[span][1]:
+                    results.append((module_id, position))
+        return results, total
+
+
+def merge_spans(spans):
+    # Sorted half-open ranges with touching ones joined
+    spans.sort()
+    merged = [spans[0]]
+    for start, end in spans[1:]:
+        if start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def intersect_ranges(ranges, other):
+    # Positions in both {module_id: spans} maps
+    if len(other) < len(ranges):
+        ranges, other = other, ranges
+    result = {}
+    for module_id, spans in ranges.items():
+        other_spans = other.get(module_id)
+        if not other_spans:
+            continue
+        both = []
+        i = j = 0
+        while i < len(spans) and j < len(other_spans):
+            start = max(spans[i][0], other_spans[j][0])
+            end = min(spans[i][1], other_spans[j][1])
+            if start < end:
+                both.append((start, end))
+            if spans[i][1] < other_spans[j][1]:
+                i += 1
+            else:
+                j += 1
+        if both:
+            result[module_id] = both
+    return result
+
+
+def value_runs(history, columns):
+    # {column: (start positions, values)} of the runs of equal consecutive
+    # values in one module's history, decoding it once
+    if not columns or not history:
+        return {}
+    all_values = [values for _, _, values in history.iter_values()]
+    runs = {}
+    for column in columns:
+        column_values = [values[column] if column < len(values) else ''
+                         for values in all_values]
+        starts = [0] + [position for position in range(1, len(column_values))
+                        if column_values[position] != column_values[position - 1]]
+        runs[column] = (starts, [column_values[start] for start in starts])
+    return runs
+
+
+def add_key(numbers, texts, key, value):
+    number = to_number(value)
+    if number is not None:
+        bisect.insort(numbers, (number, key))
+    texts.setdefault(value, set()).add(key)
+
+
+def remove_key(numbers, texts, key, value):
+    number = to_number(value)
+    if number is not None:
+        position = bisect.bisect_left(numbers, (number, key))
+        if position < len(numbers) and numbers[position] == (number, key):
+            del numbers[position]
+    keys = texts.get(value)
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            del texts[value]
@@ -0,0 +1,33 @@
+import bisect
+
+
+class ModuleIdIndex:
+    # Sorted module ids for prefix (type-ahead) search without handing every id
+    # to the Combobox
+    def __init__(self, module_ids=()):
+        self.ids = sorted(module_ids)
+
+    def rebuild(self, module_ids):
+        self.ids = sorted(module_ids)
+
+    def add(self, module_id):
+        position = bisect.bisect_left(self.ids, module_id)
+        if position == len(self.ids) or self.ids[position] != module_id:
+            self.ids.insert(position, module_id)
+
+    def remove(self, module_id):
+        position = bisect.bisect_left(self.ids, module_id)
+        if position < len(self.ids) and self.ids[position] == module_id:
+            del self.ids[position]
+
+    def search(self, prefix, limit=50):
+        start = bisect.bisect_left(self.ids, prefix)
+        matches = []
+        for module_id in self.ids[start:start + limit]:
+            if not module_id.startswith(prefix):
+                break
+            matches.append(module_id)
+        return matches
+
+    def __len__(self):
+        return len(self.ids)
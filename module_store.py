@@ -0,0 +1,302 @@
+import json
+import os
+
+from history_store import (CompactHistory, encode_entry, encode_history, intern_values,
+                           resolve_entry_values)
+from instrumentation import metrics
+from sheet_schema import SchemaCache
+
+SNAPSHOT_FORMAT = 2
+
+
+class ModuleStorage:
+    # What ModuleTrackingGUI needs from a storage backend. module_params is the
+    # in-memory dict returned by load(); the record_* methods persist a change
+    # the caller has already made to it.
+    def load(self):
+        raise NotImplementedError
+
+    def load_index(self):
+        # {module_id: {'created', 'modified'}} without loading history, or None
+        raise NotImplementedError
+
+    def record_save(self, module_id, entry):
+        raise NotImplementedError
+
+    def record_saves(self, module_ids):
+        # record_save for the newest entry of each module, as one write
+        raise NotImplementedError
+
+    def record_put(self, module_id):
+        raise NotImplementedError
+
+    def record_delete(self, module_id):
+        raise NotImplementedError
+
+    def replace_all(self, module_params):
+        raise NotImplementedError
+
+    def load_schema(self):
+        # SheetSchema.to_json() as last saved, or None
+        raise NotImplementedError
+
+    def save_schema(self, data):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ModuleStore(ModuleStorage):
+    # module_params.json holds a snapshot, every save or delete after it is one
+    # line appended to the journal. Loading replays the journal over the snapshot.
+    def __init__(self, path='module_params.json', compact_every=500, read_only=False):
+        self.path = path
+        # A read-only store (the headless push) never repairs or rewrites
+        # files, since the process that owns them may be writing right now
+        self.read_only = read_only
+        self.schema_cache = SchemaCache(os.path.join(os.path.dirname(path), 'sheet_header.json'))
+        self.journal_path = os.path.splitext(path)[0] + '.journal'
+        self.index_path = os.path.splitext(path)[0] + '.index.json'
+        self.compact_every = compact_every
+        self.module_params = {}
+        self.lsn = 0
+        self.snapshot_lsn = 0
+        self.records_since_compaction = 0
+
+    def load(self):
+        self.module_params = self.read_snapshot()
+        self.lsn = self.snapshot_lsn
+        self.records_since_compaction = 0
+        self.replay_journal()
+        if not self.read_only and not os.path.exists(self.index_path):
+            self.write_index()
+        return self.module_params
+
+    def load_index(self):
+        # Module id -> created/modified without parsing any history, for fast
+        # startup. Written at compaction time, brought up to date from the journal.
+        try:
+            with open(self.index_path, 'r') as f:
+                data = json.load(f)
+            index_lsn = data['journal_lsn']
+            index = data['modules']
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+        try:
+            with open(self.journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    if record['lsn'] <= index_lsn:
+                        continue
+                    for record in record.get('records', [record]):
+                        module_id = record['module_id']
+                        if record['op'] == 'save':
+                            timestamp = record['entry']['timestamp']
+                            created = (index.get(module_id, {}).get('created')
+                                       or record['created'] or timestamp)
+                            index[module_id] = {'created': created, 'modified': timestamp}
+                        elif record['op'] == 'put':
+                            index[module_id] = {'created': record['module']['created'],
+                                                'modified': record['module']['modified']}
+                        elif record['op'] == 'delete':
+                            index.pop(module_id, None)
+        except FileNotFoundError:
+            pass
+        return index
+
+    def write_index(self):
+        index = {
+            module_id: {'created': module_data['created'], 'modified': module_data['modified']}
+            for module_id, module_data in self.module_params.items()
+        }
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'journal_lsn': self.lsn, 'modules': index}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def read_snapshot(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            self.snapshot_lsn = 0
+            return {}
+
+        if data.get('format') == SNAPSHOT_FORMAT and isinstance(data.get('modules'), dict):
+            self.snapshot_lsn = data['journal_lsn']
+            modules = data['modules']
+        else:
+            # Plain dict written by older versions
+            self.snapshot_lsn = 0
+            modules = data
+
+        for module_data in modules.values():
+            module_data['parameters'] = list(intern_values(module_data['parameters']))
+            module_data['history'] = CompactHistory.from_json(module_data['history'])
+        return modules
+
+    def replay_journal(self):
+        try:
+            f = open(self.journal_path, 'rb')
+        except FileNotFoundError:
+            return
+
+        good_offset = 0
+        torn = False
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if record is None or not line.endswith(b'\n'):
+                    # Torn write from a crash, everything after it is unusable
+                    torn = True
+                    break
+                good_offset += len(line)
+                if record['lsn'] <= self.snapshot_lsn:
+                    continue
+                self.apply(record)
+                self.lsn = record['lsn']
+                self.records_since_compaction += 1
+
+        if torn and not self.read_only:
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(good_offset)
+
+    def apply(self, record):
+        module_id = record['module_id']
+        if record['op'] == 'save':
+            entry = record['entry']
+            module_data = self.module_params.setdefault(module_id, {
+                'parameters': [],
+                'created': '',
+                'modified': '',
+                'history': CompactHistory()
+            })
+            if not module_data['created']:
+                module_data['created'] = record['created'] or entry['timestamp']
+            history = module_data['history']
+            history.append({
+                'seq': entry.get('seq', 0),
+                'timestamp': entry['timestamp'],
+                'parameters': resolve_entry_values(history.latest, entry),
+                'origin': entry.get('origin', ''),
+                'base': entry.get('base', '')
+            })
+            module_data['parameters'] = list(module_data['history'].latest)
+            module_data['modified'] = entry['timestamp']
+        elif record['op'] == 'put':
+            module_data = record['module']
+            module_data['history'] = CompactHistory.from_json(module_data['history'])
+            self.module_params[module_id] = module_data
+        elif record['op'] == 'delete':
+            self.module_params.pop(module_id, None)
+        elif record['op'] == 'batch':
+            for sub_record in record['records']:
+                self.apply(sub_record)
+
+    def append(self, record):
+        self.lsn += 1
+        record['lsn'] = self.lsn
+        line = json.dumps(record, default=encode_history) + '\n'
+        with metrics.span('store.journal_write'):
+            with open(self.journal_path, 'a') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        metrics.count('disk.bytes_written', len(line))
+
+        self.records_since_compaction += 1
+        if self.records_since_compaction >= self.compact_every:
+            self.compact()
+
+    def record_save(self, module_id, entry):
+        # The entry has already been appended to the module's history by the
+        # caller. Only the fields that differ from the previous entry are
+        # written, with the full values every CHECKPOINT_EVERY entries.
+        self.append(self.save_record(module_id))
+
+    def record_saves(self, module_ids):
+        # One journal line (and one fsync) for the whole batch
+        self.append({
+            'op': 'batch',
+            'module_id': None,
+            'records': [self.save_record(module_id) for module_id in module_ids]
+        })
+
+    def save_record(self, module_id):
+        history = self.module_params[module_id]['history']
+        return {
+            'op': 'save',
+            'module_id': module_id,
+            'created': self.module_params[module_id]['created'],
+            'entry': encode_entry(history, len(history) - 1)
+        }
+
+    def record_put(self, module_id):
+        # Whole-module record, for changes that are not a single appended entry
+        self.append({
+            'op': 'put',
+            'module_id': module_id,
+            'module': self.module_params[module_id]
+        })
+
+    def record_delete(self, module_id):
+        self.append({'op': 'delete', 'module_id': module_id})
+
+    def load_schema(self):
+        return self.schema_cache.load()
+
+    def save_schema(self, data):
+        self.schema_cache.save(data)
+
+    def replace_all(self, module_params):
+        self.module_params = module_params
+        self.compact()
+        return self.module_params
+
+    def compact(self):
+        snapshot = {
+            'format': SNAPSHOT_FORMAT,
+            'journal_lsn': self.lsn,
+            'modules': self.module_params
+        }
+        tmp_path = self.path + '.tmp'
+        with metrics.span('store.compact'):
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f, default=encode_history)
+                f.flush()
+                os.fsync(f.fileno())
+                written = f.tell()
+            os.replace(tmp_path, self.path)
+            fsync_directory(self.path)
+            self.write_index()
+        metrics.count('disk.bytes_written', written)
+
+        # Records up to journal_lsn are now in the snapshot and skipped on replay,
+        # so a crash before this truncate is harmless
+        self.snapshot_lsn = self.lsn
+        with open(self.journal_path, 'w') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self.records_since_compaction = 0
+
+
+def fsync_directory(path):
+    # Make the rename itself durable; not supported on every platform
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
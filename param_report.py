@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+
+# Per-parameter statistics over every module's history: distribution of the
+# current values, mean per day and drift over time, written as CSV or HTML.
+#
+#   python3 uiWireBonder.py report report.html
+#   python3 uiWireBonder.py report summary.csv --since 2024-05-01
+#
+# Needs NumPy (pip3 install numpy); the rest of the program does not.
+
+import argparse
+import csv
+import html
+import itertools
+import math
+import os
+import sys
+import time
+import warnings
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from sheet_schema import SheetSchema
+from sqlite_store import open_storage
+
+CACHE_PATH = 'report_cache.npz'
+PERCENTILES = (5, 25, 50, 75, 95)
+HISTOGRAM_BINS = 10
+
+# Exit codes, as for `sync`
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError("The report needs NumPy: pip3 install numpy")
+
+
+def fingerprint(history):
+    # Changes whenever an entry is appended or the history is rebuilt by a merge
+    if not history:
+        return (0, 0, '')
+    return (len(history), history.seqs[-1], history.timestamps[-1])
+
+
+def stale_histories(module_params, parsed):
+    # {module_id: (fingerprint, [(timestamp, stored values), ...])} for the
+    # modules `parsed` does not hold in their current state. Call it where
+    # module_params is modified (the Tk thread); parsing can then run elsewhere.
+    stale = {}
+    for module_id, module_data in module_params.items():
+        history = module_data['history']
+        key = fingerprint(history)
+        if parsed.fingerprints.get(module_id) != key:
+            stale[module_id] = (key, [(timestamp, values)
+                                      for _, timestamp, values in history.iter_values()])
+    return stale
+
+
+class NumberCache(dict):
+    # Cell text -> float, NaN for empty or non-numeric cells. Histories repeat
+    # the same few strings a lot, so each distinct one is parsed once.
+    def __missing__(self, text):
+        try:
+            number = float(text)
+        except ValueError:
+            number = math.nan
+        self[text] = number
+        return number
+
+
+def parse_times(timestamps):
+    try:
+        return np.array(timestamps, dtype='datetime64[s]')
+    except ValueError:
+        times = np.empty(len(timestamps), dtype='datetime64[s]')
+        for i, timestamp in enumerate(timestamps):
+            try:
+                times[i] = np.datetime64(timestamp, 's')
+            except ValueError:
+                times[i] = np.datetime64('NaT')
+        return times
+
+
+class ParsedHistories:
+    # Every module's history as NumPy arrays: save times and the stored values
+    # as float64, one matrix column per stored column id. Modules are only
+    # parsed again when their fingerprint changes, and the arrays are kept in
+    # report_cache.npz between runs.
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.fingerprints = {}
+        self.times = {}
+        self.values = {}
+        self.numbers = NumberCache()
+        self.changed = False
+
+    @classmethod
+    def open(cls, path=CACHE_PATH):
+        parsed = cls(path)
+        try:
+            parsed.load()
+        except (OSError, ValueError, KeyError):
+            # Missing or unreadable: everything is parsed again
+            parsed = cls(path)
+        return parsed
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with np.load(self.path) as data:
+            module_ids = data['module_ids'].tolist()
+            lengths = data['lengths'].tolist()
+            seqs = data['seqs'].tolist()
+            last = data['last'].tolist()
+            offsets = data['offsets']
+            times = data['times']
+            values = data['values']
+        for i, module_id in enumerate(module_ids):
+            start, end = offsets[i], offsets[i + 1]
+            self.fingerprints[module_id] = (lengths[i], seqs[i], last[i])
+            self.times[module_id] = times[start:end]
+            self.values[module_id] = values[start:end]
+
+    def save(self):
+        module_ids = list(self.fingerprints)
+        offsets, times, values = self.arrays(module_ids)
+        temp_path = self.path + '.tmp.npz'
+        np.savez(temp_path,
+                 module_ids=np.array(module_ids, dtype=str),
+                 lengths=np.array([self.fingerprints[m][0] for m in module_ids], dtype=np.int64),
+                 seqs=np.array([self.fingerprints[m][1] for m in module_ids], dtype=np.int64),
+                 last=np.array([self.fingerprints[m][2] for m in module_ids], dtype=str),
+                 offsets=offsets, times=times, values=values)
+        os.replace(temp_path, self.path)
+        self.changed = False
+
+    def update(self, stale, module_ids):
+        # Parse the stale modules in one batch and forget deleted ones; returns
+        # how many modules were parsed
+        for module_id in set(self.fingerprints) - set(module_ids):
+            del self.fingerprints[module_id]
+            del self.times[module_id]
+            del self.values[module_id]
+            self.changed = True
+        if not stale:
+            return 0
+
+        timestamps = []
+        rows = []
+        for key, entries in stale.values():
+            for timestamp, values in entries:
+                timestamps.append(timestamp)
+                rows.append(values)
+        lengths = np.fromiter(map(len, rows), np.int64, count=len(rows))
+        width = int(lengths.max()) if len(rows) else 0
+        cells = np.fromiter(map(self.numbers.__getitem__, itertools.chain.from_iterable(rows)),
+                            np.float64, count=int(lengths.sum()))
+        if (lengths == width).all():
+            values = cells.reshape(len(rows), width)
+        else:
+            # Shorter rows (saved before a column was added) are padded with NaN
+            values = np.full((len(rows), width), np.nan)
+            row_index = np.repeat(np.arange(len(rows)), lengths)
+            starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+            values[row_index, np.arange(len(cells)) - starts] = cells
+        times = parse_times(timestamps)
+
+        start = 0
+        for module_id, (key, entries) in stale.items():
+            end = start + len(entries)
+            self.fingerprints[module_id] = key
+            self.times[module_id] = times[start:end]
+            self.values[module_id] = values[start:end]
+            start = end
+        self.changed = True
+        return len(stale)
+
+    def arrays(self, module_ids):
+        # (offsets, times, values) of `module_ids` back to back; module i owns
+        # rows offsets[i]:offsets[i + 1]. Narrower histories are padded with NaN.
+        lengths = [len(self.times[module_id]) for module_id in module_ids]
+        offsets = np.zeros(len(module_ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        width = max((self.values[module_id].shape[1] for module_id in module_ids), default=0)
+        times = np.empty(offsets[-1], dtype='datetime64[s]')
+        values = np.full((offsets[-1], width), np.nan)
+        for i, module_id in enumerate(module_ids):
+            start, end = offsets[i], offsets[i + 1]
+            times[start:end] = self.times[module_id]
+            block = self.values[module_id]
+            values[start:end, :block.shape[1]] = block
+        return offsets, times, values
+
+
+class Report:
+    # Statistics for the numeric parameters. Distribution figures are over each
+    # module's latest value in the time range; daily means and drift are over
+    # every history entry in it.
+    def __init__(self, parameters, modules, entries, summary, days, daily_means,
+                 daily_counts, histograms, since='', until=''):
+        self.parameters = parameters
+        self.modules = modules
+        self.entries = entries
+        self.summary = summary
+        self.days = days
+        self.daily_means = daily_means
+        self.daily_counts = daily_counts
+        self.histograms = histograms
+        self.since = since
+        self.until = until
+        self.generated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def time_range(since, until):
+    # (start, end) for the entries saved in start <= time < end, None when
+    # open. Like the query dialog, until "2024-05-01" includes that whole day.
+    # Raises ValueError for malformed times.
+    start = end = None
+    if since.strip():
+        start = np.datetime64(since.strip(), 's')
+    if until.strip():
+        end = np.datetime64(until.strip())
+        end = end + np.timedelta64(1, np.datetime_data(end.dtype)[0])
+    return start, end
+
+
+def build_report(parsed, module_ids, schema, since='', until=''):
+    offsets, times, values = parsed.arrays(module_ids)
+    owner = np.repeat(np.arange(len(module_ids)), np.diff(offsets))
+
+    # Live parameters in sheet order; columns no module has stored yet are all NaN
+    ids = np.array(schema.live_ids, dtype=np.int64)
+    if values.shape[1] <= (ids.max() if len(ids) else -1):
+        values = np.pad(values, ((0, 0), (0, ids.max() + 1 - values.shape[1])),
+                        constant_values=np.nan)
+    values = values[:, ids]
+
+    keep = ~np.isnat(times)
+    start, end = time_range(since, until)
+    if start is not None:
+        keep &= times >= start
+    if end is not None:
+        keep &= times < end
+    times, values, owner = times[keep], values[keep], owner[keep]
+
+    # Numeric parameters only
+    numeric = ~np.isnan(values)
+    columns = np.flatnonzero(numeric.any(axis=0))
+    parameters = [schema.parameters[column] for column in columns]
+    values, numeric = values[:, columns], numeric[:, columns]
+
+    # Each module's newest entry in range (rows are oldest first per module)
+    reverse_owner = owner[::-1]
+    modules_present, last_from_end = np.unique(reverse_owner, return_index=True)
+    current = values[len(owner) - 1 - last_from_end]
+
+    with warnings.catch_warnings():
+        # All-NaN columns give NaN statistics, which is what we want
+        warnings.simplefilter('ignore', RuntimeWarning)
+        counts = (~np.isnan(current)).sum(axis=0)
+        means = np.nanmean(current, axis=0)
+        stds = np.nanstd(current, axis=0)
+        minima = np.nanmin(current, axis=0) if len(current) else np.full(len(columns), np.nan)
+        maxima = np.nanmax(current, axis=0) if len(current) else np.full(len(columns), np.nan)
+        if len(current):
+            percentiles = np.nanpercentile(current, PERCENTILES, axis=0)
+        else:
+            percentiles = np.full((len(PERCENTILES), len(columns)), np.nan)
+
+    # Mean per calendar day: sort entries by day and sum each day's block
+    days = times.astype('datetime64[D]')
+    order = np.argsort(days, kind='stable')
+    unique_days, starts = np.unique(days[order], return_index=True)
+    if len(order):
+        sums = np.add.reduceat(np.where(numeric, values, 0.0)[order], starts, axis=0)
+        daily_counts = np.add.reduceat(numeric[order].astype(np.int64), starts, axis=0)
+    else:
+        sums = np.zeros((0, len(columns)))
+        daily_counts = np.zeros((0, len(columns)), dtype=np.int64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        daily_means = sums / daily_counts
+
+    # Drift: slope of the daily means over time, least squares weighted by the
+    # number of values each day contributes
+    x = (unique_days - unique_days[0]).astype(np.float64)[:, None] if len(unique_days) else \
+        np.zeros((0, 1))
+    weights = daily_counts.astype(np.float64)
+    y = np.where(daily_counts > 0, daily_means, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        total = weights.sum(axis=0)
+        x_mean = (weights * x).sum(axis=0) / total
+        y_mean = (weights * y).sum(axis=0) / total
+        spread = (weights * (x - x_mean) ** 2).sum(axis=0)
+        drift = (weights * (x - x_mean) * (y - y_mean)).sum(axis=0) / spread
+    drift[~(spread > 0)] = np.nan
+
+    summary = []
+    histograms = []
+    for i, name in enumerate(parameters):
+        summary.append({
+            'parameter': name,
+            'modules': int(counts[i]),
+            'mean': means[i],
+            'std': stds[i],
+            'min': minima[i],
+            **{f"p{p}": percentiles[k, i] for k, p in enumerate(PERCENTILES)},
+            'max': maxima[i],
+            'entries': int(numeric[:, i].sum()),
+            'drift_per_day': drift[i],
+            'drift_per_30_days': drift[i] * 30
+        })
+        column = current[:, i]
+        column = column[~np.isnan(column)]
+        histograms.append(np.histogram(column, bins=HISTOGRAM_BINS) if len(column) else None)
+
+    return Report(parameters, len(modules_present), len(times), summary,
+                  [str(day) for day in unique_days], daily_means, daily_counts, histograms,
+                  since, until)
+
+
+SUMMARY_FIELDS = (['parameter', 'modules', 'mean', 'std', 'min']
+                  + [f"p{p}" for p in PERCENTILES]
+                  + ['max', 'entries', 'drift_per_day', 'drift_per_30_days'])
+
+
+def format_number(value):
+    if isinstance(value, (int, np.integer)):
+        return str(value)
+    if np.isnan(value):
+        return ''
+    return f"{value:.6g}"
+
+
+def write_csv(report, path):
+    # One row per parameter
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(SUMMARY_FIELDS)
+        for row in report.summary:
+            writer.writerow([row['parameter']] + [format_number(row[field])
+                                                  for field in SUMMARY_FIELDS[1:]])
+
+
+def write_html(report, path):
+    # Summary table, a histogram per parameter and the daily means
+    def cell(value, tag='td'):
+        return f"<{tag}>{html.escape(value)}</{tag}>"
+
+    scope = "all history"
+    if report.since or report.until:
+        scope = f"saves from {report.since or 'the start'} to {report.until or 'now'}"
+    lines = [
+        "<!DOCTYPE html>",
+        "<html><head><meta charset='utf-8'><title>Module parameter report</title>",
+        "<style>body{font-family:sans-serif} table{border-collapse:collapse;margin-bottom:2em}"
+        " td,th{border:1px solid #ccc;padding:2px 6px;text-align:right}"
+        " td:first-child,th:first-child{text-align:left}"
+        " .bar{background:#4a7fb5;height:10px}</style></head><body>",
+        "<h1>Module parameter report</h1>",
+        f"<p>Generated {html.escape(report.generated)} over {html.escape(scope)}: "
+        f"{report.modules} modules, {report.entries} history entries.</p>",
+        "<h2>Summary</h2>",
+        "<p>Distribution columns use each module's latest value; drift is the slope of the "
+        "daily means.</p>",
+        "<table><tr>" + ''.join(cell(field, 'th') for field in SUMMARY_FIELDS) + "</tr>"
+    ]
+    for row in report.summary:
+        lines.append("<tr>" + cell(row['parameter'])
+                     + ''.join(cell(format_number(row[field])) for field in SUMMARY_FIELDS[1:])
+                     + "</tr>")
+    lines.append("</table>")
+
+    lines.append("<h2>Distributions</h2>")
+    for name, histogram in zip(report.parameters, report.histograms):
+        if histogram is None:
+            continue
+        counts, edges = histogram
+        lines.append(f"<h3>{html.escape(name)}</h3><table>")
+        peak = max(counts.max(), 1)
+        for k, count in enumerate(counts):
+            width = int(200 * count / peak)
+            lines.append(f"<tr><td>{format_number(edges[k])} – {format_number(edges[k + 1])}</td>"
+                         f"<td>{count}</td><td style='text-align:left'>"
+                         f"<div class='bar' style='width:{width}px'></div></td></tr>")
+        lines.append("</table>")
+
+    lines.append("<h2>Daily means</h2>")
+    lines.append("<table><tr>" + cell('day', 'th')
+                 + ''.join(cell(name, 'th') for name in report.parameters) + "</tr>")
+    for d, day in enumerate(report.days):
+        lines.append("<tr>" + cell(day)
+                     + ''.join(cell(format_number(mean)) for mean in report.daily_means[d])
+                     + "</tr>")
+    lines.append("</table></body></html>")
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def write_report(report, path):
+    if path.lower().endswith(('.html', '.htm')):
+        write_html(report, path)
+    else:
+        write_csv(report, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='uiWireBonder.py report',
+        description="Write per-parameter statistics over all module history as CSV or HTML "
+                    "(chosen by the file extension).")
+    parser.add_argument('output', help="report file, e.g. report.html or summary.csv")
+    parser.add_argument('--since', default='',
+                        help="only entries saved at or after this time (YYYY-MM-DD[ HH:MM:SS])")
+    parser.add_argument('--until', default='',
+                        help="only entries saved up to this day (YYYY-MM-DD, inclusive)")
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default='json',
+                        help="local storage backend, as for the UI")
+    args = parser.parse_args(argv)
+
+    try:
+        require_numpy()
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return EXIT_FAILED
+    try:
+        time_range(args.since, args.until)
+    except ValueError as e:
+        print(f"Bad time range: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    started = time.perf_counter()
+    store = open_storage(args.storage, read_only=True)
+    try:
+        module_params = store.load()
+        schema = SheetSchema.from_json(store.load_schema())
+    finally:
+        store.close()
+    if not schema.header:
+        print("No cached sheet header yet; start the UI once or run `sync --pull` first",
+              file=sys.stderr)
+        return EXIT_FAILED
+
+    try:
+        parsed = ParsedHistories.open()
+        module_ids = list(module_params)
+        parsed_count = parsed.update(stale_histories(module_params, parsed), module_ids)
+        report = build_report(parsed, module_ids, schema, args.since, args.until)
+        write_report(report, args.output)
+        if parsed.changed:
+            parsed.save()
+    except OSError as e:
+        print(f"Could not write the report: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    print(f"Wrote {args.output}: {len(report.parameters)} parameters, {report.modules} modules, "
+          f"{report.entries} entries ({parsed_count} modules parsed, "
+          f"{time.perf_counter() - started:.1f} s)")
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+import tkinter as tk
+from tkinter import ttk
+
+
+class ParameterForm(ttk.Frame):
+    # One Label/Entry row per sheet parameter, built once per header. Switching
+    # modules only rewrites the entry contents; edited fields are tracked
+    # against the values last loaded and marked with '*'.
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.parameters = []
+        self.labels = []
+        self.entries = {}
+        self.vars = []
+        self.baseline = []
+        self.dirty = set()
+        self.loading = False
+
+    def build(self, parameters):
+        if list(parameters) == self.parameters:
+            return False
+
+        for widget in self.winfo_children():
+            widget.destroy()
+        self.parameters = list(parameters)
+        self.labels = []
+        self.entries = {}
+        self.vars = []
+
+        for i, param_name in enumerate(self.parameters):
+            label = ttk.Label(self, text=f"{param_name}:")
+            label.grid(row=i, column=0, pady=2, padx=5, sticky='e')
+            var = tk.StringVar()
+            var.trace_add('write', lambda *args, column=i: self.on_edit(column))
+            entry = ttk.Entry(self, textvariable=var)
+            entry.grid(row=i, column=1, pady=2, padx=5, sticky='w')
+            self.labels.append(label)
+            self.vars.append(var)
+            self.entries[param_name] = entry
+
+        self.load([])
+        return True
+
+    def load(self, values):
+        # Show `values` (padded to the header) and treat them as unedited
+        self.loading = True
+        self.baseline = [values[i] if i < len(values) else ''
+                         for i in range(len(self.parameters))]
+        for var, value in zip(self.vars, self.baseline):
+            if var.get() != value:
+                var.set(value)
+        self.loading = False
+        self.mark_clean()
+
+    def clear(self):
+        self.load([])
+
+    def values(self):
+        return [var.get() for var in self.vars]
+
+    def dirty_fields(self):
+        return sorted(self.dirty)
+
+    def mark_clean(self):
+        for column in self.dirty:
+            self.labels[column].config(text=f"{self.parameters[column]}:")
+        self.dirty = set()
+        self.baseline = self.values()
+
+    def on_edit(self, column):
+        if self.loading:
+            return
+        was_dirty = column in self.dirty
+        if self.vars[column].get() != self.baseline[column]:
+            self.dirty.add(column)
+        else:
+            self.dirty.discard(column)
+        if was_dirty != (column in self.dirty):
+            marker = " *" if column in self.dirty else ""
+            self.labels[column].config(text=f"{self.parameters[column]}:{marker}")
@@ -0,0 +1,125 @@
+from history_store import CompactHistory, intern_values
+from sheet_sync import row_key
+
+
+def iter_sheet_pages(sheet, page_size=1000, start_row=2, pages_per_request=1):
+    # Fetch data rows in ranged pages ("2:1001", "1002:2001", ...) instead of
+    # pulling the whole sheet with get_all_values(). With pages_per_request > 1
+    # several pages come back from one batch_get request, which matters more
+    # against the per-minute quota than the larger response does.
+    row = start_row
+    while True:
+        if pages_per_request > 1:
+            ranges = [f"{row + i * page_size}:{row + (i + 1) * page_size - 1}"
+                      for i in range(pages_per_request)]
+            pages = sheet.batch_get(ranges)
+        else:
+            pages = [sheet.get(f"{row}:{row + page_size - 1}")]
+        for page in pages:
+            rows = [list(values) for values in page]
+            if rows:
+                yield row, rows
+            if len(rows) < page_size:
+                return
+            row += page_size
+
+
+class SheetMerger:
+    # Merges sheet rows into the local module_params. Rows are matched by their
+    # origin (station:revision), or by (module_id, timestamp) when they carry
+    # none. Rows already known locally are skipped; local entries that were
+    # never pushed stay the newest entries of their module, so unsynced edits win.
+    def __init__(self, module_params, sync_state, history_index, layout):
+        self.module_params = module_params
+        self.sync_state = sync_state
+        self.history_index = history_index
+        self.layout = layout
+        self.rows_read = 0
+        self.rows_added = 0
+        self.changed = set()
+        # Keys of every row seen on the sheet, see sheet_sync.row_key
+        self.seen = set()
+
+    def merge(self, rows):
+        # Returns the ids of the modules changed by this batch of rows
+        incoming = {}
+        for row in rows:
+            if len(row) < 2 or not row[1]:
+                continue
+            self.rows_read += 1
+            timestamp, module_id, values, origin, base = self.layout.parse(row)
+            self.seen.add(row_key(module_id, timestamp, origin))
+            incoming.setdefault(module_id, {})[origin or timestamp] = {
+                'timestamp': timestamp,
+                'parameters': values,
+                'origin': origin,
+                'base': base
+            }
+
+        changed = set()
+        for module_id, entries in incoming.items():
+            if self.merge_module(module_id, entries.values()):
+                changed.add(module_id)
+        self.changed |= changed
+        return changed
+
+    def merge_module(self, module_id, entries):
+        module_data = self.module_params.get(module_id)
+        if module_data is None:
+            history = CompactHistory()
+            module_data = {'parameters': [], 'created': '', 'modified': '', 'history': history}
+            known_origins = set()
+            known_timestamps = set()
+            pushed = 0
+        else:
+            history = module_data['history']
+            known_origins = set(history.origins)
+            known_timestamps = set(history.timestamps)
+            # The module's first sheet row may only live in 'parameters'
+            known_timestamps.add(module_data['created'])
+            known_timestamps.add(module_data['modified'])
+            pushed = min(self.sync_state.watermarks.get(module_id, 0), len(history))
+
+        new_entries = []
+        for entry in entries:
+            if entry['origin']:
+                if entry['origin'] not in known_origins:
+                    new_entries.append(entry)
+            elif entry['timestamp'] not in known_timestamps:
+                new_entries.append(entry)
+        new_entries.sort(key=lambda entry: entry['timestamp'])
+        if not new_entries:
+            return False
+
+        if pushed == len(history) and (not history
+                                       or new_entries[0]['timestamp'] >= history.timestamps[-1]):
+            # Everything local is on the sheet and the new rows are newer: append
+            for entry in new_entries:
+                entry['seq'] = self.history_index.new_seq()
+                history.append(entry)
+                self.history_index.appended(module_id, history)
+            pushed = len(history)
+        else:
+            # Rebuild: sheet rows sorted in with the pushed prefix, unpushed
+            # local entries kept after them
+            local = history.entries()
+            synced = local[:pushed]
+            for entry in new_entries:
+                entry['seq'] = self.history_index.new_seq()
+                synced.append(entry)
+            synced.sort(key=lambda entry: entry['timestamp'])
+
+            history = CompactHistory(synced + local[pushed:])
+            module_data['history'] = history
+            self.history_index.index_module(module_id, history)
+            pushed = len(synced)
+        module_data['parameters'] = list(intern_values(history.latest))
+        module_data['modified'] = history.timestamps[-1]
+        first = min(history.timestamps)
+        if not module_data['created'] or first < module_data['created']:
+            module_data['created'] = first
+
+        self.module_params[module_id] = module_data
+        self.sync_state.watermarks[module_id] = pushed
+        self.rows_added += len(new_entries)
+        return True
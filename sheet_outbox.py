@@ -0,0 +1,222 @@
+import json
+import os
+import threading
+import time
+
+from instrumentation import metrics
+from sheet_schema import SheetLayout, column_keys
+
+
+class SheetOutbox:
+    # Durable queue of row batches waiting to be appended to the sheet.
+    # One JSON line per batch; removing flushed batches rewrites the file atomically.
+    def __init__(self, path='sheet_outbox.jsonl'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.batches = []
+        self.next_id = 1
+        torn = False
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        batch = json.loads(line)
+                    except ValueError:
+                        # Torn write from a crash
+                        torn = True
+                        break
+                    self.batches.append(batch)
+        except FileNotFoundError:
+            pass
+        if torn:
+            self.rewrite()
+        if self.batches:
+            self.next_id = self.batches[-1]['id'] + 1
+
+    def add(self, rows, header=None):
+        # `header` is the sheet header the rows were laid out for
+        with self.lock:
+            batch = {'id': self.next_id, 'queued': time.time(), 'rows': rows}
+            if header is not None:
+                batch['header'] = header
+            self.next_id += 1
+            line = json.dumps(batch) + '\n'
+            with metrics.span('outbox.add'):
+                with open(self.path, 'a') as f:
+                    f.write(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+            metrics.count('disk.bytes_written', len(line))
+            self.batches.append(batch)
+            return batch['id']
+
+    def pending(self):
+        with self.lock:
+            return list(self.batches)
+
+    def pending_rows(self):
+        with self.lock:
+            return sum(len(batch['rows']) for batch in self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+    def remove(self, batch_ids):
+        batch_ids = set(batch_ids)
+        with self.lock:
+            self.batches = [batch for batch in self.batches if batch['id'] not in batch_ids]
+            self.rewrite()
+
+    def clear(self):
+        with self.lock:
+            self.batches = []
+            self.rewrite()
+
+    def rewrite(self):
+        tmp_path = self.path + '.tmp'
+        with metrics.span('outbox.rewrite'):
+            with open(tmp_path, 'w') as f:
+                for batch in self.batches:
+                    f.write(json.dumps(batch) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+                written = f.tell()
+            os.replace(tmp_path, self.path)
+        metrics.count('disk.bytes_written', written)
+
+
+class OutboxFlusher:
+    # Background thread that pushes the outbox to the sheet. Failed attempts are
+    # retried with exponential backoff; everything queued is coalesced into as
+    # few append_rows calls as possible.
+    def __init__(self, outbox, get_sheet, base_delay=2.0, max_delay=300.0,
+                 max_rows_per_call=5000, header_ttl=60.0):
+        self.outbox = outbox
+        self.get_sheet = get_sheet
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_rows_per_call = max_rows_per_call
+        # How long a header read before a flush is trusted
+        self.header_ttl = header_ttl
+        self.header_seen = None
+        self.header_checked = None
+
+        # Held while talking to the sheet; other writers take it to avoid interleaving
+        self.lock = threading.Lock()
+        self.wake_event = threading.Event()
+        self.stopped = False
+        self.thread = None
+
+        self.failures = 0
+        self.retry_at = None
+        self.last_error = None
+        self.last_latency = None
+        self.last_flush = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.wake_event.set()
+
+    def wake(self):
+        # Flush now instead of waiting for the backoff timer
+        self.wake_event.set()
+
+    def next_delay(self):
+        return min(self.max_delay, self.base_delay * (2 ** (self.failures - 1)))
+
+    def flush_once(self):
+        # Returns the number of rows pushed; raises if the sheet call fails
+        if not len(self.outbox):
+            return 0
+
+        sheet = self.get_sheet()
+        if sheet is None:
+            raise ConnectionError("Not connected to Google Sheets")
+
+        pushed = 0
+        with self.lock:
+            batches = self.outbox.pending()
+            if any('header' in batch for batch in batches):
+                header = self.live_header(sheet)
+                batches = [relayout(batch, header) for batch in batches]
+            while batches:
+                # Coalesce whole batches up to the per-call row limit
+                chunk = [batches.pop(0)]
+                rows = list(chunk[0]['rows'])
+                while batches and len(rows) + len(batches[0]['rows']) <= self.max_rows_per_call:
+                    batch = batches.pop(0)
+                    chunk.append(batch)
+                    rows.extend(batch['rows'])
+
+                start = time.monotonic()
+                sheet.append_rows(rows)
+                self.last_latency = time.monotonic() - start
+                self.outbox.remove([batch['id'] for batch in chunk])
+                pushed += len(rows)
+
+        if pushed:
+            self.last_flush = time.time()
+        return pushed
+
+    def live_header(self, sheet):
+        # The sheet's header row, re-read at most every header_ttl seconds
+        now = time.monotonic()
+        if self.header_checked is None or now - self.header_checked >= self.header_ttl:
+            self.header_seen = sheet.row_values(1)
+            self.header_checked = now
+        return self.header_seen
+
+    def run(self):
+        while not self.stopped:
+            try:
+                self.flush_once()
+            except Exception as e:
+                self.failures += 1
+                self.last_error = e
+                delay = self.next_delay()
+                self.retry_at = time.time() + delay
+            else:
+                self.failures = 0
+                self.last_error = None
+                self.retry_at = None
+                delay = None
+
+            self.wake_event.wait(delay)
+            self.wake_event.clear()
+
+    def status_text(self):
+        batches = len(self.outbox)
+        if batches:
+            text = f"Pending: {batches} batches ({self.outbox.pending_rows()} rows)"
+        else:
+            text = "Pending: none"
+        if self.last_latency is not None:
+            text += f" | last flush {self.last_latency:.2f}s"
+        if self.retry_at is not None and batches:
+            text += f" | offline, retry in {max(0, self.retry_at - time.time()):.0f}s"
+        return text
+
+
+def relayout(batch, header):
+    # Move a batch's cells to where the columns are now, matching by name, if
+    # the sheet header changed after the rows were queued
+    if not header or 'header' not in batch or batch['header'] == header:
+        return batch
+    old = SheetLayout(batch['header'])
+    new = SheetLayout(header)
+    old_keys = column_keys(old.parameters)
+    new_positions = dict(zip(column_keys(new.parameters), range(len(new.parameters))))
+    rows = []
+    for row in batch['rows']:
+        timestamp, module_id, values, origin, base = old.parse(row)
+        moved = [''] * len(new.parameters)
+        for key, value in zip(old_keys, values):
+            if key in new_positions:
+                moved[new_positions[key]] = value
+        rows.append(new.row(timestamp, module_id, moved, origin, base))
+    return dict(batch, rows=rows, header=header)
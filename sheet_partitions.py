@@ -0,0 +1,578 @@
+#!/usr/bin/env python3
+
+# History spread over several worksheets of the spreadsheet, so no single
+# worksheet grows without bound and reads only fetch what changed.
+#
+#   python3 uiWireBonder.py partition --status
+#   python3 uiWireBonder.py partition --enable month          # or year
+#   python3 uiWireBonder.py partition --enable modules --bounds HB-0500,HB-1000
+#   python3 uiWireBonder.py partition --split HB-0750
+#   python3 uiWireBonder.py partition --archive-before 2024-06
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from instrumentation import metrics
+
+INDEX_TITLE = 'Partitions'
+INDEX_HEADER = ['Worksheet', 'Kind', 'From', 'To', 'Status', 'Updated']
+STATUS_COLUMN = 'E'
+UPDATED_COLUMN = 'F'
+
+# Period partitions hold the rows saved in one month or year; the value is the
+# length of the timestamp prefix naming the period ("2024-05", "2024")
+PERIODS = {'month': 7, 'year': 4}
+# Module partitions hold the modules whose id is in [From, To) ('' = open)
+MODULES = 'modules'
+# The worksheet that held everything before partitioning; read, never written
+LEGACY = 'legacy'
+
+ACTIVE = 'active'
+ARCHIVED = 'archived'
+
+TITLE_PREFIX = 'History'
+
+# How long a read of the index is trusted for routing rows
+INDEX_TTL = 60.0
+
+READS_PATH = 'sheet_reads.json'
+
+# Exit codes, as for `sync`
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+
+def period_title(key):
+    return f"{TITLE_PREFIX} {key}"
+
+
+def module_range_title(low, high):
+    return f"{TITLE_PREFIX} {low}..{high}"
+
+
+def new_marker():
+    # Written to a partition's Updated cell after every append. Readers only
+    # compare it for equality, so clocks of different stations do not matter.
+    return f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} {uuid.uuid4().hex[:6]}"
+
+
+class Partition:
+    # One row of the index worksheet. `row` is its row number there, None for
+    # a partition that does not exist yet.
+    def __init__(self, title, kind, low='', high='', status=ACTIVE, updated='', row=None):
+        self.title = title
+        self.kind = kind
+        self.low = low
+        self.high = high
+        self.status = status
+        self.updated = updated
+        self.row = row
+
+    @classmethod
+    def from_row(cls, cells, row):
+        cells = list(cells) + [''] * (len(INDEX_HEADER) - len(cells))
+        title, kind, low, high, status, updated = cells[:len(INDEX_HEADER)]
+        return cls(title, kind, low, high, status or ACTIVE, updated, row)
+
+    def to_row(self):
+        return [self.title, self.kind, self.low, self.high, self.status, self.updated]
+
+    @property
+    def archived(self):
+        return self.status == ARCHIVED
+
+    def holds(self, timestamp, module_id):
+        if self.kind in PERIODS:
+            return timestamp[:PERIODS[self.kind]] == self.low
+        if self.kind == MODULES:
+            return self.low <= module_id and (not self.high or module_id < self.high)
+        return False
+
+
+class PartitionIndex:
+    # The partitions in index order (the legacy worksheet first, then in the
+    # order they were created). If two stations created the same partition at
+    # once, the first row wins.
+    def __init__(self, partitions=()):
+        self.partitions = []
+        self.by_title = {}
+        for partition in partitions:
+            if partition.title and partition.title not in self.by_title:
+                self.partitions.append(partition)
+                self.by_title[partition.title] = partition
+
+    @classmethod
+    def from_rows(cls, rows):
+        return cls(Partition.from_row(cells, row)
+                   for row, cells in enumerate(rows[1:], 2) if cells and cells[0])
+
+    def period_kind(self):
+        for partition in reversed(self.partitions):
+            if partition.kind in PERIODS:
+                return partition.kind
+        return None
+
+    def module_ranges(self):
+        return [partition for partition in self.partitions if partition.kind == MODULES]
+
+    def route(self, timestamp, module_id, now=None):
+        # The partition a row belongs in, or a new Partition (row None) that
+        # has to be created first. Rows of an archived period go to the
+        # current period instead.
+        ranges = self.module_ranges()
+        if ranges:
+            for partition in ranges:
+                if partition.holds(timestamp, module_id):
+                    return partition
+            raise ValueError(f"No partition holds module '{module_id}'; check the "
+                             f"{INDEX_TITLE} worksheet")
+        kind = self.period_kind()
+        if kind is None:
+            raise ValueError(f"The {INDEX_TITLE} worksheet has no period or module partitions")
+        key = timestamp[:PERIODS[kind]]
+        partition = self.by_title.get(period_title(key))
+        if partition is None:
+            return Partition(period_title(key), kind, key, key)
+        if partition.archived:
+            now = now or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            if now[:PERIODS[kind]] == key:
+                raise ValueError(f"'{partition.title}' is archived but is the current period")
+            return self.route(now, module_id, now)
+        return partition
+
+    def current(self):
+        # The partition whose header new partitions copy: the newest active
+        # one, or the legacy worksheet before any other exists
+        for partition in reversed(self.partitions):
+            if not partition.archived and partition.kind != LEGACY:
+                return partition
+        return self.partitions[0] if self.partitions else None
+
+
+class PartitionedSheet:
+    # Stands in for the single history worksheet once the spreadsheet has an
+    # index worksheet. append_rows() routes every row to its partition,
+    # creating the partition on first use, and stamps the partitions it wrote
+    # in the index. Header reads (row_values, col_count) go to the current
+    # partition; header writes (add_cols, update) to every active partition,
+    # since any of them may still receive rows. `wrap` is applied to the
+    # spreadsheet and every worksheet, e.g. sheets_client.wrap_sheet for
+    # quota handling.
+    def __init__(self, spreadsheet, wrap=None, worksheets=None):
+        self.wrap = wrap or (lambda sheet: sheet)
+        self.spreadsheet = self.wrap(spreadsheet)
+        self.title = spreadsheet.title
+        self.lock = threading.RLock()
+        self.sheets = {}
+        for sheet in worksheets if worksheets is not None else self.spreadsheet.worksheets():
+            self.sheets[sheet.title] = self.wrap(sheet)
+        self.index_sheet = self.sheets[INDEX_TITLE]
+        self.index = None
+        self.index_read = None
+        # Rows a failed append_rows() call did write; the outbox retries the
+        # whole call, so they are left out the next time
+        self.written = set()
+        self.unstamped = set()
+
+    def load_index(self, max_age=INDEX_TTL):
+        with self.lock:
+            now = time.monotonic()
+            if self.index is None or now - self.index_read >= max_age:
+                self.index = PartitionIndex.from_rows(self.index_sheet.get_all_values())
+                self.index_read = now
+            return self.index
+
+    def worksheet(self, title):
+        with self.lock:
+            if title not in self.sheets:
+                self.sheets[title] = self.wrap(self.spreadsheet.worksheet(title))
+            return self.sheets[title]
+
+    def current_sheet(self):
+        return self.worksheet(self.load_index().current().title)
+
+    def row_values(self, row):
+        return self.current_sheet().row_values(row)
+
+    @property
+    def col_count(self):
+        return self.current_sheet().col_count
+
+    def active_sheets(self):
+        return [self.worksheet(partition.title) for partition in self.load_index().partitions
+                if not partition.archived and partition.kind != LEGACY]
+
+    def add_cols(self, cols):
+        for sheet in self.active_sheets():
+            sheet.add_cols(cols)
+
+    def update(self, *args, **kwargs):
+        for sheet in self.active_sheets():
+            sheet.update(*args, **kwargs)
+
+    def group(self, rows, index):
+        groups = {}
+        for row in rows:
+            partition = index.route(row[0], row[1])
+            groups.setdefault(partition.title, (partition, []))[1].append(row)
+        return list(groups.values())
+
+    def append_rows(self, rows, **kwargs):
+        with self.lock:
+            if self.written:
+                rows = [row for row in rows if tuple(row) not in self.written]
+            groups = self.group(rows, self.load_index())
+            if any(partition.row is None for partition, _ in groups):
+                # Another station may have created it already
+                groups = self.group(rows, self.load_index(max_age=0))
+            header = None
+            for partition, partition_rows in groups:
+                if partition.row is None:
+                    if header is None:
+                        header = self.current_sheet().row_values(1)
+                    self.create(partition, header, len(partition_rows))
+            if any(partition.row is None for partition, _ in groups):
+                index = self.load_index(max_age=0)
+                groups = [(index.by_title[partition.title], partition_rows)
+                          for partition, partition_rows in groups]
+
+            for partition, partition_rows in groups:
+                try:
+                    self.worksheet(partition.title).append_rows(partition_rows, **kwargs)
+                except Exception:
+                    # The partition may have been archived since the index
+                    # was read; route the retry with a fresh one
+                    self.index = None
+                    raise
+                self.written.update(tuple(row) for row in partition_rows)
+                self.unstamped.add(partition.title)
+            self.stamp()
+            self.written.clear()
+
+    def stamp(self):
+        # Write a new Updated marker for every partition appended to since
+        # the last stamp, so readers know to look at it again. Until this
+        # succeeds the rows stay unannounced; "Resync Sheet" reads them anyway.
+        if not self.unstamped:
+            return
+        index = self.load_index()
+        updates = []
+        for title in sorted(self.unstamped):
+            partition = index.by_title[title]
+            partition.updated = new_marker()
+            updates.append({'range': f"{UPDATED_COLUMN}{partition.row}",
+                            'values': [[partition.updated]]})
+        self.index_sheet.batch_update(updates)
+        self.unstamped.clear()
+
+    def create(self, partition, header, rows):
+        try:
+            sheet = self.spreadsheet.add_worksheet(partition.title, rows=rows + 1,
+                                                   cols=max(len(header), 1))
+        except Exception:
+            # Lost a race with another station creating the same partition;
+            # re-raises if the worksheet really could not be created
+            sheet = self.spreadsheet.worksheet(partition.title)
+        sheet = self.wrap(sheet)
+        # Both stations write the same header, and before any row goes in
+        if not sheet.row_values(1):
+            sheet.update(range_name='A1', values=[header])
+        self.sheets[partition.title] = sheet
+        self.index_sheet.append_rows([partition.to_row()])
+        metrics.count('sheet.partitions_created')
+
+
+def open_history(spreadsheet, wrap=None):
+    # The history of `spreadsheet`: partitioned if it has an index worksheet,
+    # otherwise its first worksheet
+    wrap = wrap or (lambda sheet: sheet)
+    worksheets = wrap(spreadsheet).worksheets()
+    if any(sheet.title == INDEX_TITLE for sheet in worksheets):
+        return PartitionedSheet(spreadsheet, wrap, worksheets)
+    return wrap(worksheets[0])
+
+
+class SheetReads:
+    # Where the last read stopped in each worksheet: the number of the last
+    # row read, that row's cells (to notice rows deleted or moved since) and
+    # the partition's Updated stamp seen before reading it. Positions are
+    # staged in `pending` while reading and saved by commit() once the rows
+    # are merged into local storage.
+    def __init__(self, path=READS_PATH):
+        self.path = path
+        self.pending = {}
+        try:
+            with open(self.path, 'r') as f:
+                self.positions = json.load(f)
+        except FileNotFoundError:
+            self.positions = {}
+        except ValueError:
+            # Unreadable: the next read starts from the top
+            self.positions = {}
+
+    def get(self, title):
+        return self.positions.get(title)
+
+    def commit(self):
+        if not self.pending:
+            return
+        self.positions.update(self.pending)
+        self.pending = {}
+        tmp_path = self.path + '.tmp'
+        with metrics.span('sheet_reads.save'):
+            with open(tmp_path, 'w') as f:
+                json.dump(self.positions, f)
+                written = f.tell()
+            os.replace(tmp_path, self.path)
+        metrics.count('disk.bytes_written', written)
+
+
+def iter_worksheet(sheet, start_row, page_size, pages_per_request):
+    # (row number, rows) pages from start_row to the end of the worksheet,
+    # several pages per batch_get. When start_row is past the header, the
+    # header row comes first as its own (1, [header]) page, from the same request.
+    ranges = ['1:1'] if start_row > 1 else []
+    row = start_row
+    while True:
+        ranges += [f"{row + i * page_size}:{row + (i + 1) * page_size - 1}"
+                   for i in range(pages_per_request)]
+        pages = sheet.batch_get(ranges)
+        if ranges[0] == '1:1':
+            yield 1, [list(values) for values in pages.pop(0)]
+        ranges = []
+        for page in pages:
+            rows = [list(values) for values in page]
+            if rows:
+                yield row, rows
+            if len(rows) < page_size:
+                return
+            row += page_size
+
+
+def read_worksheet(sheet, position, page_size, pages_per_request):
+    # (header, first row number, rows) pages of one worksheet; header is set
+    # on the first page only. Continues after `position` when the row read
+    # last is still where it was, otherwise reads from the top.
+    if position is not None and position['row'] > 1:
+        pages = iter_worksheet(sheet, position['row'], page_size, pages_per_request)
+        header = next(pages)[1]
+        first = next(pages, None)
+        if header and first is not None and first[1][0] == position['last']:
+            row_number, rows = first
+            yield header[0], row_number + 1, rows[1:]
+            for row_number, rows in pages:
+                yield None, row_number, rows
+            return
+        pages.close()
+        metrics.count('sheet.rereads')
+
+    for row_number, rows in iter_worksheet(sheet, 1, page_size, pages_per_request):
+        if row_number == 1:
+            yield rows[0], 2, rows[1:]
+        else:
+            yield None, row_number, rows
+
+
+def iter_history_pages(sheet, reads=None, full=False, page_size=1000, pages_per_request=5):
+    # (worksheet title, header, first row number, rows) for every history row
+    # of a plain or partitioned sheet, partitions in index order, with each
+    # worksheet's header on its first page (None after). With `reads` (a
+    # SheetReads) and not `full`, partitions whose Updated stamp is unchanged
+    # are skipped and the rest are read from where the last read stopped. The
+    # new positions are staged in reads.pending as pages are consumed.
+    current = None
+    if isinstance(sheet, PartitionedSheet):
+        index = sheet.load_index(max_age=0)
+        targets = [(sheet.worksheet(partition.title), partition.title, partition.updated)
+                   for partition in index.partitions]
+        current = index.current().title
+    else:
+        targets = [(sheet, sheet.title, None)]
+
+    header_from = None
+    for worksheet, title, updated in targets:
+        position = None
+        if reads is not None and not full:
+            position = reads.get(title)
+            if (position is not None and updated is not None
+                    and position.get('updated') == updated):
+                continue
+        staged = None
+        for header, start_row, rows in read_worksheet(worksheet, position, page_size,
+                                                      pages_per_request):
+            if header:
+                header_from = title
+                if staged is None and position is None:
+                    # A worksheet with no rows yet is recorded by its header
+                    staged = {'row': 1, 'last': header, 'updated': updated}
+            yield title, header or None, start_row, rows
+            if rows:
+                staged = {'row': start_row + len(rows) - 1, 'last': rows[-1],
+                          'updated': updated}
+            if reads is not None and staged is not None:
+                reads.pending[title] = staged
+        if reads is not None and staged is None and position is not None:
+            # Nothing new, but remember the stamp so it is skipped next time
+            reads.pending[title] = dict(position, updated=updated)
+
+    if header_from is not None and current is not None and header_from != current:
+        # Older partitions may have fewer columns; end on the header new rows
+        # are written with
+        yield current, sheet.worksheet(current).row_values(1), 2, []
+
+
+def enable_partitioning(spreadsheet, by='month', bounds=(), now=None):
+    # Add the index worksheet. The first worksheet becomes the legacy
+    # partition; new rows go to period partitions (by='month' or 'year') or
+    # to module id ranges split at `bounds`.
+    worksheets = spreadsheet.worksheets()
+    if any(sheet.title == INDEX_TITLE for sheet in worksheets):
+        raise ValueError("The spreadsheet is already partitioned")
+    legacy = worksheets[0]
+    header = legacy.row_values(1)
+    if not header:
+        raise ValueError(f"'{legacy.title}' has no header row to copy")
+
+    if by in PERIODS:
+        now = now or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        key = now[:PERIODS[by]]
+        partitions = [Partition(period_title(key), by, key, key)]
+    elif by == MODULES:
+        edges = [''] + sorted(set(bound.strip() for bound in bounds if bound.strip())) + ['']
+        if len(edges) < 3:
+            raise ValueError("Module partitions need at least one --bounds module id")
+        partitions = [Partition(module_range_title(low, high), MODULES, low, high)
+                      for low, high in zip(edges, edges[1:])]
+    else:
+        raise ValueError(f"Unknown partitioning '{by}'")
+
+    for partition in partitions:
+        sheet = spreadsheet.add_worksheet(partition.title, rows=1, cols=len(header))
+        sheet.update(range_name='A1', values=[header])
+    rows = [INDEX_HEADER, Partition(legacy.title, LEGACY).to_row()]
+    rows += [partition.to_row() for partition in partitions]
+    index = spreadsheet.add_worksheet(INDEX_TITLE, rows=len(rows), cols=len(INDEX_HEADER))
+    index.update(range_name='A1', values=rows)
+
+
+def split_partition(sheet, bound):
+    # Give module ids from `bound` up their own partition. Rows already in
+    # the old partition stay there; reads cover every partition anyway.
+    index = sheet.load_index(max_age=0)
+    for partition in index.module_ranges():
+        if partition.holds('', bound):
+            break
+    else:
+        raise ValueError("Only module partitions can be split")
+    if bound == partition.low:
+        raise ValueError(f"'{partition.title}' already starts at {bound}")
+    header = sheet.worksheet(partition.title).row_values(1)
+    upper = Partition(module_range_title(bound, partition.high), MODULES, bound, partition.high)
+    sheet.create(upper, header, 0)
+    # Only now stop routing the upper ids to the old partition
+    sheet.index_sheet.update(range_name=f"D{partition.row}", values=[[bound]])
+    sheet.load_index(max_age=0)
+
+
+def archive_partitions(sheet, titles=(), before='', now=None):
+    # Mark partitions archived and protect their worksheets against edits.
+    # `before` archives every period partition (and the legacy worksheet)
+    # older than that period. Returns the archived titles.
+    index = sheet.load_index(max_age=0)
+    now = now or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    chosen = []
+    for partition in index.partitions:
+        wanted = partition.title in titles
+        if before and (partition.kind == LEGACY
+                       or (partition.kind in PERIODS and partition.low < before)):
+            wanted = True
+        if not wanted or partition.archived:
+            continue
+        if partition.kind == MODULES:
+            raise ValueError(f"'{partition.title}' still receives rows and cannot be archived")
+        if partition.kind in PERIODS and partition.low == now[:PERIODS[partition.kind]]:
+            raise ValueError(f"'{partition.title}' is the current period")
+        chosen.append(partition)
+    unknown = set(titles) - set(index.by_title)
+    if unknown:
+        raise ValueError(f"No partition named {', '.join(sorted(unknown))}")
+    if not chosen:
+        return []
+
+    sheet.index_sheet.batch_update([{'range': f"{STATUS_COLUMN}{partition.row}",
+                                     'values': [[ARCHIVED]]} for partition in chosen])
+    sheet.spreadsheet.batch_update({'requests': [
+        {'addProtectedRange': {'protectedRange': {
+            'range': {'sheetId': sheet.worksheet(partition.title).id},
+            'description': f"Archived by uiWireBonder on {now[:10]}"}}}
+        for partition in chosen]})
+    sheet.load_index(max_age=0)
+    return [partition.title for partition in chosen]
+
+
+def print_status(sheet):
+    index = sheet.load_index(max_age=0)
+    print(f"{'Worksheet':<28} {'Kind':<8} {'From':<12} {'To':<12} {'Status':<9} Updated")
+    for partition in index.partitions:
+        print(f"{partition.title:<28} {partition.kind:<8} {partition.low:<12} "
+              f"{partition.high:<12} {partition.status:<9} {partition.updated}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='uiWireBonder.py partition',
+        description="Spread the history over several worksheets and archive old ones. "
+                    "Restart every station after enabling partitioning.")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument('--status', action='store_true', help="list the partitions")
+    action.add_argument('--enable', choices=sorted(PERIODS) + [MODULES],
+                        help="partition new rows by month, by year or by module id range")
+    action.add_argument('--split', metavar='MODULE_ID',
+                        help="start a new module partition at this id")
+    action.add_argument('--archive', metavar='WORKSHEET', action='append',
+                        help="archive this partition (repeatable)")
+    action.add_argument('--archive-before', metavar='PERIOD',
+                        help="archive the legacy worksheet and every period before PERIOD "
+                             "(e.g. 2024-06)")
+    parser.add_argument('--bounds', default='',
+                        help="comma separated module ids where module partitions start "
+                             "(with --enable modules)")
+    parser.add_argument('--sheet', default='uiWireBonder',
+                        help="spreadsheet title (default uiWireBonder)")
+    args = parser.parse_args(argv)
+
+    from sheets_client import open_spreadsheet, wrap_sheet
+
+    try:
+        _, spreadsheet = open_spreadsheet(args.sheet)
+        if args.enable:
+            enable_partitioning(spreadsheet, args.enable, args.bounds.split(','))
+            print(f"Partitioned by {args.enable}; restart every station to pick it up")
+        sheet = open_history(spreadsheet, wrap_sheet)
+        if not isinstance(sheet, PartitionedSheet):
+            print(f"'{args.sheet}' is not partitioned; use --enable", file=sys.stderr)
+            return EXIT_USAGE
+        if args.split:
+            split_partition(sheet, args.split)
+        elif args.archive or args.archive_before:
+            archived = archive_partitions(sheet, args.archive or (), args.archive_before or '')
+            print(f"Archived {', '.join(archived) if archived else 'nothing'}")
+        print_status(sheet)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return EXIT_USAGE
+    except Exception as e:
+        print(f"Failed: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
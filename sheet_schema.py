@@ -0,0 +1,187 @@
+import json
+import os
+import sys
+import time
+
+# Columns that carry the sync protocol rather than a parameter. They are found
+# by name and added to the right of the existing header when missing.
+STATION_COLUMN = 'Station'
+REVISION_COLUMN = 'Revision'
+BASE_COLUMN = 'Base'
+SYNC_COLUMNS = (STATION_COLUMN, REVISION_COLUMN, BASE_COLUMN)
+
+
+def make_origin(station, revision):
+    return sys.intern(f"{station}:{revision}")
+
+
+def split_origin(origin):
+    station, _, revision = origin.rpartition(':')
+    return station, revision
+
+
+class SheetLayout:
+    # Where each field lives in a sheet row, derived from the header row. The
+    # first two columns are the timestamp and module id, sync columns are found
+    # by name and every other column is a parameter.
+    def __init__(self, header):
+        self.header = [sys.intern(name) for name in header]
+        self.sync_columns = {name: column for column, name in enumerate(self.header)
+                             if name in SYNC_COLUMNS}
+        self.parameter_columns = [column for column in range(2, len(self.header))
+                                  if self.header[column] not in SYNC_COLUMNS]
+        self.parameters = [self.header[column] for column in self.parameter_columns]
+
+    def missing_sync_columns(self):
+        return [name for name in SYNC_COLUMNS if name not in self.sync_columns]
+
+    def row(self, timestamp, module_id, values, origin='', base=''):
+        row = [''] * max(len(self.header), 2)
+        row[0] = timestamp
+        row[1] = module_id
+        for column, value in zip(self.parameter_columns, values):
+            row[column] = value
+        if origin:
+            station, revision = split_origin(origin)
+            self.set_field(row, STATION_COLUMN, station)
+            self.set_field(row, REVISION_COLUMN, revision)
+        self.set_field(row, BASE_COLUMN, base)
+        return row
+
+    def parse(self, row):
+        # (timestamp, module_id, values, origin, base) of a sheet row
+        values = [row[column] if column < len(row) else ''
+                  for column in self.parameter_columns]
+        station = self.field(row, STATION_COLUMN)
+        revision = self.field(row, REVISION_COLUMN)
+        origin = make_origin(station, revision) if station and revision else ''
+        return row[0], row[1], values, origin, self.field(row, BASE_COLUMN)
+
+    def field(self, row, name):
+        column = self.sync_columns.get(name)
+        if column is None or column >= len(row):
+            return ''
+        return row[column]
+
+    def set_field(self, row, name, value):
+        column = self.sync_columns.get(name)
+        if column is not None:
+            row[column] = value
+
+
+def column_keys(names):
+    # Identity of each named column; a repeated name gets "#2", "#3", ...
+    keys = []
+    seen = {}
+    for name in names:
+        seen[name] = seen.get(name, 0) + 1
+        keys.append(name if seen[name] == 1 else f"{name}#{seen[name]}")
+    return keys
+
+
+class SheetSchema:
+    # The sheet header plus the order parameter values are stored in locally.
+    # Stored values are lists indexed by column id: a parameter keeps its id for
+    # good, a new parameter gets the next id, and the id of a parameter that
+    # leaves the sheet is retired, not reused. Inserting, moving or removing a
+    # sheet column therefore never shifts stored values, only the mapping to
+    # sheet positions changes (and `version` goes up). Records written before
+    # this existed line up with the header that was current at upgrade time.
+    def __init__(self, header=(), columns=(), version=1, checked=0.0):
+        self.columns = [sys.intern(key) for key in columns]
+        self.version = version
+        self.checked = checked
+        self.set_header(header)
+
+    def set_header(self, header):
+        self.layout = SheetLayout(header)
+        self.header = self.layout.header
+        self.parameters = self.layout.parameters
+        keys = column_keys(self.parameters)
+        for key in keys:
+            if key not in self.columns:
+                self.columns.append(sys.intern(key))
+        column_ids = {key: column_id for column_id, key in enumerate(self.columns)}
+        # Stored column id of each parameter, in sheet order
+        self.live_ids = [column_ids[key] for key in keys]
+        self.in_order = self.live_ids == list(range(len(self.columns)))
+
+    def update(self, header, now=None):
+        # Take a header just read from the sheet; True if it differs
+        self.checked = time.time() if now is None else now
+        header = list(header)
+        if header == self.header:
+            return False
+        self.set_header(header)
+        self.version += 1
+        return True
+
+    def missing_sync_columns(self):
+        return self.layout.missing_sync_columns()
+
+    def is_fresh(self, max_age):
+        return bool(self.header) and time.time() - self.checked < max_age
+
+    def pad(self, stored):
+        stored = list(stored)
+        if len(stored) < len(self.columns):
+            stored.extend([''] * (len(self.columns) - len(stored)))
+        return stored
+
+    def to_storage(self, values, previous=()):
+        # Parameter values in sheet order -> stored list; retired columns keep
+        # their values from `previous`
+        if self.in_order:
+            return self.pad(values)[:len(self.columns)]
+        stored = self.pad(previous)
+        for column_id, value in zip(self.live_ids, values):
+            stored[column_id] = value
+        return stored
+
+    def from_storage(self, stored):
+        if self.in_order:
+            return [stored[i] if i < len(stored) else '' for i in range(len(self.live_ids))]
+        return [stored[column_id] if column_id < len(stored) else ''
+                for column_id in self.live_ids]
+
+    def row(self, timestamp, module_id, stored, origin='', base=''):
+        return self.layout.row(timestamp, module_id, self.from_storage(stored), origin, base)
+
+    def parse(self, row):
+        timestamp, module_id, values, origin, base = self.layout.parse(row)
+        return timestamp, module_id, self.to_storage(values), origin, base
+
+    def to_json(self):
+        return {'version': self.version, 'header': self.header,
+                'columns': self.columns, 'checked': self.checked}
+
+    @classmethod
+    def from_json(cls, data):
+        if not data:
+            return cls()
+        if 'columns' not in data:
+            # Older caches held only the header (or only the parameter names);
+            # the stored positional values line up with it as it was
+            header = data.get('header') or ['Timestamp', 'Module ID'] + data.get('parameters', [])
+            return cls(header, column_keys(SheetLayout(header).parameters))
+        return cls(data['header'], data['columns'], data['version'], data.get('checked', 0.0))
+
+
+class SchemaCache:
+    # The sheet schema saved next to the module data, so the form can be drawn
+    # before (or without) a network round trip
+    def __init__(self, path='sheet_header.json'):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, data):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,238 @@
+import json
+import os
+import re
+import socket
+import sys
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+from instrumentation import metrics
+from sheet_schema import SheetLayout, split_origin
+
+
+# Held by whichever process writes the local module store: the UI, or
+# `sync --pull`. A `sync` push only reads the store and takes PUSH_LOCK instead.
+STORE_LOCK = 'module_params.lock'
+PUSH_LOCK = 'sync_push.lock'
+
+
+class FileLock:
+    # Exclusive lock on a file, held until release(). The OS drops it when the
+    # holder exits or crashes, so there is no stale lock to clean up.
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def acquire(self, owner):
+        f = open(self.path, 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            f.close()
+            return False
+        f.seek(0)
+        f.truncate()
+        f.write(f"{owner} (pid {os.getpid()})\n")
+        f.flush()
+        self.file = f
+        return True
+
+    def holder(self):
+        try:
+            with open(self.path, 'r') as f:
+                return f.read().strip() or "another process"
+        except OSError:
+            return "another process"
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def default_station_id():
+    # Host name plus a random suffix, so cloned stations never share an id
+    host = re.sub(r'[\s:]+', '-', socket.gethostname()) or 'station'
+    return f"{host}-{uuid.uuid4().hex[:6]}"
+
+
+class SyncState:
+    # Per-module watermark: number of history entries already pushed to the sheet.
+    # Also remembers this station's id, which goes into every row it pushes,
+    # and the last revision number it stamped on an entry. The UI and the
+    # headless `sync` command may both push, so the file is the source of
+    # truth: commits re-read it and only ever move a watermark or the
+    # revision up.
+    def __init__(self, path='sync_state.json', station=None):
+        self.path = path
+        saved_station, self.watermarks, self.revision = self.read()
+        self.station = sys.intern(station or saved_station or default_station_id())
+        if self.station != saved_station:
+            self.save()
+
+    def read(self):
+        # (station, watermarks, revision) as saved on disk
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None, {}, 0
+        if data.get('format') == 2:
+            return data.get('station'), data['watermarks'], data.get('revision', 0)
+        # Older files held only the watermarks
+        return None, data, 0
+
+    def refresh(self):
+        # Pick up pushes made by another process
+        self.watermarks = self.read()[1]
+
+    def new_revision(self):
+        # Revision for an entry saved on this station. Saved with the next
+        # commit, which happens before the entry can reach the sheet.
+        self.revision += 1
+        return self.revision
+
+    def note_revision(self, revision):
+        # Entries stamped before the counter was saved (an older version, or
+        # a crash before the commit) must not have their revisions reused
+        self.revision = max(self.revision, revision)
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with metrics.span('sync_state.save'):
+            with open(tmp_path, 'w') as f:
+                json.dump({'format': 2, 'station': self.station, 'watermarks': self.watermarks,
+                           'revision': self.revision}, f)
+                written = f.tell()
+            os.replace(tmp_path, self.path)
+        metrics.count('disk.bytes_written', written)
+
+    def pending_rows(self, module_params, layout):
+        # Rows for history entries that have not been pushed yet,
+        # together with the watermarks to commit once the push succeeds.
+        # Refuses an incomplete header: the rows would lack their parameter or
+        # sync columns, and the watermarks would still move past the entries.
+        if not layout.parameters or layout.missing_sync_columns():
+            raise ValueError("the sheet header is not known yet")
+        self.refresh()
+        rows = []
+        new_watermarks = {}
+        for module_id, module_data in module_params.items():
+            pushed = self.watermarks.get(module_id, 0)
+            history = module_data['history']
+            if pushed >= len(history):
+                continue
+            self.note_revision(max_revision(history.origins[pushed:], self.station))
+            for history_entry in history.entries(pushed):
+                rows.append(entry_row(layout, module_id, history_entry))
+            new_watermarks[module_id] = len(history)
+
+        # Keep the sheet in chronological append order
+        rows.sort(key=lambda x: x[0])
+        return rows, new_watermarks
+
+    def commit(self, new_watermarks):
+        if not new_watermarks:
+            return
+        _, watermarks, revision = self.read()
+        for module_id, pushed in new_watermarks.items():
+            watermarks[module_id] = max(pushed, watermarks.get(module_id, 0))
+        self.watermarks = watermarks
+        self.note_revision(revision)
+        self.save()
+
+    def forget(self, module_id):
+        # Always saves, so the revisions of the deleted entries stay used
+        _, self.watermarks, revision = self.read()
+        self.watermarks.pop(module_id, None)
+        self.note_revision(revision)
+        self.save()
+
+
+def max_revision(origins, station):
+    # Highest revision among `origins` stamped by `station`, 0 if none
+    highest = 0
+    for origin in origins:
+        if origin:
+            origin_station, revision = split_origin(origin)
+            if origin_station == station and revision.isdigit():
+                highest = max(highest, int(revision))
+    return highest
+
+
+def entry_row(layout, module_id, history_entry):
+    return layout.row(history_entry['timestamp'], module_id, history_entry['parameters'],
+                      history_entry['origin'], history_entry['base'])
+
+
+def row_key(module_id, timestamp, origin):
+    # Identity of a row on the sheet: its origin, or (module, timestamp) for
+    # rows written before stations stamped their rows
+    return origin or (module_id, timestamp)
+
+
+def missing_rows(module_params, seen, layout):
+    # Rows for every local entry whose key is not in `seen`, oldest first
+    rows = []
+    for module_id, module_data in module_params.items():
+        for history_entry in module_data['history'].entries():
+            key = row_key(module_id, history_entry['timestamp'], history_entry['origin'])
+            if key not in seen:
+                rows.append(entry_row(layout, module_id, history_entry))
+    rows.sort(key=lambda x: x[0])
+    return rows
+
+
+def ensure_sync_columns(sheet):
+    # Layout of `sheet`, adding the Station/Revision/Base columns to its header
+    # first if they are missing. Every station writes the same header, so two
+    # doing this at once is harmless.
+    header = [sys.intern(name) for name in sheet.row_values(1)]
+    layout = SheetLayout(header)
+    missing = layout.missing_sync_columns()
+    if header and missing:
+        header = header + missing
+        if sheet.col_count < len(header):
+            sheet.add_cols(len(header) - sheet.col_count)
+        sheet.update(range_name='A1', values=[header])
+        layout = SheetLayout(header)
+    return layout
+
+
+def history_heads(history):
+    # Positions of the stamped entries that no later entry was edited from.
+    # One head is a linear history; more mean two stations edited the module
+    # without seeing each other's change.
+    parents = set()
+    for base in history.bases:
+        if base:
+            parents.update(base.split())
+    return [position for position, origin in enumerate(history.origins)
+            if origin and origin not in parents]
+
+
+def head_base(history):
+    # Base of a new entry: every current head, so saving also resolves a conflict
+    return ' '.join(history.origins[position] for position in history_heads(history))
+
+
+def find_conflicts(module_params, module_ids=None):
+    # {module_id: head positions} for the modules with concurrent edits
+    conflicts = {}
+    for module_id in module_params if module_ids is None else module_ids:
+        module_data = module_params.get(module_id)
+        if module_data is None:
+            continue
+        heads = history_heads(module_data['history'])
+        if len(heads) > 1:
+            conflicts[module_id] = heads
+    return conflicts
@@ -0,0 +1,297 @@
+import tkinter as tk
+from tkinter import ttk
+
+from sheet_import import iter_sheet_pages
+
+
+def column_letter(index):
+    # 0 -> A, 25 -> Z, 26 -> AA
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def query_literal(text):
+    # Query language strings cannot escape quotes; None if `text` has both kinds
+    if "'" not in text:
+        return f"'{text}'"
+    if '"' not in text:
+        return f'"{text}"'
+    return None
+
+
+class RangeSource:
+    # Rows in sheet order, one ranged read per page
+    def __init__(self, sheet, first_row):
+        self.sheet = sheet
+        self.first_row = first_row
+
+    def fetch(self, offset, limit):
+        start = self.first_row + offset
+        return [list(row) for row in self.sheet.get(f"{start}:{start + limit - 1}")]
+
+
+class QuerySource:
+    # Sorted and/or filtered rows, computed by the server one page at a time
+    def __init__(self, sheet, columns, headers, sort, descending, filter_text, filter_column):
+        self.sheet = sheet
+        self.headers = headers
+        clauses = ['SELECT *']
+        if filter_text:
+            literal = query_literal(filter_text.lower())
+            if literal is None:
+                raise ValueError("Filter text contains both kinds of quotes")
+            searched = [filter_column] if filter_column is not None else range(len(columns))
+            clauses.append('WHERE ' + ' OR '.join(
+                f"lower({column_letter(column)}) contains {literal}" for column in searched))
+        if sort is not None:
+            clauses.append(f"ORDER BY {column_letter(sort)} {'DESC' if descending else 'ASC'}")
+        self.query = ' '.join(clauses)
+
+    def fetch(self, offset, limit):
+        return self.sheet.query(f"{self.query} LIMIT {limit} OFFSET {offset}", self.headers)
+
+
+class LocalSource:
+    # Fallback for sheets that cannot be queried: the first fetch reads every
+    # row (in batched ranged pages) and sorts/filters it here
+    def __init__(self, sheet, first_row, sort, descending, filter_text, filter_column):
+        self.sheet = sheet
+        self.first_row = first_row
+        self.sort = sort
+        self.descending = descending
+        self.filter_text = filter_text.lower()
+        self.filter_column = filter_column
+        self.rows = None
+
+    def matches(self, row):
+        if self.filter_column is not None:
+            cells = row[self.filter_column:self.filter_column + 1]
+        else:
+            cells = row
+        return any(self.filter_text in cell.lower() for cell in cells)
+
+    def fetch(self, offset, limit):
+        if self.rows is None:
+            rows = []
+            for start_row, page in iter_sheet_pages(self.sheet, page_size=1000,
+                                                    start_row=self.first_row,
+                                                    pages_per_request=5):
+                if self.filter_text:
+                    page = [row for row in page if self.matches(row)]
+                rows.extend(page)
+            if self.sort is not None:
+                column = self.sort
+                rows.sort(key=lambda row: row[column] if column < len(row) else '',
+                          reverse=self.descending)
+            self.rows = rows
+        return self.rows[offset:offset + limit]
+
+
+class PagedSheetViewer:
+    # Window over a worksheet that only holds the rows scrolled to so far.
+    # Pages are fetched on `worker` when the view gets near the end of what is
+    # loaded, and inserted CHUNK_SIZE rows per `after` tick so the window stays
+    # responsive. Clicking a heading sorts by that column and the filter box
+    # keeps rows containing the text; both run on the server as a visualization
+    # query, or locally over one full read if the sheet cannot be queried.
+    PAGE_SIZE = 500
+    CHUNK_SIZE = 100
+
+    def __init__(self, root, sheet, worker, title="Sheet Data", header_row=True, widths=None):
+        self.root = root
+        self.sheet = sheet
+        self.worker = worker
+        self.header_row = header_row
+        self.first_row = 2 if header_row else 1
+        self.widths = widths or {}
+        self.columns = []
+        self.sort = None
+        self.descending = False
+        self.filter_text = ''
+        self.filter_column = None
+        # None until a query has been tried, then whether the sheet answers them
+        self.can_query = None
+        self.source = RangeSource(sheet, self.first_row)
+
+        # Bumped on every sort/filter change; pages of an older view are dropped
+        self.generation = 0
+        self.loaded = 0
+        self.queued = []
+        self.loading = False
+        self.exhausted = False
+
+        self.window = tk.Toplevel(root)
+        self.window.title(title)
+
+        filter_frame = ttk.Frame(self.window)
+        filter_frame.grid(row=0, column=0, columnspan=2, sticky='ew')
+        ttk.Label(filter_frame, text="Filter:").pack(side='left', padx=5, pady=5)
+        self.filter_entry = ttk.Entry(filter_frame)
+        self.filter_entry.pack(side='left', padx=5, pady=5)
+        self.filter_entry.bind('<Return>', lambda event: self.apply_filter())
+        self.filter_column_var = tk.StringVar(value="All columns")
+        self.filter_column_combo = ttk.Combobox(filter_frame, textvariable=self.filter_column_var,
+                                                state='readonly', width=15)
+        self.filter_column_combo.pack(side='left', padx=5, pady=5)
+        ttk.Button(filter_frame, text="Filter", command=self.apply_filter).pack(side='left', padx=5)
+        ttk.Button(filter_frame, text="Clear", command=self.clear_filter).pack(side='left', padx=5)
+
+        self.tree = ttk.Treeview(self.window, show='headings')
+        self.scrollbar = ttk.Scrollbar(self.window, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.on_yscroll)
+        self.status_label = ttk.Label(self.window, text="")
+
+        self.tree.grid(row=1, column=0, sticky='nsew')
+        self.scrollbar.grid(row=1, column=1, sticky='ns')
+        self.status_label.grid(row=2, column=0, columnspan=2, sticky='w')
+        self.window.grid_columnconfigure(0, weight=1)
+        self.window.grid_rowconfigure(1, weight=1)
+
+        if header_row:
+            self.status_label.config(text="Loading header...")
+            self.worker.submit("Loading header", lambda job: self.sheet.row_values(1),
+                               on_done=self.header_loaded, on_error=self.failed)
+        else:
+            self.load_more()
+
+    def set_columns(self, names):
+        self.columns = list(names)
+        ids = [f"c{i}" for i in range(len(self.columns))]
+        self.tree.configure(columns=ids)
+        for i, name in enumerate(self.columns):
+            self.tree.heading(ids[i], text=self.heading_text(i),
+                              command=lambda column=i: self.sort_by(column))
+            self.tree.column(ids[i], width=self.widths.get(name, 120))
+        self.filter_column_combo['values'] = ["All columns"] + self.columns
+
+    def heading_text(self, column):
+        text = self.columns[column]
+        if column == self.sort:
+            text += ' ▼' if self.descending else ' ▲'
+        return text
+
+    def header_loaded(self, header):
+        if not self.window.winfo_exists():
+            return
+        self.set_columns(header)
+        self.load_more()
+
+    def on_yscroll(self, first, last):
+        self.scrollbar.set(first, last)
+        # Fetch the next page once the last tenth of the loaded rows is in view
+        if float(last) > 0.9 and not self.queued:
+            self.load_more()
+
+    def load_more(self):
+        if self.loading or self.exhausted:
+            return
+        self.loading = True
+        generation = self.generation
+        source = self.source
+        offset = self.loaded
+        self.show_status()
+        self.worker.submit("Loading rows", lambda job: source.fetch(offset, self.PAGE_SIZE),
+                           on_done=lambda rows: self.page_loaded(generation, rows),
+                           on_error=lambda e: self.page_failed(generation, e))
+
+    def page_loaded(self, generation, rows):
+        if generation != self.generation or not self.window.winfo_exists():
+            return
+        self.loading = False
+        self.exhausted = len(rows) < self.PAGE_SIZE
+        self.loaded += len(rows)
+        if not self.header_row:
+            width = max((len(row) for row in rows), default=0)
+            if width > len(self.columns):
+                self.set_columns([column_letter(i) for i in range(width)])
+        self.queued.extend(rows)
+        self.insert_chunk(generation)
+
+    def insert_chunk(self, generation):
+        if generation != self.generation or not self.window.winfo_exists():
+            return
+        chunk = self.queued[:self.CHUNK_SIZE]
+        del self.queued[:self.CHUNK_SIZE]
+        for row in chunk:
+            self.tree.insert('', tk.END, values=row)
+        if self.queued:
+            self.root.after(1, self.insert_chunk, generation)
+        self.show_status()
+
+    def page_failed(self, generation, e):
+        if generation != self.generation or not self.window.winfo_exists():
+            return
+        self.loading = False
+        if isinstance(self.source, QuerySource):
+            # Sort and filter here instead
+            self.can_query = False
+            self.reload()
+            return
+        self.failed(e)
+
+    def failed(self, e):
+        if self.window.winfo_exists():
+            self.status_label.config(text=f"Failed to load data: {str(e)}")
+
+    def show_status(self):
+        shown = self.loaded - len(self.queued)
+        if self.loading:
+            text = f"{shown} rows, loading more..."
+        elif self.exhausted:
+            text = f"{shown} rows"
+        else:
+            text = f"{shown} rows, scroll for more"
+        if self.filter_text:
+            text += f" matching '{self.filter_text}'"
+        self.status_label.config(text=text)
+
+    def sort_by(self, column):
+        if self.sort == column:
+            self.descending = not self.descending
+        else:
+            self.sort = column
+            self.descending = False
+        for i in range(len(self.columns)):
+            self.tree.heading(f"c{i}", text=self.heading_text(i))
+        self.reload()
+
+    def apply_filter(self):
+        self.filter_text = self.filter_entry.get().strip()
+        name = self.filter_column_var.get()
+        self.filter_column = self.columns.index(name) if name in self.columns else None
+        self.reload()
+
+    def clear_filter(self):
+        self.filter_entry.delete(0, tk.END)
+        self.filter_column_var.set("All columns")
+        self.apply_filter()
+
+    def make_source(self):
+        if self.sort is None and not self.filter_text:
+            return RangeSource(self.sheet, self.first_row)
+        if self.can_query is not False and hasattr(self.sheet, 'query'):
+            try:
+                return QuerySource(self.sheet, self.columns, 1 if self.header_row else 0,
+                                   self.sort, self.descending, self.filter_text,
+                                   self.filter_column)
+            except ValueError:
+                pass
+        return LocalSource(self.sheet, self.first_row, self.sort, self.descending,
+                           self.filter_text, self.filter_column)
+
+    def reload(self):
+        # Start over with the current sort and filter
+        self.generation += 1
+        self.source = self.make_source()
+        items = self.tree.get_children()
+        if items:
+            self.tree.delete(*items)
+        self.loaded = 0
+        self.queued = []
+        self.loading = False
+        self.exhausted = False
+        self.load_more()
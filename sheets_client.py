@@ -0,0 +1,177 @@
+import csv
+import io
+import random
+import threading
+import time
+
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+
+from instrumentation import SHEET_READS, SHEET_WRITES, instrument_sheet, metrics
+from sheet_partitions import open_history
+
+# Sheets API default quota per user, counted over a rolling minute
+READ_QUOTA = 60
+WRITE_QUOTA = 60
+
+SCOPE = ['https://spreadsheets.google.com/feeds',
+         'https://www.googleapis.com/auth/drive']
+
+# Google Visualization query endpoint, for sorting/filtering on the server
+QUERY_URL = 'https://docs.google.com/spreadsheets/d/{}/gviz/tq'
+
+
+class TokenBucket:
+    # Allows `rate` requests per `per` seconds, in bursts of up to `capacity`.
+    # take() blocks until a token is free, so callers queue up instead of
+    # running into the quota.
+    def __init__(self, rate, per=60.0, capacity=None):
+        self.rate = rate / per
+        self.capacity = capacity or rate
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.resume_at = 0.0
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        # Returns the seconds spent waiting
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.refill(now)
+                if now >= self.resume_at and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = max(self.resume_at - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        # The server said we are over quota: hold every caller off, not just
+        # the one that got the error
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+    def available(self):
+        with self.lock:
+            self.refill(time.monotonic())
+            return int(self.tokens)
+
+
+# Shared by every client in the process, since the quota is per user
+read_bucket = TokenBucket(READ_QUOTA)
+write_bucket = TokenBucket(WRITE_QUOTA)
+
+
+def error_status(e):
+    # HTTP status of a gspread APIError (or anything shaped like one)
+    response = getattr(e, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status is None:
+        status = getattr(e, 'code', None)
+    return status
+
+
+def retry_after(e):
+    response = getattr(e, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class SheetsClient:
+    # Worksheet wrapper all GUIs talk to the sheet through. Each API call first
+    # takes a token from the shared read or write bucket, and a 429 answer is
+    # retried with exponential backoff instead of surfacing as an error. Reads
+    # are also retried on 500/503; writes are not, since the server may have
+    # applied them.
+    def __init__(self, sheet, read_bucket=read_bucket, write_bucket=write_bucket,
+                 retries=5, base_delay=1.0, max_delay=32.0):
+        self.sheet = sheet
+        self.read_bucket = read_bucket
+        self.write_bucket = write_bucket
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def __getattr__(self, name):
+        attr = getattr(self.sheet, name)
+        if name not in SHEET_READS and name not in SHEET_WRITES:
+            return attr
+
+        def call(*args, **kwargs):
+            return self.call(name in SHEET_WRITES, attr, *args, **kwargs)
+        return call
+
+    def call(self, write, func, *args, **kwargs):
+        bucket = self.write_bucket if write else self.read_bucket
+        attempt = 0
+        while True:
+            waited = bucket.take()
+            if waited:
+                metrics.count('sheet.quota_wait_ms', int(waited * 1000))
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                status = error_status(e)
+                retryable = status == 429 or (not write and status in (500, 503))
+                if not retryable or attempt >= self.retries:
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+                    delay *= random.uniform(0.5, 1.0)
+                if status == 429:
+                    bucket.pause(delay)
+                else:
+                    time.sleep(delay)
+                attempt += 1
+                metrics.count('sheet.retries')
+
+    def query(self, tq, headers=1):
+        # Rows matching a Google Visualization query ("SELECT * WHERE ... ORDER
+        # BY ... LIMIT ... OFFSET ...", columns by letter), evaluated by the
+        # server. `headers` is the number of header rows the sheet has. Raises
+        # if the sheet cannot be queried, e.g. a worksheet without an API client.
+        url = QUERY_URL.format(self.sheet.spreadsheet_id)
+        params = {'tqx': 'out:csv', 'gid': self.sheet.id, 'headers': headers, 'tq': tq}
+        response = self.call(False, self.sheet.client.request, 'get', url, params=params)
+        if 'csv' not in response.headers.get('Content-Type', ''):
+            raise ValueError("The sheet query was not answered with CSV")
+        # The first line holds the column labels
+        return list(csv.reader(io.StringIO(response.text)))[1:]
+
+
+def open_spreadsheet(title, credentials='credentials.json'):
+    # (gspread client, spreadsheet `title`), unwrapped
+    creds = ServiceAccountCredentials.from_json_keyfile_name(credentials, SCOPE)
+    client = gspread.authorize(creds)
+    return client, client.open(title)
+
+
+def open_worksheet(title, credentials='credentials.json'):
+    # (gspread client, first worksheet of the spreadsheet `title` wrapped in a
+    # SheetsClient)
+    client, spreadsheet = open_spreadsheet(title, credentials)
+    return client, wrap_sheet(spreadsheet.sheet1)
+
+
+def open_history_sheet(title, credentials='credentials.json'):
+    # Like open_worksheet, but a PartitionedSheet if the spreadsheet is
+    # partitioned (see sheet_partitions)
+    client, spreadsheet = open_spreadsheet(title, credentials)
+    return client, open_history(spreadsheet, wrap_sheet)
+
+
+def wrap_sheet(sheet):
+    # Quota handling outside, instrumentation inside, so every retry is
+    # counted as the request it is
+    return SheetsClient(instrument_sheet(sheet))
@@ -2,22 +2,22 @@
 
 import tkinter as tk
 from tkinter import messagebox
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+
+from background_worker import BackgroundWorker
+from sheet_viewer import PagedSheetViewer
+from sheets_client import open_worksheet
 
 class SpreadsheetGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("Spreadsheet Manager")
 
-        # Initialize Google Sheets connection
-        scope = ['https://spreadsheets.google.com/feeds',
-                'https://www.googleapis.com/auth/drive']
-        creds = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', scope)
-        self.client = gspread.authorize(creds)
-
-        # Open spreadsheet
-        self.sheet = self.client.open('test').sheet1
+        # Open spreadsheet; calls are throttled to the API quota and
+        # retried when rate limited
+        self.client, self.sheet = open_worksheet('test')
+        # Every sheet call runs off the Tk thread, so waiting for quota
+        # never freezes the window
+        self.worker = BackgroundWorker(root)
 
         # Create buttons
         tk.Button(root, text="Add Row", command=self.add_row).pack(pady=5)
@@ -30,30 +30,31 @@ class SpreadsheetGUI:
 
     def add_row(self):
         data = self.entry.get()
-        try:
-            self.sheet.append_row([data])
+
+        def added(result):
             messagebox.showinfo("Success", "Data added successfully!")
-            self.entry.delete(0, tk.END)
-        except Exception as e:
+            if self.entry.get() == data:
+                self.entry.delete(0, tk.END)
+
+        def failed(e):
             messagebox.showerror("Error", f"Failed to add data: {str(e)}")
 
+        self.worker.submit("Adding row", lambda job: self.sheet.append_row([data]),
+                           on_done=added, on_error=failed)
+
     def clear_sheet(self):
-        try:
-            self.sheet.clear()
+        def cleared(result):
             messagebox.showinfo("Success", "Sheet cleared successfully!")
-        except Exception as e:
+
+        def failed(e):
             messagebox.showerror("Error", f"Failed to clear sheet: {str(e)}")
 
+        self.worker.submit("Clearing sheet", lambda job: self.sheet.clear(),
+                           on_done=cleared, on_error=failed)
+
     def read_data(self):
-        try:
-            data = self.sheet.get_all_values()
-            display_window = tk.Toplevel(self.root)
-            display_window.title("Sheet Data")
-
-            for row in data:
-                tk.Label(display_window, text=' | '.join(row)).pack()
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to read data: {str(e)}")
+        # Rows are fetched page by page as the table is scrolled
+        PagedSheetViewer(self.root, self.sheet, self.worker, header_row=False)
 
 if __name__ == "__main__":
     root = tk.Tk()
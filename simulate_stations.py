@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+# Runs several simulated stations against one in-process fake worksheet using
+# the same sync pieces as uiWireBonder.py (sync state, outbox, sheet merger),
+# and checks that they converge and that concurrent edits are flagged.
+# With --partitioned the soak runs against a spreadsheet partitioned by month.
+#
+#   python3 simulate_stations.py --stations 3 --modules 20 --steps 500
+#   python3 simulate_stations.py --partitioned
+#
+# Exits with status 1 if any check fails.
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+from fake_sheet import FakeSpreadsheet, FakeWorksheet
+from history_index import HistoryIndex
+from history_store import CompactHistory
+from sheet_import import SheetMerger
+from sheet_outbox import OutboxFlusher, SheetOutbox
+from sheet_partitions import (INDEX_TITLE, PartitionedSheet, SheetReads, archive_partitions,
+                              enable_partitioning, iter_history_pages)
+from sheet_schema import SheetLayout, SheetSchema, make_origin
+from sheet_sync import SyncState, ensure_sync_columns, find_conflicts, head_base
+
+
+class SimulatedStation:
+    # The sync-relevant half of ModuleTrackingGUI, without Tk
+    def __init__(self, name, sheet, directory, clock):
+        self.sheet = sheet
+        self.clock = clock
+        self.module_params = {}
+        self.history_index = HistoryIndex(self.module_params)
+        self.sync_state = SyncState(os.path.join(directory, 'sync_state.json'), station=name)
+        self.outbox = SheetOutbox(os.path.join(directory, 'sheet_outbox.jsonl'))
+        self.reads = SheetReads(os.path.join(directory, 'sheet_reads.json'))
+        self.flusher = OutboxFlusher(self.outbox, lambda: self.sheet)
+        self.layout = ensure_sync_columns(sheet)
+        self.conflicts = {}
+
+    def save(self, module_id, values):
+        timestamp = self.clock()
+        module_data = self.module_params.setdefault(module_id, {
+            'parameters': [], 'created': timestamp, 'modified': '', 'history': CompactHistory()
+        })
+        history = module_data['history']
+        seq = self.history_index.new_seq()
+        history.append({
+            'seq': seq,
+            'timestamp': timestamp,
+            'parameters': values,
+            'origin': make_origin(self.sync_state.station, self.sync_state.new_revision()),
+            'base': head_base(history)
+        })
+        self.history_index.appended(module_id, history)
+        module_data['parameters'] = list(history.latest)
+        module_data['modified'] = timestamp
+        self.conflicts.pop(module_id, None)
+
+    def submit(self):
+        rows, new_watermarks = self.sync_state.pending_rows(self.module_params, self.layout)
+        if rows:
+            self.outbox.add(rows)
+            self.sync_state.commit(new_watermarks)
+
+    def flush(self):
+        try:
+            self.flusher.flush_once()
+        except (ConnectionError, PermissionError):
+            # PermissionError: appended to a partition archived meanwhile
+            pass
+
+    def read(self):
+        merger = SheetMerger(self.module_params, self.sync_state, self.history_index, self.layout)
+        try:
+            for title, header, start_row, rows in iter_history_pages(self.sheet, self.reads,
+                                                                     page_size=50):
+                changed = merger.merge(rows)
+                self.sync_state.commit({module_id: self.sync_state.watermarks[module_id]
+                                        for module_id in changed})
+                for module_id in changed:
+                    self.conflicts.pop(module_id, None)
+                self.conflicts.update(find_conflicts(self.module_params, changed))
+            self.reads.commit()
+        except ConnectionError:
+            pass
+        return merger
+
+    def origins(self):
+        return {module_id: sorted(origin for origin in module_data['history'].origins)
+                for module_id, module_data in self.module_params.items()}
+
+
+def make_clock(start, step=timedelta(seconds=1)):
+    moment = [start]
+
+    def clock():
+        moment[0] += step
+        return moment[0].strftime("%Y-%m-%d %H:%M:%S")
+    return clock
+
+
+def check(condition, message, failures):
+    print(("ok    " if condition else "FAIL  ") + message)
+    if not condition:
+        failures.append(message)
+
+
+def sync_all(stations):
+    # Everyone pushes, then everyone pulls
+    for station in stations:
+        station.submit()
+        station.flush()
+    for station in stations:
+        station.read()
+
+
+def scenario(workdir, failures):
+    # Two stations edit the same module without seeing each other's change
+    sheet = FakeWorksheet(['Timestamp', 'Module ID', 'loop height', 'force'])
+    clock = make_clock(datetime(2024, 1, 1))
+    a = SimulatedStation('A', sheet, os.path.join(workdir, 'A'), clock)
+    b = SimulatedStation('B', sheet, os.path.join(workdir, 'B'), clock)
+
+    a.save('M1', ['10', '5'])
+    sync_all([a, b])
+    check(not a.conflicts and not b.conflicts, "sequential edit is not a conflict", failures)
+
+    a.save('M1', ['11', '5'])
+    b.save('M1', ['10', '6'])
+    sync_all([a, b])
+    check(set(a.conflicts) == {'M1'} and set(b.conflicts) == {'M1'},
+          "concurrent edits are flagged on both stations", failures)
+
+    # A keeps its version; once synced the conflict is gone everywhere
+    history = a.module_params['M1']['history']
+    a.save('M1', history.values_at(a.conflicts.get('M1', [len(history) - 1])[0]))
+    sync_all([a, b])
+    check(not a.conflicts and not b.conflicts, "resolving on one station clears it everywhere",
+          failures)
+    check(a.origins() == b.origins(), "both stations hold the same entries", failures)
+
+
+def unknown_header(workdir, failures):
+    # A station with history but no usable header yet (just upgraded, or not
+    # connected) must not queue rows or move its watermarks
+    sheet = FakeWorksheet(['Timestamp', 'Module ID', 'loop height'])
+    directory = os.path.join(workdir, 'C')
+    os.makedirs(directory)
+    station = SimulatedStation('C', sheet, directory, make_clock(datetime(2024, 1, 1)))
+    station.save('M1', ['10'])
+    for layout in (SheetSchema(), SheetLayout(['Timestamp', 'Module ID', 'loop height'])):
+        station.layout = layout
+        try:
+            station.submit()
+        except ValueError:
+            pass
+        check(station.outbox.pending_rows() == 0 and not station.sync_state.read()[1],
+              f"no rows queued for header {layout.header}", failures)
+
+
+def sheet_rows(sheet):
+    # Every history row on a fake worksheet or partitioned fake spreadsheet
+    if isinstance(sheet, FakeSpreadsheet):
+        return [row for worksheet in sheet.sheets if worksheet.title != INDEX_TITLE
+                for row in worksheet.values[1:]]
+    return sheet.values[1:]
+
+
+def soak(args, workdir, failures):
+    rng = random.Random(args.seed)
+    header = ['Timestamp', 'Module ID'] + [f"param_{i}" for i in range(args.params)]
+    if args.partitioned:
+        # A day per save, so the rows span several monthly partitions
+        sheet = FakeSpreadsheet(header)
+        enable_partitioning(sheet, 'month', now='2024-01-01 00:00:00')
+        clock = make_clock(datetime(2024, 1, 1), timedelta(days=1))
+        stations = [SimulatedStation(f"S{i}", PartitionedSheet(sheet),
+                                     os.path.join(workdir, f"S{i}"), clock)
+                    for i in range(args.stations)]
+    else:
+        sheet = FakeWorksheet(header)
+        clock = make_clock(datetime(2024, 1, 1))
+        stations = [SimulatedStation(f"S{i}", sheet, os.path.join(workdir, f"S{i}"), clock)
+                    for i in range(args.stations)]
+    module_ids = [f"M{m:04d}" for m in range(args.modules)]
+    saved = set()
+    row_count = len(sheet_rows(sheet))
+    archived = []
+
+    for step in range(args.steps):
+        if args.partitioned and step == args.steps // 2:
+            # Archive every month before the current one while stations still
+            # hold rows for them in their outboxes
+            sheet.offline = False
+            archived = archive_partitions(stations[0].sheet, before=clock()[:7])
+        station = rng.choice(stations)
+        action = rng.random()
+        sheet.offline = rng.random() < args.offline
+        if action < 0.5:
+            module_id = rng.choice(module_ids)
+            module_data = station.module_params.get(module_id)
+            values = list(module_data['history'].latest) if module_data else [''] * args.params
+            values[rng.randrange(args.params)] = str(rng.randint(0, 999))
+            station.save(module_id, values)
+            saved.add(station.module_params[module_id]['history'].origins[-1])
+        elif action < 0.75:
+            station.submit()
+            station.flush()
+        else:
+            station.read()
+        check_rows = len(sheet_rows(sheet))
+        if check_rows < row_count:
+            check(False, f"sheet shrank at step {step}", failures)
+        row_count = check_rows
+
+    sheet.offline = False
+    sync_all(stations)
+    sync_all(stations)
+
+    origins = stations[0].origins()
+    check(all(station.origins() == origins for station in stations),
+          f"{args.stations} stations converge on the same entries", failures)
+
+    layout = stations[0].layout
+    on_sheet = [layout.parse(row)[3] for row in sheet_rows(sheet)]
+    check(len(on_sheet) == len(set(on_sheet)), "no entry is written to the sheet twice", failures)
+    check(saved == set(on_sheet), f"all {len(saved)} saved entries reached the sheet", failures)
+
+    if args.partitioned:
+        partitions = len(sheet.sheets) - 1
+        check(bool(archived) and all(sheet.worksheet(title).protected for title in archived),
+              f"{len(archived)} archived of {partitions} partitions are protected", failures)
+        full = SheetReads(os.path.join(workdir, 'full_reads.json'))
+        read = sum(len(rows) for _, _, _, rows in iter_history_pages(stations[0].sheet, full))
+        check(read == len(on_sheet), f"a full read of all partitions finds {read} rows",
+              failures)
+
+    conflicts = set(stations[0].conflicts)
+    check(all(set(station.conflicts) == conflicts for station in stations),
+          f"all stations agree on {len(conflicts)} conflicting modules", failures)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate several stations sharing one sheet")
+    parser.add_argument('--stations', type=int, default=3)
+    parser.add_argument('--modules', type=int, default=20)
+    parser.add_argument('--params', type=int, default=5)
+    parser.add_argument('--steps', type=int, default=500)
+    parser.add_argument('--offline', type=float, default=0.1,
+                        help="chance that the sheet is unreachable during a step")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--partitioned', action='store_true',
+                        help="run the soak against a spreadsheet partitioned by month")
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory(prefix='uiWireBonder-stations-') as workdir:
+        for name in ['A', 'B'] + [f"S{i}" for i in range(args.stations)]:
+            os.makedirs(os.path.join(workdir, name))
+        scenario(workdir, failures)
+        unknown_header(workdir, failures)
+        soak(args, workdir, failures)
+
+    if failures:
+        print(f"{len(failures)} checks failed")
+        sys.exit(1)
+    print("All checks passed")
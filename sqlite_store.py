@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+from history_store import CompactHistory, encode_entry, encode_history, intern_values
+from instrumentation import metrics
+from module_store import ModuleStorage, ModuleStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS modules (
+    module_id TEXT PRIMARY KEY,
+    created TEXT NOT NULL,
+    modified TEXT NOT NULL,
+    parameters TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS history (
+    module_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    seq INTEGER,
+    timestamp TEXT NOT NULL,
+    entry TEXT NOT NULL,
+    PRIMARY KEY (module_id, position)
+);
+CREATE INDEX IF NOT EXISTS history_timestamp ON history (timestamp);
+CREATE INDEX IF NOT EXISTS history_module_timestamp ON history (module_id, timestamp);
+"""
+
+
+class SqliteModuleStore(ModuleStorage):
+    # Modules, history rows and the sheet schema in indexed SQLite tables.
+    # Every change is one small transaction; WAL lets other readers (e.g. a
+    # second station process) work while we write. With read_only the
+    # database is opened as is and never created or changed.
+    def __init__(self, path='module_params.db', read_only=False):
+        self.path = path
+        self.module_params = {}
+        # Loading may happen on a worker thread, writes on the Tk thread
+        self.lock = threading.Lock()
+        if read_only:
+            self.db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+            return
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def load(self):
+        # Both queries in one read transaction, so a save committed by another
+        # process in between cannot leave history without its module row
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                module_params = {}
+                for module_id, created, modified, parameters in self.db.execute(
+                        "SELECT module_id, created, modified, parameters FROM modules"):
+                    module_params[module_id] = {
+                        'parameters': list(intern_values(json.loads(parameters))),
+                        'created': created,
+                        'modified': modified,
+                        'history': []
+                    }
+
+                for module_id, entry in self.db.execute(
+                        "SELECT module_id, entry FROM history ORDER BY module_id, position"):
+                    module_params[module_id]['history'].append(json.loads(entry))
+            finally:
+                self.db.commit()
+
+        for module_data in module_params.values():
+            module_data['history'] = CompactHistory.from_json(
+                {'format': 'delta', 'entries': module_data['history']})
+        self.module_params = module_params
+        return self.module_params
+
+    def load_index(self):
+        with self.lock:
+            return {module_id: {'created': created, 'modified': modified}
+                    for module_id, created, modified in self.db.execute(
+                        "SELECT module_id, created, modified FROM modules")}
+
+    def write_module_row(self, module_id):
+        module_data = self.module_params[module_id]
+        self.db.execute(
+            "INSERT OR REPLACE INTO modules (module_id, created, modified, parameters) "
+            "VALUES (?, ?, ?, ?)",
+            (module_id, module_data['created'], module_data['modified'],
+             json.dumps(list(module_data['parameters']))))
+
+    def write_history(self, module_id):
+        history = self.module_params[module_id]['history']
+        self.db.execute("DELETE FROM history WHERE module_id = ?", (module_id,))
+        self.db.executemany(
+            "INSERT INTO history (module_id, position, seq, timestamp, entry) VALUES (?, ?, ?, ?, ?)",
+            ((module_id, position, entry.get('seq'), entry['timestamp'],
+              json.dumps(entry, default=encode_history))
+             for position, entry in enumerate(history.to_json()['entries'])))
+
+    def write_newest_entry(self, module_id):
+        history = self.module_params[module_id]['history']
+        position = len(history) - 1
+        stored = encode_entry(history, position)
+        self.db.execute(
+            "INSERT OR REPLACE INTO history (module_id, position, seq, timestamp, entry) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (module_id, position, stored.get('seq'), stored['timestamp'],
+             json.dumps(stored, default=encode_history)))
+        self.write_module_row(module_id)
+
+    def record_save(self, module_id, entry):
+        # The entry has already been appended to the module's history
+        with metrics.span('store.sqlite_save'), self.lock, self.db:
+            self.write_newest_entry(module_id)
+
+    def record_saves(self, module_ids):
+        with metrics.span('store.sqlite_save_batch'), self.lock, self.db:
+            for module_id in module_ids:
+                self.write_newest_entry(module_id)
+
+    def record_put(self, module_id):
+        with metrics.span('store.sqlite_put'), self.lock, self.db:
+            self.write_history(module_id)
+            self.write_module_row(module_id)
+
+    def record_delete(self, module_id):
+        with metrics.span('store.sqlite_delete'), self.lock, self.db:
+            self.db.execute("DELETE FROM history WHERE module_id = ?", (module_id,))
+            self.db.execute("DELETE FROM modules WHERE module_id = ?", (module_id,))
+
+    def replace_all(self, module_params):
+        self.module_params = module_params
+        with metrics.span('store.sqlite_replace_all'), self.lock, self.db:
+            self.db.execute("DELETE FROM history")
+            self.db.execute("DELETE FROM modules")
+            for module_id in module_params:
+                self.write_history(module_id)
+                self.write_module_row(module_id)
+        return self.module_params
+
+    def load_schema(self):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM settings WHERE key = 'schema'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_schema(self, data):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('schema', ?)",
+                            (json.dumps(data),))
+
+
+def migrate_json_to_sqlite(json_path='module_params.json', db_path='module_params.db'):
+    # One-shot copy of the JSON snapshot + journal (and cached schema) into SQLite
+    json_store = ModuleStore(json_path)
+    module_params = json_store.load()
+    sqlite_store = SqliteModuleStore(db_path)
+    try:
+        sqlite_store.replace_all(module_params)
+        schema = json_store.load_schema()
+        if schema:
+            sqlite_store.save_schema(schema)
+    finally:
+        sqlite_store.close()
+    return len(module_params)
+
+
+def open_storage(kind='json', directory='.', read_only=False):
+    if kind == 'json':
+        return ModuleStore(os.path.join(directory, 'module_params.json'), read_only=read_only)
+    if kind == 'sqlite':
+        json_path = os.path.join(directory, 'module_params.json')
+        db_path = os.path.join(directory, 'module_params.db')
+        if not os.path.exists(db_path):
+            if read_only:
+                # Only the UI's first SQLite start creates the database (and
+                # imports module_params.json into it); until then read the JSON
+                return ModuleStore(json_path, read_only=True)
+            if os.path.exists(json_path):
+                migrate_json_to_sqlite(json_path, db_path)
+        return SqliteModuleStore(db_path, read_only=read_only)
+    raise ValueError(f"Unknown storage backend: {kind}")
+
+
+if __name__ == "__main__":
+    # python3 sqlite_store.py [module_params.json] [module_params.db]
+    json_path = sys.argv[1] if len(sys.argv) > 1 else 'module_params.json'
+    db_path = sys.argv[2] if len(sys.argv) > 2 else 'module_params.db'
+    if os.path.exists(db_path):
+        print(f"{db_path} already exists, not overwriting it")
+        sys.exit(1)
+    count = migrate_json_to_sqlite(json_path, db_path)
+    print(f"Migrated {count} modules from {json_path} to {db_path}")
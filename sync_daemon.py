@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+from datetime import datetime
+
+from history_index import HistoryIndex
+from sheet_import import SheetMerger
+from sheet_outbox import OutboxFlusher, SheetOutbox
+from sheet_partitions import SheetReads, iter_history_pages
+from sheet_schema import SheetSchema
+from sheet_sync import (PUSH_LOCK, STORE_LOCK, FileLock, SyncState, ensure_sync_columns,
+                        find_conflicts)
+from sheets_client import open_history_sheet
+from sqlite_store import open_storage
+
+# Exit codes
+EXIT_OK = 0
+EXIT_FAILED = 1   # a sheet or disk operation failed; queued rows are kept
+EXIT_USAGE = 2    # bad arguments (argparse uses 2 as well)
+EXIT_LOCKED = 3   # another process holds the lock this command needs
+
+# Rows queued by pushes; the UI's Resync reads it (under PUSH_LOCK) as pending
+OUTBOX_PATH = 'sync_outbox.jsonl'
+
+
+class Reporter:
+    # One line per event on stdout: readable text, or one JSON object per line.
+    # With quiet_idle, pushes that moved no rows are not reported.
+    def __init__(self, as_json, quiet_idle=False, stream=None):
+        self.as_json = as_json
+        self.quiet_idle = quiet_idle
+        self.stream = stream or sys.stdout
+
+    def emit(self, event, text, **fields):
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if self.as_json:
+            line = json.dumps(dict({'event': event, 'time': now}, **fields))
+        else:
+            line = f"{now} {text}"
+        self.stream.write(line + '\n')
+        self.stream.flush()
+
+
+class HeadlessSync:
+    # The UI's push and pull without Tk, on the same local files. A push only
+    # reads the module store, so it can run next to an open UI; a pull writes
+    # it and needs the store to itself.
+    def __init__(self, storage='json', sheet=None, sheet_title='uiWireBonder',
+                 read_only=True, station=None):
+        self.store = open_storage(storage, read_only=read_only)
+        self.sync_state = SyncState('sync_state.json', station=station)
+        self.sheet_reads = SheetReads()
+        # Not the UI's sheet_outbox.jsonl: the UI rewrites that file from
+        # memory and would drop rows queued here
+        self.outbox = SheetOutbox(OUTBOX_PATH)
+        self.flusher = OutboxFlusher(self.outbox, self.connect)
+        self.sheet = sheet
+        self.sheet_title = sheet_title
+        self.schema = SheetSchema()
+        self.store_seen = None
+
+    def connect(self):
+        if self.sheet is None:
+            _, self.sheet = open_history_sheet(self.sheet_title)
+        return self.sheet
+
+    def store_stamp(self):
+        # Size and mtime of the store's files, to skip reloading an idle store
+        paths = [self.store.path, self.store.path + '-wal', getattr(self.store, 'journal_path', '')]
+        stamp = []
+        for path in paths:
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            stamp.append((path, info.st_size, info.st_mtime_ns))
+        return stamp
+
+    def load_schema(self):
+        # The UI keeps the cached schema current; only go to the sheet when
+        # there is no usable header yet. The flusher re-reads the live header
+        # before uploading and moves cells to where the columns are now.
+        self.schema = SheetSchema.from_json(self.store.load_schema())
+        if not self.schema.header or self.schema.layout.missing_sync_columns():
+            self.schema.update(ensure_sync_columns(self.connect()).header)
+
+    def push(self):
+        # Queue the history entries the sheet has not seen, then flush everything
+        # queued (including rows left over from an earlier failed run)
+        queued = modules = 0
+        stamp = self.store_stamp()
+        if stamp != self.store_seen:
+            module_params = self.store.load()
+            self.load_schema()
+            rows, new_watermarks = self.sync_state.pending_rows(module_params, self.schema)
+            if rows:
+                # Durable in the outbox first, so the watermarks can move on
+                self.outbox.add(rows, self.schema.header)
+                self.sync_state.commit(new_watermarks)
+            queued, modules = len(rows), len(new_watermarks)
+            self.store_seen = stamp
+        pushed = self.flusher.flush_once()
+        return {'queued': queued, 'modules': modules, 'pushed': pushed,
+                'pending': self.outbox.pending_rows()}
+
+    def pull(self):
+        # Merge every sheet row into local storage, like "Read from Sheet"
+        module_params = self.store.load()
+        self.schema = SheetSchema.from_json(self.store.load_schema())
+        self.sync_state.refresh()
+        merger = SheetMerger(module_params, self.sync_state, HistoryIndex(module_params),
+                             self.schema)
+        # Only rows added since the last pull (by this command or the UI)
+        for title, header, start_row, rows in iter_history_pages(self.connect(), self.sheet_reads):
+            if header is not None:
+                self.schema.update(header)
+                self.store.save_schema(self.schema.to_json())
+            changed = merger.merge(rows)
+            for module_id in changed:
+                self.store.record_put(module_id)
+            if changed:
+                self.sync_state.commit({module_id: self.sync_state.watermarks[module_id]
+                                        for module_id in changed})
+        self.sheet_reads.commit()
+        return {'rows_read': merger.rows_read, 'entries_added': merger.rows_added,
+                'modules_changed': len(merger.changed),
+                'conflicts': sorted(find_conflicts(module_params))}
+
+    def close(self):
+        self.store.close()
+
+
+def run_cycle(sync, reporter, push, pull):
+    # One pull and/or push; returns an exit code
+    code = EXIT_OK
+    if pull:
+        try:
+            result = sync.pull()
+        except Exception as e:
+            reporter.emit('error', f"Pull failed: {e}", step='pull', error=str(e),
+                          type=type(e).__name__)
+            code = EXIT_FAILED
+        else:
+            text = (f"Pulled {result['rows_read']} rows: {result['entries_added']} new entries "
+                    f"in {result['modules_changed']} modules")
+            if result['conflicts']:
+                text += f"; {len(result['conflicts'])} modules have conflicting edits"
+            reporter.emit('pull', text, **result)
+    if push:
+        try:
+            result = sync.push()
+        except Exception as e:
+            reporter.emit('error', f"Push failed, {sync.outbox.pending_rows()} rows kept "
+                                   f"for the next attempt: {e}",
+                          step='push', error=str(e), type=type(e).__name__,
+                          pending=sync.outbox.pending_rows())
+            code = EXIT_FAILED
+        else:
+            if result['queued'] or result['pushed'] or not reporter.quiet_idle:
+                reporter.emit('push', f"Pushed {result['pushed']} rows "
+                                      f"({result['queued']} new from {result['modules']} modules, "
+                                      f"{result['pending']} still pending)", **result)
+    return code
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='uiWireBonder.py sync',
+        description="Push local module history to the sheet and/or merge the sheet into "
+                    "local storage, without the UI.")
+    parser.add_argument('--push', action='store_true',
+                        help="upload history entries the sheet does not have yet")
+    parser.add_argument('--pull', action='store_true',
+                        help="merge the sheet into local storage (not while the UI is open)")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running, repeating every --interval seconds (implies --push "
+                             "unless --pull is given); stop with SIGINT/SIGTERM")
+    parser.add_argument('--interval', type=float, default=60.0,
+                        help="seconds between rounds in --watch mode (default 60)")
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default='json',
+                        help="local storage backend, as for the UI")
+    parser.add_argument('--sheet', default='uiWireBonder',
+                        help="spreadsheet title (default uiWireBonder)")
+    parser.add_argument('--json', action='store_true',
+                        help="print one JSON object per event instead of text")
+    args = parser.parse_args(argv)
+    if not args.push and not args.pull:
+        if not args.watch:
+            parser.error("nothing to do, give --push, --pull and/or --watch")
+        args.push = True
+
+    reporter = Reporter(args.json, quiet_idle=args.watch)
+
+    locks = []
+    for needed, path in ((args.pull, STORE_LOCK), (args.push, PUSH_LOCK)):
+        if not needed:
+            continue
+        lock = FileLock(path)
+        if not lock.acquire("uiWireBonder.py sync"):
+            reporter.emit('locked', f"{lock.holder()} holds {path}, not syncing",
+                          lock=path, holder=lock.holder())
+            return EXIT_LOCKED
+        locks.append(lock)
+
+    sync = HeadlessSync(args.storage, sheet_title=args.sheet, read_only=not args.pull)
+    try:
+        if not args.watch:
+            code = run_cycle(sync, reporter, args.push, args.pull)
+        else:
+            stop = threading.Event()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda signum, frame: stop.set())
+            reporter.emit('watch', f"Watching, every {args.interval:g}s", interval=args.interval)
+            code = EXIT_OK
+            while not stop.is_set():
+                code = run_cycle(sync, reporter, args.push, args.pull)
+                stop.wait(args.interval)
+    finally:
+        sync.close()
+        for lock in locks:
+            lock.release()
+    reporter.emit('exit', f"Done (exit code {code})", code=code)
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,21 +2,29 @@
 
 import tkinter as tk
 from tkinter import messagebox, ttk
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import time
 from datetime import datetime
 
+from background_worker import BackgroundWorker
+from sheet_outbox import OutboxFlusher, SheetOutbox
+from sheet_viewer import PagedSheetViewer
+from sheets_client import open_worksheet
+
 class WireTrackingGUI:
+    # Burst mode uploads buffered entries once the oldest has waited this long,
+    # or as soon as this many are pending
+    FLUSH_INTERVAL = 10.0
+    FLUSH_ROWS = 20
+
     def __init__(self, root):
         self.root = root
         self.root.title("Wire Tracking System")
 
-        # Initialize Google Sheets connection
-        scope = ['https://spreadsheets.google.com/feeds',
-                'https://www.googleapis.com/auth/drive']
-        creds = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', scope)
-        self.client = gspread.authorize(creds)
-        self.sheet = self.client.open('test').sheet1
+        # Initialize Google Sheets connection; calls are throttled to the
+        # API quota and retried when rate limited
+        self.client, self.sheet = open_worksheet('test')
+        # Sheet calls (single entries, data viewer reads) run off the Tk thread
+        self.worker = BackgroundWorker(root)
 
         # Create main frame
         main_frame = ttk.Frame(root, padding="10")
@@ -30,6 +38,8 @@ class WireTrackingGUI:
         ttk.Label(main_frame, text="Wire ID:").grid(row=1, column=0, sticky=tk.W, pady=5)
         self.wire_id = ttk.Entry(main_frame)
         self.wire_id.grid(row=1, column=1, padx=5, pady=5)
+        # Barcode scanners finish with Enter
+        self.wire_id.bind('<Return>', lambda event: self.add_entry())
 
         # Create buttons
         ttk.Button(main_frame, text="Submit Entry", command=self.add_entry).grid(row=2, column=0, columnspan=2, pady=10)
@@ -39,6 +49,29 @@ class WireTrackingGUI:
         self.status_label = ttk.Label(main_frame, text="")
         self.status_label.grid(row=4, column=0, columnspan=2, pady=5)
 
+        # Burst mode: entries go to a durable outbox and are shown at once in
+        # the pending list; a background thread appends them in one call
+        self.burst_mode = tk.BooleanVar(value=False)
+        ttk.Checkbutton(main_frame, text="Burst mode (upload in batches)",
+                        variable=self.burst_mode).grid(row=5, column=0, columnspan=2, pady=5)
+        self.pending_label = ttk.Label(main_frame, text="")
+        self.pending_label.grid(row=6, column=0, columnspan=2)
+        self.pending_list = tk.Listbox(main_frame, height=8, width=45)
+        self.pending_list.grid(row=7, column=0, columnspan=2, pady=5)
+        ttk.Button(main_frame, text="Upload Now",
+                   command=self.flush_pending).grid(row=8, column=0, columnspan=2, pady=5)
+
+        self.outbox = SheetOutbox('wire_outbox.jsonl')
+        self.flusher = OutboxFlusher(self.outbox, lambda: self.sheet)
+        self.flusher.start()
+        self.shown_batches = None
+        if len(self.outbox):
+            self.status_label.config(
+                text=f"{self.outbox.pending_rows()} entries from the last session waiting for upload")
+            self.flusher.wake()
+        self.refresh_pending()
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+
     def add_entry(self):
         try:
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -50,56 +83,75 @@ class WireTrackingGUI:
                 messagebox.showerror("Error", "Please fill in all fields")
                 return
 
-            # Add row to spreadsheet
             row_data = [timestamp, module_id, wire_id]
-            self.sheet.append_row(row_data)
+            # Rows still buffered go first, so the sheet stays in scan order
+            if self.burst_mode.get() or len(self.outbox):
+                self.outbox.add([row_data])
+                if self.outbox.pending_rows() >= self.FLUSH_ROWS:
+                    self.flush_pending()
+                self.refresh_pending(reschedule=False)
+
+                # Next wire of the same module
+                self.wire_id.delete(0, tk.END)
+                self.wire_id.focus_set()
+                self.status_label.config(text=f"Entry buffered at {timestamp}")
+                return
 
-            # Clear entries and show success message
-            self.module_id.delete(0, tk.END)
-            self.wire_id.delete(0, tk.END)
-            self.status_label.config(text=f"Entry added successfully at {timestamp}")
+            # Add row to spreadsheet off the Tk thread; a rate-limited call
+            # may wait for quota
+            self.status_label.config(text=f"Uploading entry from {timestamp}...")
+            self.worker.submit("Adding entry", lambda job: self.sheet.append_row(row_data),
+                               on_done=lambda result: self.entry_added(row_data),
+                               on_error=self.entry_failed)
 
         except Exception as e:
             messagebox.showerror("Error", f"Failed to add entry: {str(e)}")
 
-    def view_data(self):
-        try:
-            # Create new window for data display
-            data_window = tk.Toplevel(self.root)
-            data_window.title("Wire Tracking Data")
-
-            # Create treeview
-            tree = ttk.Treeview(data_window, columns=('Timestamp', 'Module ID', 'Wire ID'), show='headings')
-
-            # Set column headings
-            tree.heading('Timestamp', text='Timestamp')
-            tree.heading('Module ID', text='Module ID')
-            tree.heading('Wire ID', text='Wire ID')
-
-            # Set column widths
-            tree.column('Timestamp', width=150)
-            tree.column('Module ID', width=100)
-            tree.column('Wire ID', width=100)
-
-            # Get and insert data
-            data = self.sheet.get_all_values()
-            for row in data[1:]:  # Skip header row
-                tree.insert('', tk.END, values=row)
-
-            # Add scrollbar
-            scrollbar = ttk.Scrollbar(data_window, orient=tk.VERTICAL, command=tree.yview)
-            tree.configure(yscrollcommand=scrollbar.set)
-
-            # Pack elements
-            tree.grid(row=0, column=0, sticky='nsew')
-            scrollbar.grid(row=0, column=1, sticky='ns')
-
-            # Configure grid weights
-            data_window.grid_columnconfigure(0, weight=1)
-            data_window.grid_rowconfigure(0, weight=1)
+    def entry_added(self, row_data):
+        timestamp, module_id, wire_id = row_data
+        # Clear entries unless the next scan has already been typed in
+        if self.module_id.get() == module_id and self.wire_id.get() == wire_id:
+            self.module_id.delete(0, tk.END)
+            self.wire_id.delete(0, tk.END)
+        self.status_label.config(text=f"Entry added successfully at {timestamp}")
+
+    def entry_failed(self, e):
+        self.status_label.config(text="")
+        messagebox.showerror("Error", f"Failed to add entry: {str(e)}")
+
+    def flush_pending(self):
+        # Upload now, unless the flusher is backing off after a failure
+        if len(self.outbox) and self.flusher.retry_at is None:
+            self.flusher.wake()
+
+    def refresh_pending(self, reschedule=True):
+        batches = self.outbox.pending()
+        if batches and time.time() - batches[0]['queued'] >= self.FLUSH_INTERVAL:
+            self.flush_pending()
+
+        batch_ids = [batch['id'] for batch in batches]
+        if batch_ids != self.shown_batches:
+            self.shown_batches = batch_ids
+            self.pending_list.delete(0, tk.END)
+            for batch in batches:
+                for timestamp, module_id, wire_id in batch['rows']:
+                    self.pending_list.insert(tk.END, f"{timestamp}  {module_id}  {wire_id}")
+        text = f"Pending upload: {self.outbox.pending_rows()} entries"
+        if self.flusher.retry_at is not None and batches:
+            text += f" (offline, retry in {max(0, self.flusher.retry_at - time.time()):.0f}s)"
+        self.pending_label.config(text=text)
+        if reschedule:
+            self.root.after(500, self.refresh_pending)
+
+    def close(self):
+        # Anything still pending stays in wire_outbox.jsonl for the next start
+        self.flusher.stop()
+        self.root.destroy()
 
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to load data: {str(e)}")
+    def view_data(self):
+        # Rows are fetched page by page as the table is scrolled
+        PagedSheetViewer(self.root, self.sheet, self.worker, title="Wire Tracking Data",
+                         widths={'Timestamp': 150, 'Module ID': 100, 'Wire ID': 100})
 
 if __name__ == "__main__":
     root = tk.Tk()
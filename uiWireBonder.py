@@ -1,37 +1,83 @@
 #!/usr/bin/env python3
 
 import tkinter as tk
-from tkinter import ttk, messagebox
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from datetime import datetime
-import json
+from tkinter import ttk, messagebox, filedialog
+from datetime import datetime, timedelta
 
+import argparse
 import os
+import sys
 from tkinter import PhotoImage
 from PIL import Image, ImageTk
 
+from background_worker import BackgroundWorker
+from bulk_import import BulkImport
+from history_index import HistoryIndex
+from instrumentation import metrics, timed
+from history_store import CompactHistory
+from history_view import VirtualHistoryView
+from module_query import OPERATORS, Predicate, Query, QueryIndex
+from module_search import ModuleIdIndex
+from parameter_form import ParameterForm
+from sheet_import import SheetMerger
+from sheet_outbox import OutboxFlusher, SheetOutbox
+from sheet_partitions import SheetReads, iter_history_pages, open_history
+from sheets_client import open_history_sheet, wrap_sheet
+from sheet_schema import SheetLayout, SheetSchema, make_origin, split_origin
+from sheet_sync import (PUSH_LOCK, STORE_LOCK, FileLock, SyncState, ensure_sync_columns, find_conflicts,
+                        head_base, max_revision, missing_rows, row_key)
+from sqlite_store import open_storage
+import param_report
+import sheet_partitions
+import sync_daemon
+
+# Modules whose history is copied out for the report per Tk tick
+REPORT_CHUNK = 500
+
+
 class ModuleTrackingGUI:
-    def __init__(self, root):
+    def __init__(self, root, fast_start=True, sheet=None, storage='json', station=None,
+                 header_max_age=3600):
         self.root = root
         self.root.title("Module Tracking System")
 
-        # Initialize Google Sheets connection
-        scope = ['https://spreadsheets.google.com/feeds',
-                'https://www.googleapis.com/auth/drive']
-        creds = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', scope)
-        self.client = gspread.authorize(creds)
-        self.sheet = self.client.open('uiWireBonder').sheet1
-
-        # Get parameters from first row
-        self.parameters = self.sheet.row_values(1)[2:]
-
-        # Load or create module params with timestamps
-        try:
-            with open('module_params.json', 'r') as f:
-                self.module_params = json.load(f)
-        except FileNotFoundError:
+        # Google Sheets connection is opened on the worker thread; until then
+        # the form uses the schema cached from the last connection, and while
+        # that is younger than header_max_age seconds the header is not re-read
+        self.client = None
+        self.sheet = None
+
+        # Load or create module params with timestamps (JSON snapshot + journal
+        # replay, or SQLite). In fast-start mode only the module index is read
+        # now and the full history is loaded in the background.
+        self.store = open_storage(storage)
+        self.schema = SheetSchema.from_json(self.store.load_schema())
+        self.parameters = self.schema.parameters
+        self.header_max_age = header_max_age
+        self.module_index = {}
+        if fast_start:
             self.module_params = {}
+            self.module_index = self.store.load_index() or {}
+            self.history_index = HistoryIndex()
+            self.history_loaded = False
+        else:
+            self.module_params = self.store.load()
+            self.history_index = HistoryIndex(self.module_params)
+            self.history_loaded = True
+        # Secondary indexes for the query dialog, updated on every save
+        self.query_index = QueryIndex(self.module_params)
+        # Parsed history for reports, loaded on the first one
+        self.parsed_histories = None
+        self.report_running = False
+
+        # Track which history entries have already been pushed to the sheet;
+        # every row this station writes is stamped with its station id
+        self.sync_state = SyncState('sync_state.json', station=station)
+        self.sync_state.note_revision(self.own_revision(self.module_params))
+        # How far "Read All from Sheet" got in each worksheet
+        self.sheet_reads = SheetReads()
+        # Modules edited concurrently on another station: {module_id: head positions}
+        self.conflicts = find_conflicts(self.module_params)
 
         # Create main frame with three columns
         self.main_frame = ttk.Frame(root, padding="10")
@@ -43,33 +89,40 @@ class ModuleTrackingGUI:
 
         ttk.Label(self.left_frame, text="Module ID:").pack(pady=5)
         self.module_id_var = tk.StringVar()
-        self.module_id_combo = ttk.Combobox(self.left_frame, textvariable=self.module_id_var)
-        self.module_id_combo['values'] = list(self.module_params.keys())
+        self.module_id_combo = ttk.Combobox(self.left_frame, textvariable=self.module_id_var,
+                                            postcommand=self.refresh_module_choices)
         self.module_id_combo.pack(pady=5)
         self.module_id_combo.bind('<<ComboboxSelected>>', self.on_module_select)
 
+        # Type-ahead: the dropdown only ever holds the ids matching what was typed
+        self.module_search = ModuleIdIndex(self.module_ids())
+        self.refresh_module_choices()
+        self.module_id_combo.bind('<KeyRelease>', self.on_module_search)
+        self.module_id_combo.bind('<Return>', self.on_module_select)
+
         # Add buttons
         ttk.Button(self.left_frame, text="Add New Module",
                   command=self.show_add_module_dialog).pack(pady=5)
+        ttk.Button(self.left_frame, text="Import Modules...",
+                  command=self.import_modules).pack(pady=5)
+        ttk.Button(self.left_frame, text="Query...",
+                  command=self.show_query).pack(pady=5)
+        ttk.Button(self.left_frame, text="Report...",
+                  command=self.make_report).pack(pady=5)
         ttk.Button(self.left_frame, text="Clear Module",
                   command=self.clear_module).pack(pady=5)
-        # Add TIDC logo at the bottom of left_frame
-        try:
-            logo_image = Image.open('tidc_icon.png')
-            logo_image = logo_image.resize((150, 50), Image.Resampling.LANCZOS)  # Adjust size as needed
-            self.logo_photo = ImageTk.PhotoImage(logo_image)
-            logo_label = ttk.Label(self.left_frame, image=self.logo_photo)
-            logo_label.pack(side='bottom', pady=10)
-        except Exception as e:
-            print(f"Could not load logo: {e}")
+        # TIDC logo goes at the bottom of left_frame once it is decoded
+        self.logo_label = ttk.Label(self.left_frame)
+        self.logo_label.pack(side='bottom', pady=10)
 
         # Middle Column - Parameter Entry
         self.middle_frame = ttk.LabelFrame(self.main_frame, text="Module Parameters")
         self.middle_frame.grid(row=0, column=1, padx=5, pady=5, sticky='nsew')
 
-        # Parameter Frame
-        self.param_frame = ttk.Frame(self.middle_frame)
-        self.param_frame.pack(fill='both', expand=True, pady=5)
+        # Parameter form, rebuilt only when the sheet header changes
+        self.param_form = ParameterForm(self.middle_frame)
+        self.param_form.pack(fill='both', expand=True, pady=5)
+        self.param_form.build(self.parameters)
 
         # Always visible Save Parameters button in middle frame
         self.save_button = ttk.Button(self.middle_frame, text="Save Parameters",
@@ -88,11 +141,9 @@ class ModuleTrackingGUI:
 
         # Add History Section
         ttk.Label(self.right_frame, text="Modification History:").pack(pady=(10,0))
-        self.history_listbox = ttk.Treeview(self.right_frame, height=6,
-                                          columns=('Timestamp',), show='headings')
-        self.history_listbox.heading('Timestamp', text='Timestamp')
-        self.history_listbox.pack(pady=5, fill='x')
-        self.history_listbox.bind('<<TreeviewSelect>>', self.show_history_details)
+        self.history_view = VirtualHistoryView(self.right_frame, height=6)
+        self.history_view.pack(pady=5, fill='x')
+        self.history_view.bind_select(self.show_history_details)
 
         # Google Sheets Operations Frame
         self.sheets_frame = ttk.LabelFrame(self.main_frame, text="Google Sheets Operations")
@@ -103,12 +154,200 @@ class ModuleTrackingGUI:
                   command=self.submit_all_to_sheet).pack(side='left', padx=5, pady=5)
         ttk.Button(self.sheets_frame, text="Read All from Sheet",
                   command=self.read_all_from_sheet).pack(side='left', padx=5, pady=5)
+        ttk.Button(self.sheets_frame, text="Resync Sheet",
+                  command=self.resync_sheet).pack(side='left', padx=5, pady=5)
+        self.conflicts_button = ttk.Button(self.sheets_frame, text="Conflicts",
+                                           command=self.show_conflicts)
+        self.conflicts_button.pack(side='left', padx=5, pady=5)
+        self.refresh_conflicts()
+        if metrics.enabled:
+            ttk.Button(self.sheets_frame, text="Stats",
+                      command=self.show_stats).pack(side='left', padx=5, pady=5)
+        self.cancel_button = ttk.Button(self.sheets_frame, text="Cancel",
+                                        command=self.cancel_sheet_operation)
+        self.cancel_button.pack(side='right', padx=5, pady=5)
+        self.cancel_button.config(state='disabled')
+        self.outbox_label = ttk.Label(self.sheets_frame, text="")
+        self.outbox_label.pack(side='right', padx=5, pady=5)
 
         # Move status label to row 3 and ensure it's visible
         self.status_label = ttk.Label(self.main_frame, text="")
         self.status_label.grid(row=3, column=0, columnspan=3, pady=5)
 
-        self.param_entries = {}
+
+        # All gspread calls go through this worker so the UI never blocks
+        self.sheets_worker = BackgroundWorker(self.root, on_status=self.show_sheet_status)
+        self.resync_job = None
+        self.connect_attempts = 0
+        if sheet is None:
+            self.connect_to_sheet()
+        else:
+            # Worksheet or spreadsheet supplied by the caller, e.g. a
+            # fake_sheet.FakeWorksheet or FakeSpreadsheet
+            if hasattr(sheet, 'worksheets'):
+                self.sheet = open_history(sheet, wrap_sheet)
+            else:
+                self.sheet = wrap_sheet(sheet)
+            self.set_header(ensure_sync_columns(self.sheet).header)
+
+        # Local disk work that can wait until the window is up
+        self.local_worker = BackgroundWorker(self.root)
+        if fast_start:
+            self.local_worker.submit("Loading logo", lambda job: self.decode_logo(),
+                                     on_done=self.show_logo, on_error=self.logo_failed)
+            self.load_history()
+        else:
+            try:
+                self.show_logo(self.decode_logo())
+            except Exception as e:
+                self.logo_failed(e)
+
+        # Submitted rows wait in a durable outbox until the sheet accepts them
+        self.outbox = SheetOutbox('sheet_outbox.jsonl')
+        self.flusher = OutboxFlusher(self.outbox, lambda: self.sheet)
+        self.flusher.start()
+        self.refresh_outbox_status()
+
+    def decode_logo(self):
+        logo_image = Image.open('tidc_icon.png')
+        return logo_image.resize((150, 50), Image.Resampling.LANCZOS)  # Adjust size as needed
+
+    def show_logo(self, logo_image):
+        # PhotoImage has to be created on the Tk thread
+        self.logo_photo = ImageTk.PhotoImage(logo_image)
+        self.logo_label.config(image=self.logo_photo)
+
+    def logo_failed(self, e):
+        print(f"Could not load logo: {e}")
+
+    def load_history(self):
+        def load(job):
+            module_params = self.store.load()
+            return (module_params, HistoryIndex(module_params), QueryIndex(module_params),
+                    self.own_revision(module_params))
+
+        def loaded(result):
+            self.module_params, self.history_index, self.query_index, revision = result
+            self.sync_state.note_revision(revision)
+            self.history_loaded = True
+            self.module_index = {}
+            self.update_module_list()
+            self.conflicts = find_conflicts(self.module_params)
+            self.refresh_conflicts()
+            # Fill in the parameters of a module selected while loading
+            self.on_module_select(None)
+            self.status_label.config(text="Module history loaded")
+
+        def failed(e):
+            self.status_label.config(text="Failed to load module history")
+            messagebox.showerror("Error", f"Failed to load module_params.json: {str(e)}")
+
+        self.status_label.config(text="Loading module history...")
+        self.local_worker.submit("Loading module history", load,
+                                 on_done=loaded, on_error=failed)
+
+    def module_ids(self):
+        if self.history_loaded:
+            return list(self.module_params.keys())
+        return list(self.module_index.keys())
+
+    def require_history(self):
+        if not self.history_loaded:
+            self.status_label.config(text="Still loading module history, please wait")
+            return False
+        return True
+
+    def connect_to_sheet(self):
+        self.connect_attempts += 1
+        fresh = (self.schema.is_fresh(self.header_max_age)
+                 and not self.schema.layout.missing_sync_columns())
+        def connect(job):
+            # Initialize Google Sheets connection
+            job.progress("opening spreadsheet")
+            client, sheet = open_history_sheet('uiWireBonder')
+
+            # Uploads and reads re-check the header themselves, so a recent
+            # cached one is good enough to start with
+            if fresh:
+                return client, sheet, None
+            # Get parameters from first row
+            job.progress("reading header")
+            return client, sheet, ensure_sync_columns(sheet).header
+
+        def connected(result):
+            self.client, self.sheet, header = result
+            if header is not None:
+                self.set_header(header)
+                self.status_label.config(text="Connected to Google Sheets")
+            else:
+                self.status_label.config(text="Connected to Google Sheets (cached header)")
+            self.flusher.wake()
+
+        def failed(e):
+            self.status_label.config(text="Not connected to Google Sheets, retrying in 60s")
+            if self.connect_attempts == 1:
+                messagebox.showerror("Error", f"Failed to connect to sheet: {str(e)}")
+            self.root.after(60000, self.connect_to_sheet)
+
+        self.sheets_worker.submit("Connecting to Google Sheets", connect,
+                                  on_done=connected, on_error=failed)
+
+    def set_header(self, header):
+        # A header just read from the sheet: remember when it was checked and,
+        # if it changed, remap the form (stored values keep their column ids)
+        changed = self.schema.update(header)
+        self.store.save_schema(self.schema.to_json())
+        if not changed:
+            return
+        self.parameters = self.schema.parameters
+        # Redraw the parameter form with the new header
+        self.param_form.build(self.parameters)
+        self.on_module_select(None)
+
+    @property
+    def param_entries(self):
+        return self.param_form.entries
+
+    def show_sheet_status(self, text, busy):
+        if text:
+            self.status_label.config(text=text)
+        self.cancel_button.config(state='normal' if busy else 'disabled')
+
+    def cancel_sheet_operation(self):
+        if not self.sheets_worker.cancel():
+            self.status_label.config(text="The running sheet operation cannot be cancelled")
+
+    def refresh_outbox_status(self):
+        # The flusher re-reads the header before uploading; pick up changes
+        header = self.flusher.header_seen
+        if header and header != self.schema.header:
+            self.set_header(header)
+        self.outbox_label.config(text=self.flusher.status_text())
+        self.root.after(1000, self.refresh_outbox_status)
+
+    def require_sheet(self, exclusive=False):
+        if self.sheet is None:
+            self.status_label.config(text="Still connecting to Google Sheets, please wait")
+            return False
+        # Uploads compute their rows up front, so two in flight would push the same rows
+        if exclusive and self.sheets_worker.busy:
+            self.status_label.config(text="Another sheet operation is still running")
+            return False
+        return True
+
+    def require_header(self):
+        if not self.parameters:
+            self.status_label.config(text="Waiting for the parameter header from Google Sheets")
+            return False
+        return True
+
+    def require_sync_columns(self):
+        # Rows built before the header has its Station/Revision/Base columns
+        # would reach the sheet without them
+        if self.schema.layout.missing_sync_columns():
+            self.status_label.config(text="Waiting for the sheet header, please wait")
+            return False
+        return True
 
 
     def update_timestamps(self):
@@ -119,6 +358,9 @@ class ModuleTrackingGUI:
             self.modified_label.config(
                 text=f"Modified: {self.module_params[module_id]['modified']}")
     def show_add_module_dialog(self):
+        if not self.require_history() or not self.require_header():
+            return
+
         dialog = tk.Toplevel(self.root)
         dialog.title("Add New Module")
         dialog.geometry("400x500")  # Larger window for parameters
@@ -171,14 +413,14 @@ class ModuleTrackingGUI:
 
             # Initialize module without timestamps
             self.module_params[module_id] = {
-                'parameters': [entry.get() for entry in param_entries.values()],
+                'parameters': self.schema.to_storage([entry.get() for entry in param_entries.values()]),
                 'created': '',  # Will be set on first save
                 'modified': '',
-                'history': []
+                'history': CompactHistory()
             }
 
             # Update UI
-            self.update_module_list()
+            self.module_search.add(module_id)
             dialog.destroy()
 
             # Set the new module as selected
@@ -196,9 +438,19 @@ class ModuleTrackingGUI:
         ttk.Button(button_frame, text="Cancel",
                   command=dialog.destroy).pack(side='right', padx=5)
 
+    @timed('ui.on_module_select')
     def on_module_select(self, event):
-        self.clear_param_frame()
         module_id = self.module_id_var.get()
+        if not self.history_loaded:
+            # Only timestamps are known until the history has been loaded
+            module_info = self.module_index.get(module_id, {})
+            self.created_label.config(text=f"Created: {module_info.get('created', '')}")
+            self.modified_label.config(text=f"Modified: {module_info.get('modified', '')}")
+            self.save_button.config(state='disabled')
+            self.clear_param_frame()
+            self.update_history_display()
+            return
+
         if module_id in self.module_params:
             # Display timestamps
             created_time = self.module_params[module_id]['created']
@@ -210,90 +462,254 @@ class ModuleTrackingGUI:
                 text=f"Modified: {modified_time if modified_time else 'Not saved'}")
 
             # Display parameters
-            for i, (param_name, param_value) in enumerate(
-                zip(self.parameters, self.module_params[module_id]['parameters'])):
-                ttk.Label(self.param_frame, text=f"{param_name}:").grid(
-                    row=i, column=0, pady=2, padx=5, sticky='e')
-                entry = ttk.Entry(self.param_frame)
-                entry.insert(0, param_value)
-                entry.grid(row=i, column=1, pady=2, padx=5, sticky='w')
-                self.param_entries[param_name] = entry
+            self.param_form.load(self.schema.from_storage(self.module_params[module_id]['parameters']))
 
             # Enable save button
             self.save_button.config(state='normal')
         else:
             # Disable save button if no module selected
+            self.clear_param_frame()
             self.save_button.config(state='disabled')
 
         self.update_history_display()
 
+    @timed('ui.save_parameters')
     def save_parameters(self):
         module_id = self.module_id_var.get()
-        if module_id:
+        if module_id and self.require_history() and self.require_header():
+            # Get current parameters, in stored column order
+            history = self.module_params[module_id]['history']
+            new_parameters = self.schema.to_storage(self.param_form.values(), history.latest)
+
+            # Nothing changed since the last save: don't add a duplicate entry
+            if history and (not self.param_form.dirty_fields()
+                            or new_parameters == self.schema.pad(history.latest)):
+                self.param_form.mark_clean()
+                self.status_label.config(text="No changes to save")
+                return
+
+            self.append_entry(module_id, new_parameters)
+            self.param_form.mark_clean()
+            self.history_view.appended()
+            self.update_timestamps()
+            self.status_label.config(text="Parameters saved successfully")
+
+    def append_entry(self, module_id, values):
+        history_entry = self.add_history_entry(module_id, values)
+
+        # Append to the journal
+        self.store.record_save(module_id, history_entry)
+
+        # Saving on top of every head resolves a conflict
+        if self.conflicts.pop(module_id, None) is not None:
+            self.refresh_conflicts()
+
+    def own_revision(self, module_params):
+        # Highest revision this station stamped on any of these modules' entries
+        return max((max_revision(module_data['history'].origins, self.sync_state.station)
+                    for module_data in module_params.values()), default=0)
+
+    def add_history_entry(self, module_id, values, current_time=None):
+        # In-memory part of a save; the caller writes it to the store
+        if current_time is None:
             current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-            # If first save, set created timestamp
-            if not self.module_params[module_id]['created']:
-                self.module_params[module_id]['created'] = current_time
+        # If first save, set created timestamp
+        if not self.module_params[module_id]['created']:
+            self.module_params[module_id]['created'] = current_time
+
+        # Add to history. The origin carries this station's next revision
+        # number and the base names the entries this edit was made on top of.
+        history = self.module_params[module_id]['history']
+        history_entry = {
+            'seq': self.history_index.new_seq(),
+            'timestamp': current_time,
+            'parameters': values,
+            'origin': make_origin(self.sync_state.station, self.sync_state.new_revision()),
+            'base': head_base(history)
+        }
+        history.append(history_entry)
+        self.history_index.appended(module_id, history)
+        self.query_index.appended(module_id)
+
+        # Update current parameters and modified timestamp
+        self.module_params[module_id]['parameters'] = list(history.latest)
+        self.module_params[module_id]['modified'] = current_time
+        return history_entry
+
+    def import_modules(self):
+        # Create or update many modules from a CSV/TSV file in one go
+        if not self.require_history() or not self.require_header():
+            return
 
-            # Get current parameters
-            new_parameters = [entry.get() for entry in self.param_entries.values()]
+        path = filedialog.askopenfilename(
+            title="Import modules",
+            filetypes=[("CSV / TSV", "*.csv *.tsv *.txt"), ("All files", "*")])
+        if not path:
+            return
 
-            # Add to history
-            self.module_params[module_id]['history'].append({
-                'timestamp': current_time,
-                'parameters': new_parameters
-            })
+        try:
+            bulk = BulkImport(self.schema, self.module_params).read(path)
+        except (OSError, UnicodeDecodeError) as e:
+            messagebox.showerror("Error", f"Failed to read {path}: {str(e)}")
+            return
 
-            # Update current parameters and modified timestamp
-            self.module_params[module_id]['parameters'] = new_parameters
-            self.module_params[module_id]['modified'] = current_time
+        if bulk.errors:
+            problems = '\n'.join(f"line {line}: {message}" for line, message in bulk.errors[:20])
+            if len(bulk.errors) > 20:
+                problems += f"\n... and {len(bulk.errors) - 20} more"
+        else:
+            problems = "No problems found"
+        if not bulk.rows:
+            messagebox.showerror("Import", f"Nothing to import.\n\n{problems}")
+            return
+        if not messagebox.askyesno("Import", f"{bulk.summary()}.\n\n{problems}\n\n"
+                                             "Save these modules?"):
+            return
 
-            # Save to file and update display
-            with open('module_params.json', 'w') as f:
-                json.dump(self.module_params, f)
+        # All entries share one timestamp and go to the store in one write
+        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        module_ids = []
+        for module_id, values in bulk.rows:
+            if module_id not in self.module_params:
+                self.module_params[module_id] = {
+                    'parameters': [],
+                    'created': '',
+                    'modified': '',
+                    'history': CompactHistory()
+                }
+                self.module_search.add(module_id)
+            history = self.module_params[module_id]['history']
+            self.add_history_entry(module_id, self.schema.to_storage(values, history.latest),
+                                   current_time)
+            self.conflicts.pop(module_id, None)
+            module_ids.append(module_id)
+        try:
+            self.store.record_saves(module_ids)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save imported modules: {str(e)}")
+            return
+        self.refresh_conflicts()
+        self.refresh_module_choices()
+        if self.module_id_var.get() in self.module_params:
+            self.on_module_select(None)
 
-            self.update_history_display()
-            self.update_timestamps()
-            self.status_label.config(text="Parameters saved successfully")
+        text = f"Imported {len(module_ids)} modules"
+        if bulk.errors:
+            text += f", {len(bulk.errors)} problems skipped"
+        if self.schema.layout.missing_sync_columns():
+            text += "; submit them once connected to the sheet"
+        elif messagebox.askyesno("Import", f"{text}. Upload them to the sheet now?"):
+            # One outbox batch, flushed as a single append
+            modules = {module_id: self.module_params[module_id] for module_id in module_ids}
+            data, new_watermarks = self.sync_state.pending_rows(modules, self.schema)
+            try:
+                self.outbox.add(data, self.schema.header)
+                self.sync_state.commit(new_watermarks)
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to queue rows for the sheet: {str(e)}")
+                return
+            self.flusher.wake()
+            text += f", {len(data)} rows queued for upload"
+        self.status_label.config(text=text)
 
     def submit_all_to_sheet(self):
-        try:
-            # Clear the sheet except header
-            self.sheet.resize(rows=1)
-
-            # Prepare data for sheet - include all history for each module
-            data = []
-            for module_id, module_data in self.module_params.items():
-                # Add current state
-                current_row = [
-                    module_data['modified'],
-                    module_id
-                ] + module_data['parameters']
-                data.append(current_row)
-
-                # Add historical entries
-                for history_entry in module_data['history']:
-                    history_row = [
-                        history_entry['timestamp'],
-                        module_id
-                    ] + history_entry['parameters']
-                    data.append(history_row)
-
-            # Sort all data by timestamp
-            data.sort(key=lambda x: x[0], reverse=True)
-
-            # Append all data at once
-            if data:
-                self.sheet.append_rows(data)
-                self.status_label.config(text="All data submitted to sheet successfully")
-            else:
-                self.status_label.config(text="No data to submit")
+        if (not self.require_history() or not self.require_header()
+                or not self.require_sync_columns()):
+            return
+        if self.resync_job in self.sheets_worker.pending:
+            self.status_label.config(text="Sheet is being rebuilt, please wait")
+            return
+
+        # Only push history entries newer than each module's watermark
+        data, new_watermarks = self.sync_state.pending_rows(self.module_params, self.schema)
+        if not data:
+            self.status_label.config(text="Sheet is already up to date")
+            return
 
+        try:
+            # Rows are durable in the outbox, so the watermarks can move on now
+            self.outbox.add(data, self.schema.header)
+            self.sync_state.commit(new_watermarks)
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to submit to sheet: {str(e)}")
+            messagebox.showerror("Error", f"Failed to queue rows for the sheet: {str(e)}")
+            return
+
+        self.flusher.wake()
+        self.status_label.config(text=f"Queued {len(data)} new rows for upload")
+
+    def resync_sheet(self):
+        # Reconcile with the sheet without rewriting it: merge everything on the
+        # sheet into local data, then queue the local entries the sheet is missing
+        if not self.require_history() or not self.require_sheet(exclusive=True):
+            return
+
+        confirm = messagebox.askyesno("Confirm Resync",
+                                     "Merge the whole sheet with local data and upload "
+                                     "everything the sheet is missing?")
+        if not confirm:
+            return
+
+        # Keeps `sync --push` from queueing or uploading rows while we work out
+        # what the sheet is missing
+        push_lock = FileLock(PUSH_LOCK)
+        if not push_lock.acquire("uiWireBonder.py resync"):
+            messagebox.showerror("Error", f"{push_lock.holder()} is pushing to the sheet; "
+                                          "resync once it has stopped")
+            return
+
+        self.sync_state.refresh()
+        merger = SheetMerger(self.module_params, self.sync_state, self.history_index, self.schema)
+
+        def resync(job):
+            self.fetch_sheet(job, merger, full=True)
+
+        def resynced(result):
+            try:
+                queue_missing()
+            finally:
+                push_lock.release()
+
+        def queue_missing():
+            self.finish_sheet_merge(merger)
+
+            # Rows still waiting in our outbox or the push command's are as
+            # good as on the sheet
+            seen = set(merger.seen)
+            for batch in self.outbox.pending() + SheetOutbox(sync_daemon.OUTBOX_PATH).pending():
+                layout = SheetLayout(batch.get('header', self.schema.header))
+                for row in batch['rows']:
+                    timestamp, module_id, values, origin, base = layout.parse(row)
+                    seen.add(row_key(module_id, timestamp, origin))
+
+            data = missing_rows(self.module_params, seen, self.schema)
+            synced = {module_id: len(module_data['history'])
+                      for module_id, module_data in self.module_params.items()}
+            try:
+                if data:
+                    self.outbox.add(data, self.schema.header)
+                self.sync_state.commit(synced)
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to queue rows for the sheet: {str(e)}")
+                return
+            self.flusher.wake()
+            self.status_label.config(
+                text=f"Sheet resynced: {merger.rows_added} entries merged, "
+                     f"{len(data)} rows queued for upload")
+
+        def failed(e):
+            push_lock.release()
+            self.finish_sheet_merge(merger)
+            messagebox.showerror("Error", f"Failed to resync sheet: {str(e)}")
+
+        self.resync_job = self.sheets_worker.submit("Resyncing sheet", resync,
+                                                    on_done=resynced, on_error=failed,
+                                                    cancellable=False)
 
     def clear_module(self):
+        if not self.require_history():
+            return
+
         module_id = self.module_id_var.get()
         if not module_id:
             messagebox.showerror("Error", "Please select a Module ID first")
@@ -304,11 +720,14 @@ class ModuleTrackingGUI:
         if confirm:
             try:
                 del self.module_params[module_id]
-                with open('module_params.json', 'w') as f:
-                    json.dump(self.module_params, f)
+                self.history_index.remove_module(module_id)
+                self.query_index.modules_changed([module_id])
+                self.store.record_delete(module_id)
+                self.sync_state.forget(module_id)
 
                 self.module_id_combo.set('')
-                self.update_module_list()
+                self.module_search.remove(module_id)
+                self.refresh_module_choices()
                 self.clear_param_frame()
                 self.created_label.config(text="Created: ")
                 self.modified_label.config(text="Modified: ")
@@ -320,38 +739,40 @@ class ModuleTrackingGUI:
                 messagebox.showerror("Error", f"Failed to delete module: {str(e)}")
 
     def clear_param_frame(self):
-        for widget in self.param_frame.winfo_children():
-            widget.destroy()
-        self.param_entries.clear()
+        self.param_form.clear()
 
     def update_module_list(self):
-        self.module_id_combo['values'] = list(self.module_params.keys())
+        self.module_search.rebuild(self.module_ids())
+        self.refresh_module_choices()
+
+    def refresh_module_choices(self):
+        self.module_id_combo['values'] = self.module_search.search(self.module_id_var.get().strip())
+
+    def on_module_search(self, event):
+        if event.keysym in ('Up', 'Down', 'Return', 'Escape', 'Tab'):
+            return
+        self.refresh_module_choices()
 
+    @timed('ui.update_history_display')
     def update_history_display(self):
         module_id = self.module_id_var.get()
-        # Clear current history display
-        for item in self.history_listbox.get_children():
-            self.history_listbox.delete(item)
-
-        if module_id and 'history' in self.module_params[module_id]:
-            for entry in reversed(self.module_params[module_id]['history']):
-                self.history_listbox.insert('', 'end', values=(entry['timestamp'],))
+        if module_id in self.module_params:
+            self.history_view.set_entries(self.module_params[module_id]['history'])
+        else:
+            self.history_view.clear()
 
     def show_history_details(self, event):
-        selection = self.history_listbox.selection()
+        selection = self.history_view.selection()
         if not selection:
             return
 
         module_id = self.module_id_var.get()
-        selected_item = self.history_listbox.item(selection[0])
-        selected_timestamp = selected_item['values'][0]
 
-        # Find matching history entry
-        history_entry = next(
-            (entry for entry in self.module_params[module_id]['history']
-             if entry['timestamp'] == selected_timestamp), None)
+        # Treeview iids are the entries' seq ids
+        history_entry = self.history_index.get(module_id, int(selection[0]))
 
         if history_entry:
+            selected_timestamp = history_entry['timestamp']
             # Create popup window with historical parameters
             dialog = tk.Toplevel(self.root)
             dialog.title(f"History - {selected_timestamp}")
@@ -366,8 +787,12 @@ class ModuleTrackingGUI:
             frame.pack(fill='both', expand=True)
 
             ttk.Label(frame, text="Historical Parameters:").pack(pady=(0,10))
+            if 'origin' in history_entry:
+                station = split_origin(history_entry['origin'])[0]
+                ttk.Label(frame, text=f"Station: {station}").pack(pady=(0,10))
 
-            for param_name, param_value in zip(self.parameters, history_entry['parameters']):
+            values = self.schema.from_storage(history_entry['parameters'])
+            for param_name, param_value in zip(self.parameters, values):
                 param_frame = ttk.Frame(frame)
                 param_frame.pack(fill='x', pady=2)
                 ttk.Label(param_frame, text=f"{param_name}:").pack(side='left', padx=5)
@@ -377,58 +802,436 @@ class ModuleTrackingGUI:
                       command=dialog.destroy).pack(side='bottom', pady=10)
 
     def read_all_from_sheet(self):
-        try:
-            # Get all data from sheet
-            sheet_data = self.sheet.get_all_values()
-            if len(sheet_data) <= 1:  # Only header row exists
-                messagebox.showinfo("Info", "No data found in sheet")
+        if not self.require_history() or not self.require_sheet():
+            return
+
+        self.sync_state.refresh()
+        merger = SheetMerger(self.module_params, self.sync_state, self.history_index, self.schema)
+
+        def fetch(job):
+            self.fetch_sheet(job, merger)
+
+        def done(result):
+            self.finish_sheet_merge(merger)
+
+        def failed(e):
+            self.finish_sheet_merge(merger)
+            messagebox.showerror("Error", f"Failed to read from sheet: {str(e)}")
+
+        self.sheets_worker.submit("Reading sheet", fetch, on_done=done, on_error=failed)
+
+    def fetch_sheet(self, job, merger, full=False):
+        # Stream the sheet in pages, merging each one on the Tk thread. Each
+        # worksheet's header is applied before its rows. Unless `full`, only
+        # rows added since the last read are fetched (see sheet_partitions).
+        for title, header, start_row, rows in iter_history_pages(self.sheet, self.sheet_reads,
+                                                                 full=full):
+            job.check_cancelled()
+            if header is not None:
+                job.post(self.set_header, header)
+            job.post(self.merge_sheet_rows, merger, rows)
+            job.progress(f"read {title} up to row {start_row + len(rows) - 1}")
+        # Runs after the merges posted above
+        job.post(self.sheet_reads.commit)
+
+    @timed('ui.merge_sheet_rows')
+    def merge_sheet_rows(self, merger, rows):
+        changed = merger.merge(rows)
+        if not changed:
+            return
+
+        # Only modules that actually changed are written and redrawn
+        for module_id in changed:
+            self.store.record_put(module_id)
+            self.module_search.add(module_id)
+            self.conflicts.pop(module_id, None)
+        # Rows this station wrote before its local files were reset
+        self.sync_state.note_revision(self.own_revision(
+            {module_id: self.module_params[module_id] for module_id in changed}))
+        self.sync_state.commit({module_id: self.sync_state.watermarks[module_id]
+                                for module_id in changed})
+        self.query_index.modules_changed(changed)
+        self.conflicts.update(find_conflicts(self.module_params, changed))
+        self.refresh_conflicts()
+
+        if self.module_id_var.get() in changed:
+            self.on_module_select(None)
+
+    def finish_sheet_merge(self, merger):
+        self.refresh_module_choices()
+        if merger.rows_read == 0:
+            self.status_label.config(text="No data found in sheet")
+        else:
+            text = (f"Read {merger.rows_read} rows from sheet: {merger.rows_added} new entries "
+                    f"in {len(merger.changed)} modules")
+            if self.conflicts:
+                text += f"; {len(self.conflicts)} modules have conflicting edits"
+            self.status_label.config(text=text)
+
+    def show_stats(self):
+        # Live view of the instrumentation: timings per span and counters
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Stats")
+        dialog.geometry("640x420")
+
+        frame = ttk.Frame(dialog, padding="10")
+        frame.pack(fill='both', expand=True)
+
+        columns = ('count', 'errors', 'total', 'mean', 'max', 'last')
+        tree = ttk.Treeview(frame, columns=columns, height=12)
+        tree.heading('#0', text='Span')
+        tree.column('#0', width=200)
+        for column, title in zip(columns, ('Calls', 'Errors', 'Total ms', 'Mean ms',
+                                           'Max ms', 'Last ms')):
+            tree.heading(column, text=title)
+            tree.column(column, width=70, anchor='e')
+        tree.pack(fill='both', expand=True)
+        counters_label = ttk.Label(frame, text="", justify='left')
+        counters_label.pack(fill='x', pady=5)
+        ttk.Button(frame, text="Reset", command=metrics.reset).pack(side='left')
+        ttk.Button(frame, text="Close", command=dialog.destroy).pack(side='right')
+
+        def refresh():
+            if not dialog.winfo_exists():
                 return
+            spans, counters = metrics.snapshot()
+            tree.delete(*tree.get_children())
+            for name, count, errors, total, longest, last in spans:
+                tree.insert('', tk.END, text=name, values=(
+                    count, errors, f"{total * 1000:.1f}", f"{total * 1000 / count:.2f}",
+                    f"{longest * 1000:.1f}", f"{last * 1000:.1f}"))
+            lines = [f"{name}: {value}" for name, value in sorted(counters.items())]
+            lines.append(f"sheet requests in the last minute: {metrics.requests_last_minute()}")
+            counters_label.config(text='\n'.join(lines))
+            dialog.after(1000, refresh)
+
+        refresh()
+
+    def show_query(self):
+        # Find modules (by current values) or history entries by parameter
+        # conditions, save time range and module id prefix
+        if not self.require_history():
+            return
 
-            # Clear existing data
-            self.module_params = {}
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Query Modules")
+        dialog.geometry("800x550")
+
+        form = ttk.Frame(dialog, padding="10")
+        form.pack(fill='x')
+
+        ttk.Label(form, text="Module ID starts with:").grid(row=0, column=0, sticky=tk.W, pady=2)
+        prefix_entry = ttk.Entry(form)
+        prefix_entry.grid(row=0, column=1, sticky=tk.W, pady=2)
+
+        ttk.Label(form, text="Saved from:").grid(row=1, column=0, sticky=tk.W, pady=2)
+        since_entry = ttk.Entry(form)
+        since_entry.grid(row=1, column=1, sticky=tk.W, pady=2)
+        ttk.Label(form, text="to:").grid(row=1, column=2, sticky=tk.W, pady=2)
+        until_entry = ttk.Entry(form)
+        until_entry.grid(row=1, column=3, sticky=tk.W, pady=2)
+
+        def last_hours(hours):
+            since_entry.delete(0, tk.END)
+            since_entry.insert(0, (datetime.now() - timedelta(hours=hours)).strftime(
+                "%Y-%m-%d %H:%M:%S"))
+            until_entry.delete(0, tk.END)
+
+        ttk.Button(form, text="Last shift (8h)",
+                   command=lambda: last_hours(8)).grid(row=1, column=4, padx=5)
+        ttk.Label(form, text="(YYYY-MM-DD [HH:MM:SS]; 'to' includes the whole day/hour given)"
+                  ).grid(row=2, column=1, columnspan=4, sticky=tk.W)
+
+        conditions = []
+        for row in range(3, 6):
+            parameter_var = tk.StringVar()
+            ttk.Combobox(form, textvariable=parameter_var, values=[''] + list(self.parameters),
+                         state='readonly', width=20).grid(row=row, column=0, pady=2)
+            operator_var = tk.StringVar(value='=')
+            ttk.Combobox(form, textvariable=operator_var, values=OPERATORS,
+                         state='readonly', width=8).grid(row=row, column=1, sticky=tk.W, pady=2)
+            value_entry = ttk.Entry(form)
+            value_entry.grid(row=row, column=2, columnspan=2, sticky=tk.W, pady=2)
+            high_entry = ttk.Entry(form, width=10)
+            high_entry.grid(row=row, column=4, sticky=tk.W, pady=2)
+            conditions.append((parameter_var, operator_var, value_entry, high_entry))
+        ttk.Label(form, text="(second value for between / outside)").grid(row=6, column=4,
+                                                                         sticky=tk.W)
+
+        history_var = tk.BooleanVar(value=False)
+        ttk.Radiobutton(form, text="Modules (current values)", variable=history_var,
+                        value=False).grid(row=7, column=0, sticky=tk.W, pady=5)
+        ttk.Radiobutton(form, text="History entries", variable=history_var,
+                        value=True).grid(row=7, column=1, columnspan=2, sticky=tk.W, pady=5)
+
+        result_label = ttk.Label(dialog, text="")
+        result_frame = ttk.Frame(dialog)
+        tree = ttk.Treeview(result_frame, show='headings')
+        scrollbar = ttk.Scrollbar(result_frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+        results = []
+
+        def run():
+            predicates = []
+            shown = []
+            try:
+                for parameter_var, operator_var, value_entry, high_entry in conditions:
+                    name = parameter_var.get()
+                    if not name:
+                        continue
+                    column = self.parameters.index(name)
+                    predicates.append(Predicate(self.schema.live_ids[column], operator_var.get(),
+                                                value_entry.get(), high_entry.get()))
+                    if column not in shown:
+                        shown.append(column)
+            except ValueError as e:
+                messagebox.showerror("Query", str(e), parent=dialog)
+                return
 
-            # Skip header row
-            for row in sheet_data[1:]:
-                timestamp = row[0]
-                module_id = row[1]
-                parameters = row[2:]
-
-                # Create or update module
-                if module_id not in self.module_params:
-                    self.module_params[module_id] = {
-                        'parameters': parameters,
-                        'created': timestamp,
-                        'modified': timestamp,
-                        'history': []
-                    }
+            query = Query(predicates, since_entry.get(), until_entry.get(), prefix_entry.get(),
+                          history=history_var.get())
+            started = datetime.now()
+            found, total = self.query_index.run(query)
+            elapsed = (datetime.now() - started).total_seconds()
+
+            columns = ['Module ID', 'Timestamp'] + [self.parameters[column] for column in shown]
+            tree.delete(*tree.get_children())
+            tree.configure(columns=columns)
+            for name in columns:
+                tree.heading(name, text=name)
+                tree.column(name, width=140 if name == 'Timestamp' else 100)
+            results[:] = []
+            for item in found:
+                if query.history:
+                    module_id, position = item
+                    history = self.module_params[module_id]['history']
+                    timestamp = history.timestamps[position]
+                    values = history.values_at(position)
                 else:
-                    # Add to history if parameters are different
-                    if parameters != self.module_params[module_id]['parameters']:
-                        self.module_params[module_id]['history'].append({
-                            'timestamp': timestamp,
-                            'parameters': parameters
-                        })
-                        self.module_params[module_id]['parameters'] = parameters
-                        self.module_params[module_id]['modified'] = timestamp
-
-            # Save updated data to JSON
-            with open('module_params.json', 'w') as f:
-                json.dump(self.module_params, f)
+                    module_id = item
+                    timestamp = self.module_params[module_id]['modified']
+                    values = self.module_params[module_id]['history'].latest
+                values = self.schema.from_storage(values)
+                tree.insert('', tk.END, values=[module_id, timestamp] +
+                            [values[column] for column in shown])
+                results.append(module_id)
+
+            what = "entries" if query.history else "modules"
+            text = f"{total} {what} found in {elapsed * 1000:.0f} ms"
+            if total > len(found):
+                text += f", showing the newest {len(found)}" if query.history \
+                    else f", showing the first {len(found)}"
+            result_label.config(text=text)
+
+        def open_module(event):
+            selection = tree.selection()
+            if not selection:
+                return
+            module_id = results[tree.index(selection[0])]
+            if module_id in self.module_params:
+                self.module_id_combo.set(module_id)
+                self.on_module_select(None)
 
-            # Update UI
-            self.update_module_list()
-            self.module_id_combo.set('')  # Clear current selection
-            self.clear_param_frame()
-            self.created_label.config(text="Created: ")
-            self.modified_label.config(text="Modified: ")
-            self.update_history_display()
-            self.save_button.config(state='disabled')
-            self.status_label.config(text="Data successfully loaded from sheet")
+        tree.bind('<Double-1>', open_module)
+        ttk.Button(form, text="Run Query", command=run).grid(row=7, column=3, pady=5)
+        result_label.pack(fill='x', padx=10)
+        result_frame.pack(fill='both', expand=True, padx=10, pady=5)
 
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to read from sheet: {str(e)}")
+    def make_report(self):
+        # Parameter statistics over all history, written as HTML or CSV
+        if not self.require_history() or not self.require_header():
+            return
+        if self.report_running:
+            self.status_label.config(text="A report is already being written")
+            return
+        try:
+            param_report.require_numpy()
+        except RuntimeError as e:
+            messagebox.showerror("Report", str(e))
+            return
+
+        path = filedialog.asksaveasfilename(
+            title="Write report",
+            defaultextension=".html",
+            filetypes=[("HTML report", "*.html"), ("CSV summary", "*.csv")])
+        if not path:
+            return
+
+        self.report_running = True
+        self.status_label.config(text="Preparing report...")
+        module_ids = list(self.module_params)
+        stale = {}
+        started = datetime.now()
+
+        def collect(start):
+            # Copy out the histories the cache has not parsed, a chunk per tick
+            # so the window stays responsive
+            parsed = self.parsed_histories
+            chunk = {module_id: self.module_params[module_id]
+                     for module_id in module_ids[start:start + REPORT_CHUNK]
+                     if module_id in self.module_params}
+            stale.update(param_report.stale_histories(chunk, parsed))
+            if start + REPORT_CHUNK < len(module_ids):
+                self.root.after(1, collect, start + REPORT_CHUNK)
+                return
+            included = [module_id for module_id in module_ids
+                        if module_id in stale or module_id in parsed.fingerprints]
+            schema = SheetSchema.from_json(self.schema.to_json())
+
+            def build(job):
+                parsed.update(stale, included)
+                report = param_report.build_report(parsed, included, schema)
+                param_report.write_report(report, path)
+                if parsed.changed:
+                    parsed.save()
+                return report
+
+            self.local_worker.submit("Writing report", build, on_done=done, on_error=failed)
+
+        def opened(parsed):
+            self.parsed_histories = parsed
+            collect(0)
+
+        def done(report):
+            self.report_running = False
+            elapsed = (datetime.now() - started).total_seconds()
+            self.status_label.config(
+                text=f"Report written to {os.path.basename(path)}: {len(report.parameters)} "
+                     f"parameters, {report.modules} modules ({elapsed:.1f} s)")
+
+        def failed(e):
+            self.report_running = False
+            self.status_label.config(text="")
+            messagebox.showerror("Report", f"Failed to write the report: {str(e)}")
+
+        if self.parsed_histories is None:
+            self.local_worker.submit("Loading report cache",
+                                     lambda job: param_report.ParsedHistories.open(),
+                                     on_done=opened, on_error=failed)
+        else:
+            collect(0)
+
+    def refresh_conflicts(self):
+        if self.conflicts:
+            self.conflicts_button.config(text=f"Conflicts ({len(self.conflicts)})", state='normal')
+        else:
+            self.conflicts_button.config(text="Conflicts", state='disabled')
+
+    def show_conflicts(self):
+        # Modules edited on two stations from the same starting point. Each head
+        # is one station's latest version; keeping one saves it on top of all of them.
+        if not self.conflicts:
+            return
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Conflicting Edits")
+        dialog.geometry("700x450")
+        dialog.transient(self.root)
+
+        frame = ttk.Frame(dialog, padding="10")
+        frame.pack(fill='both', expand=True)
+
+        modules_list = tk.Listbox(frame, height=15, exportselection=False)
+        modules_list.pack(side='left', fill='y', padx=(0, 10))
+        module_ids = sorted(self.conflicts)
+        for module_id in module_ids:
+            modules_list.insert(tk.END, module_id)
+
+        detail_frame = ttk.Frame(frame)
+        detail_frame.pack(side='left', fill='both', expand=True)
+
+        def show_module(event=None):
+            for widget in detail_frame.winfo_children():
+                widget.destroy()
+            selection = modules_list.curselection()
+            if not selection:
+                return
+            module_id = module_ids[selection[0]]
+            history = self.module_params[module_id]['history']
+            heads = self.conflicts.get(module_id, [])
+
+            columns = ['Parameter'] + [f"head{i}" for i in range(len(heads))]
+            tree = ttk.Treeview(detail_frame, columns=columns, show='headings', height=12)
+            tree.heading('Parameter', text='Parameter')
+            versions = []
+            for i, position in enumerate(heads):
+                station = split_origin(history.origins[position])[0]
+                tree.heading(f"head{i}", text=f"{station} {history.timestamps[position]}")
+                versions.append(history.values_at(position))
+            shown = [self.schema.from_storage(version) for version in versions]
+            for column, param_name in enumerate(self.parameters):
+                values = [version[column] for version in shown]
+                # Only the fields the stations disagree on
+                if len(set(values)) > 1:
+                    tree.insert('', tk.END, values=[param_name] + values)
+            tree.pack(fill='both', expand=True)
+
+            button_row = ttk.Frame(detail_frame)
+            button_row.pack(fill='x', pady=5)
+            for position, values in zip(heads, versions):
+                station = split_origin(history.origins[position])[0]
+                ttk.Button(button_row, text=f"Keep {station}",
+                           command=lambda values=values: keep(module_id, values)).pack(
+                               side='left', padx=5)
+
+        def keep(module_id, values):
+            self.append_entry(module_id, list(values))
+            if self.module_id_var.get() == module_id:
+                self.on_module_select(None)
+            self.status_label.config(text=f"Conflict on {module_id} resolved, submit to share it")
+            if not self.conflicts:
+                dialog.destroy()
+                return
+            module_ids.remove(module_id)
+            modules_list.delete(0, tk.END)
+            for remaining in module_ids:
+                modules_list.insert(tk.END, remaining)
+            modules_list.selection_set(0)
+            show_module()
+
+        modules_list.bind('<<ListboxSelect>>', show_module)
+        modules_list.selection_set(0)
+        show_module()
 
 if __name__ == "__main__":
+    # Headless push/pull: python3 uiWireBonder.py sync --push/--pull/--watch
+    if sys.argv[1:2] == ['sync']:
+        sys.exit(sync_daemon.main(sys.argv[2:]))
+    # Parameter statistics: python3 uiWireBonder.py report report.html
+    if sys.argv[1:2] == ['report']:
+        sys.exit(param_report.main(sys.argv[2:]))
+    # Sheet partitions: python3 uiWireBonder.py partition --status
+    if sys.argv[1:2] == ['partition']:
+        sys.exit(sheet_partitions.main(sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(description="Module Tracking System")
+    parser.add_argument('--full-start', action='store_true',
+                        help="load all module history before showing the window")
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default='json',
+                        help="local storage backend; sqlite imports module_params.json on first use")
+    parser.add_argument('--header-max-age', type=float, default=3600,
+                        help="seconds a cached sheet header is used without re-reading it")
+    parser.add_argument('--stats', action='store_true',
+                        help="time sheet calls, disk writes and UI refreshes (Stats button)")
+    parser.add_argument('--stats-log', metavar='PATH',
+                        help="also append every timing to PATH as JSON lines; implies --stats")
+    parser.add_argument('--station',
+                        help="id stamped on this station's sheet rows (default: saved or generated)")
+    args = parser.parse_args()
+    if args.stats or args.stats_log:
+        metrics.enable(args.stats_log)
+
     root = tk.Tk()
-    app = ModuleTrackingGUI(root)
+    # One process at a time writes the local store (see `sync --pull`)
+    store_lock = FileLock(STORE_LOCK)
+    if not store_lock.acquire("Module Tracking System"):
+        root.withdraw()
+        messagebox.showerror("Error", f"The local module data is in use by {store_lock.holder()}. "
+                                      "Close it and start again.")
+        sys.exit(1)
+    app = ModuleTrackingGUI(root, fast_start=not args.full_start, storage=args.storage,
+                            station=args.station, header_max_age=args.header_max_age)
     root.mainloop()
+    metrics.close()